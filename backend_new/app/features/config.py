@@ -2,4 +2,3 @@
 
 MAX_CACHE_SIZE = 1000  # Maximum number of records allowed in cache
 CACHE_TTL = 900        # Cache validity duration in seconds
-RATE_LIMIT_CALLS = 5   # Maximum allowed API calls per minute
@@ -15,6 +15,8 @@ from fastapi import APIRouter, HTTPException, status
 from pyproj import CRS, Transformer
 from shapely.geometry import shape, Point
 
+from app.services.admission import guarded
+
 # --- Fixed import path for OWSException ---
 # --- Fixed import path for OWSException ---
 class OWSException(Exception):
@@ -25,8 +27,6 @@ class OWSException(Exception):
 # --- SECURITY CONFIGS ---
 MAX_CACHE_SIZE = 1000  # Prevent disk DoS
 CACHE_TTL = 900  # 15 minutes
-RATE_LIMIT_CALLS = 5  # per minute
-REQUEST_TIMESTAMPS = []  # Simple rate limiting
 
 # --- Paths (SECURITY: Path validation) ---
 BACKEND_DIR = Path(__file__).resolve().parents[2]
@@ -70,17 +70,6 @@ router = APIRouter(
     responses={404: {"description": "Not Found"}},
 )
 
-# --- Rate limiting ---
-def rate_limit_check() -> bool:
-    """Simple in-memory rate limiting (5 calls per minute)"""
-    global REQUEST_TIMESTAMPS
-    now = time.time()
-    REQUEST_TIMESTAMPS = [ts for ts in REQUEST_TIMESTAMPS if now - ts < 60]
-    if len(REQUEST_TIMESTAMPS) >= RATE_LIMIT_CALLS:
-        return False
-    REQUEST_TIMESTAMPS.append(now)
-    return True
-
 # --- Cache handling functions (SECURITY ENHANCED) ---
 def _cache_get(lat_key: float, lon_key: float) -> Optional[Dict[str, Any]]:
     """Retrieve weather data from cache if still valid. SECURITY: Size limits."""
@@ -188,12 +177,9 @@ async def ow_current(lat: float, lon: float) -> Dict[str, Any]:
 
 # --- Main endpoint (SECURITY ENHANCED) ---
 @router.get("/fire-weather")
+@guarded("medium")
 async def get_fire_weather_layer():
-    """SECURITY: Rate limited fire weather layer endpoint."""
-    
-    # SECURITY: Rate limiting
-    if not rate_limit_check():
-        raise HTTPException(status_code=429, detail="Rate limit exceeded (5/min)")
+    """Fire weather layer endpoint. SECURITY: Admission controlled (single-flight)."""
     
     gdf = None # Initialize gdf
 
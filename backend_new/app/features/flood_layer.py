@@ -8,12 +8,11 @@ import geopandas as gpd
 import numpy as np
 import logging
 
-from app.features.config import MAX_CACHE_SIZE, CACHE_TTL, RATE_LIMIT_CALLS
+from app.features.config import MAX_CACHE_SIZE, CACHE_TTL
+from app.services.admission import guarded
 
 
 CACHE_TTL = 600  # seconds
-RATE_LIMIT_CALLS = 5  # per minute
-REQUEST_TIMESTAMPS = []
 MAX_HOURS = 120
 MAX_FEATURES = 10000
 
@@ -67,16 +66,6 @@ DEFAULT_RAIN_W  = np.clip(DEFAULT_RAIN_W, 0.0, 1.0)
 # Simple Cache for Rainfall Data (SECURITY ENHANCED)
 # ------------------------------------------------------------
 _CACHE = {}
-def rate_limit_check() -> bool:
-    """Simple in-memory rate limiting"""
-    global REQUEST_TIMESTAMPS
-    now = time.time()
-    REQUEST_TIMESTAMPS = [ts for ts in REQUEST_TIMESTAMPS if now - ts < 60]
-    if len(REQUEST_TIMESTAMPS) >= RATE_LIMIT_CALLS:
-        return False
-    REQUEST_TIMESTAMPS.append(now)
-    return True
-
 def _cache_get(hours: int):
     """Retrieves data from cache if still valid. SECURITY: Size limit."""
     global _CACHE
@@ -134,6 +123,7 @@ def ensure_wgs84(gdf, default_src_epsg=32638):
 # Flood Layer Calculation Endpoint (FULLY SECURED)
 # ------------------------------------------------------------
 @router.get("/flood-risk", response_model=None)
+@guarded("medium")
 async def flood_risk(  # Made async for weather API compatibility
     # SECURITY: Strict bounds
     hours: int = Query(24, ge=3, le=MAX_HOURS, description="Forecast horizon in hours"),
@@ -143,11 +133,7 @@ async def flood_risk(  # Made async for weather API compatibility
     flag_w:  float = Query(None, ge=0.0, le=1.0),
     rain_w:  float = Query(None, ge=0.0, le=1.0),
 ):
-    """Calculates flood risk index. SECURITY: Rate limited + validated."""
-    
-    # SECURITY: Rate limiting
-    if not rate_limit_check():
-        raise HTTPException(429, "Rate limit exceeded (5/min)")
+    """Calculates flood risk index. SECURITY: Admission controlled + validated."""
     
     # SECURITY: Path validation
     if not PARCELS_BASE.exists():
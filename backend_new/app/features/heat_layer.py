@@ -5,11 +5,11 @@ import time, json, re, logging, numpy as np
 import geopandas as gpd
 from typing import Dict, Any
 
+from app.services.admission import guarded
+
 # SECURITY CONFIGS
 MAX_CACHE_SIZE = 10
 CACHE_TTL = 600  # 10 minutes
-RATE_LIMIT_CALLS = 5
-REQUEST_TIMESTAMPS = []
 MAX_FEATURES = 10000
 
 try:
@@ -41,19 +41,9 @@ HEAT_BASE = safe_path(OUT_DIR, "parcel_heat_from_api.geojson")
 PARCELS_FALLBACK = safe_path(DATA_DIR, "parcels_faizabad.geojson")
 
 # ------------------------------------------------------------
-# Rate limiting & Cache (SECURITY ENHANCED)
+# Cache (SECURITY ENHANCED)
 # ------------------------------------------------------------
 _CACHE = {}
-def rate_limit_check() -> bool:
-    """Simple in-memory rate limiting"""
-    global REQUEST_TIMESTAMPS
-    now = time.time()
-    REQUEST_TIMESTAMPS = [ts for ts in REQUEST_TIMESTAMPS if now - ts < 60]
-    if len(REQUEST_TIMESTAMPS) >= RATE_LIMIT_CALLS:
-        return False
-    REQUEST_TIMESTAMPS.append(now)
-    return True
-
 def _cache_get() -> Dict[str, Any] | None:
     """Retrieves data from cache if still valid. SECURITY: Size limit."""
     global _CACHE
@@ -130,12 +120,9 @@ def calculate_composite_risk(T: float, RH: float, W: float, WG: float, LST_est:
 # Main Endpoint (FULLY SECURED + ASYNC)
 # ------------------------------------------------------------
 @router.get("/heat-lst", response_model=None)
+@guarded("medium")
 async def heat_lst():
-    """Heat risk layer endpoint. SECURITY: Rate limited + validated."""
-    
-    # SECURITY: Rate limiting
-    if not rate_limit_check():
-        raise HTTPException(429, "Rate limit exceeded (5/min)")
+    """Heat risk layer endpoint. SECURITY: Admission controlled + validated."""
     
     # 1) Load Base Data (SECURITY: Path validated)
     if HEAT_BASE.exists():
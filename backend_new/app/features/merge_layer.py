@@ -8,15 +8,14 @@ import matplotlib.colors as mcolors
 import warnings
 import logging
 import re
-import time
+
+from app.services.admission import guarded
 
 warnings.filterwarnings("ignore")
 
 # SECURITY CONFIGS
 MAX_PAGE_SIZE = 1000
 MAX_FEATURES = 50000
-RATE_LIMIT_CALLS = 5
-REQUEST_TIMESTAMPS = []
 MAX_BBOX_SIZE = 100000  # degrees
 
 logger = logging.getLogger(__name__)
@@ -47,19 +46,6 @@ FIRE_FP1  = safe_path(OUT, "parcel_fire_prob.geojson")
 
 DEFAULT_WEIGHTS = {"flood": 0.30, "heat": 0.25, "quake": 0.25, "fire": 0.20}
 
-# ------------------------------------------------------------
-# Rate limiting
-# ------------------------------------------------------------
-def rate_limit_check() -> bool:
-    """Simple in-memory rate limiting"""
-    global REQUEST_TIMESTAMPS
-    now = time.time()
-    REQUEST_TIMESTAMPS = [ts for ts in REQUEST_TIMESTAMPS if now - ts < 60]
-    if len(REQUEST_TIMESTAMPS) >= RATE_LIMIT_CALLS:
-        return False
-    REQUEST_TIMESTAMPS.append(now)
-    return True
-
 # -----------------------------
 # Base functions (SECURITY ENHANCED)
 # -----------------------------
@@ -168,6 +154,7 @@ def extract_metric(base, fps, cols):
 # SECURITY ENHANCED Merge API
 # -----------------------------
 @router.get("/merge")
+@guarded("medium")
 def merge_map(
     bbox: str = Query(None, description="Optional bounding box as 'minx,miny,maxx,maxy'"),
     page: int = Query(1, ge=1, le=1000),
@@ -178,11 +165,7 @@ def merge_map(
     w_quake: float = Query(DEFAULT_WEIGHTS["quake"], ge=0.0, le=1.0),
     w_fire: float = Query(DEFAULT_WEIGHTS["fire"], ge=0.0, le=1.0)
 ):
-    """Merge risk map endpoint. SECURITY: Rate limited + validated."""
-    
-    # SECURITY: Rate limiting
-    if not rate_limit_check():
-        raise HTTPException(429, "Rate limit exceeded (5/min)")
+    """Merge risk map endpoint. SECURITY: Admission controlled + validated."""
     
     # Normalize weights
     wsum = w_flood + w_heat + w_quake + w_fire
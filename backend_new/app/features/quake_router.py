@@ -10,9 +10,9 @@ import geopandas as gpd
 from shapely.geometry import Point, Polygon
 from fastapi import HTTPException
 
+from app.services.admission import guarded
+
 # --- SECURITY CONFIGS ---
-RATE_LIMIT_CALLS = 5  # per minute
-REQUEST_TIMESTAMPS = []
 MAX_FEATURES = 1000  # USGS earthquakes per hour limit
 
 # --- Layer settings and parameters ---
@@ -39,19 +39,6 @@ COLOR_MAP = {
 
 logging.basicConfig(level=logging.INFO)
 
-# ------------------------------------------------------------
-# SECURITY: Rate limiting
-# ------------------------------------------------------------
-def rate_limit_check() -> bool:
-    """Simple in-memory rate limiting (5 calls per minute)"""
-    global REQUEST_TIMESTAMPS
-    now = time.time()
-    REQUEST_TIMESTAMPS = [ts for ts in REQUEST_TIMESTAMPS if now - ts < 60]
-    if len(REQUEST_TIMESTAMPS) >= RATE_LIMIT_CALLS:
-        return False
-    REQUEST_TIMESTAMPS.append(now)
-    return True
-
 def ensure_wgs84(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """Convert CRS to WGS84 if needed."""
     try:
@@ -82,9 +69,6 @@ def fetch_and_process_usgs_data() -> gpd.GeoDataFrame:
     Fetch USGS API, filter by BBOX and convert to GeoDataFrame.
     SECURITY: Request limits + timeout.
     """
-    if not rate_limit_check():
-        raise HTTPException(status_code=429, detail="Rate limit exceeded (5/min)")
-    
     logging.info(f"Fetching data from USGS API for the last 24 hours...")
     
     # Define structure for empty GeoDataFrame
@@ -233,10 +217,9 @@ from fastapi import APIRouter
 router = APIRouter(prefix="/api", tags=["layers"])
 
 @router.get("/quake")
+@guarded("medium")
 async def get_quake_layer():
     """Earthquake layer endpoint for QuakeLayer component."""
-    if not rate_limit_check():
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
     return process_quake_layer()
 
 # --- Test example ---
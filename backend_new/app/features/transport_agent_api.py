@@ -1,25 +1,37 @@
 # backend/app/features/transport_agent_api.py
 
 from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import os
-import sys
+import io
 import json
-import shutil
-import subprocess
 import time
-import gc
 import datetime as dt
 import re
-import signal
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from typing import List, Tuple, Optional
-from contextlib import contextmanager
 
+import numpy as np
+import pandas as pd
 import geopandas as gpd
 import networkx as nx
-import fiona
-from shapely.geometry import LineString, Point, Polygon, MultiPolygon, GeometryCollection
-from shapely.ops import unary_union
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyogrio
+import shapely
+from pyproj import CRS, Transformer
+from shapely.geometry import LineString, Point, MultiPolygon, GeometryCollection
+from shapely.ops import substring
+
+from app.services.admission import Overloaded, guarded
+from app.src import simulate_agent
+from app.src.road_network import (
+    MAX_ROUTING_WORKERS, ROUTING_BACKENDS, CompiledGraph, CoverIndex, NodeIndex, compile_graph, file_digest,
+    load_bundle, build_topology, contract_degree2, parallel_shortest_paths, save_bundle, shortest_paths_from,
+)
 
 router = APIRouter(prefix="/transport", tags=["Transport"])
 
@@ -36,11 +48,72 @@ OUT_DIR = os.path.join(BASE_DIR, "output")             # backend/app/output (opt
 # ─────────────────────────────────────────────
 # Security configurations
 # ─────────────────────────────────────────────
-MAX_PAIRS_LIMIT = 50
+MAX_PAIRS_LIMIT = int(os.environ.get("TRANSPORT_MAX_PAIRS", 50))  # raise for batch jobs
 MAX_ALPHA_LIMIT = 1.0
-SUBPROCESS_TIMEOUT = 30  # seconds
-RATE_LIMIT_CALLS = 5  # per minute (simplified counter)
-REQUEST_TIMESTAMPS = []  # Simple rate limiting store
+MAX_ISO_SEEDS = 50
+MAX_ISO_BANDS = 10
+MAX_ISO_METERS = 20000.0
+WALK_SPEED_MPS = 1.3  # minutes → weighted meters for /isochrone and /od-matrix
+MAX_OD_CELLS = int(os.environ.get("TRANSPORT_MAX_OD_CELLS", 2_000_000))  # origins × destinations
+MAX_OD_ROUTES = 2000  # pairs with geometry when /od-matrix?routes=true
+BACKEND_PATTERN = "^(" + "|".join(ROUTING_BACKENDS) + ")$"
+SIM_TIMEOUT = 30  # seconds
+SIM_WORKERS = 2
+
+# ─────────────────────────────────────────────
+# Road graph cache (keyed by input file hashes)
+# ─────────────────────────────────────────────
+GRAPH_CACHE_SIZE = 4
+NETWORK_INPUTS = ["roads", "nodes", "origins", "destinations", "vegetation", "buildings"]
+TOPOLOGY_SNAP_M = 0.5  # road endpoints closer than this become one node
+TOPOLOGY_NODE_CROSSINGS = True  # split roads where they cross (False: connect at endpoints only)
+TOPOLOGY_LEVEL_COLUMNS = ["layer", "level"]  # numeric road level; crossings only split within a level
+TOPOLOGY_BRIDGE_COLUMNS = {"bridge": 1, "tunnel": -1}  # fallback level from yes/no flags
+_GRAPH_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+_GRAPH_LOCK = threading.Lock()
+_HASH_MEMO: dict = {}  # path → (mtime_ns, size, sha1)
+# Compiled network artifact (reloaded instead of rebuilt while the input hashes match; "" disables)
+NETWORK_BUNDLE = os.environ.get("TRANSPORT_NETWORK_BUNDLE", os.path.join(OUT_DIR, "transport_network.npz"))
+SIM_NETWORK_BUNDLE = os.environ.get("TRANSPORT_SIM_NETWORK_BUNDLE", os.path.join(OUT_DIR, "sim_network.npz"))
+_TO_WGS84 = Transformer.from_crs(3857, 4326, always_xy=True)
+_TO_METRIC = Transformer.from_crs(4326, 3857, always_xy=True)
+_TO_WGS84_FROM: dict = {}  # source CRS string → Transformer (GPKG layers)
+# routes_final attributes the map reads; other columns are never loaded
+ROUTE_COLUMNS = ("Id", "agentId", "agent_class")
+
+# Warm simulate_agent networks (keyed by input hashes) and its worker pool
+_SIM_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_SIM_LOCK = threading.Lock()
+_SIM_POOL = ThreadPoolExecutor(max_workers=SIM_WORKERS, thread_name_prefix="simulate-agent")
+# One slot per pool thread, released only when a run really finishes: a timed-out run keeps its
+# slot, so new work is refused (503) instead of queueing behind it and timing out in turn
+_SIM_SLOTS = threading.BoundedSemaphore(SIM_WORKERS)
+_GPKG_LOCK = threading.Lock()  # concurrent runs take turns writing results.gpkg
+
+# ─────────────────────────────────────────────
+# Hazard exposure per edge (parcel risk layers in OUT_DIR, joined once per file version)
+# ─────────────────────────────────────────────
+HAZARD_LAYERS = {
+    "flood": ("parcel_flood_risk.geojson", "risk_flood"),
+    "heat": ("parcel_heat_risk.geojson", "heat_risk"),
+    "fire": ("parcel_fire_prob.geojson", "fire_prob"),
+    "quake": ("parcel_quake_risk.geojson", "risk_quake"),
+    "merge": ("parcel_vulnerability.geojson", "vulnerability"),
+}
+HAZARD_BUF_M = 12.0  # roads run between parcels: parcels within this distance expose the edge
+MAX_HAZARD_COEFF = 5.0
+HAZARD_CACHE_SIZE = 16
+_HAZARD_CACHE: "OrderedDict[str, Optional[np.ndarray]]" = OrderedDict()  # None = layer has no risk column
+
+# ─────────────────────────────────────────────
+# Route result cache (finished routes_final per tab + weighting, keyed by data stamp)
+# ─────────────────────────────────────────────
+ROUTE_CACHE_SIZE = int(os.environ.get("TRANSPORT_ROUTE_CACHE", 64))
+ROUTE_CACHE_DIR = os.environ.get("TRANSPORT_ROUTE_CACHE_DIR", "")  # empty = memory only
+_ROUTE_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+_ROUTE_LOCK = threading.Lock()
+_ROUTE_STATS = {"hits": 0, "misses": 0, "disk_hits": 0, "invalidations": 0}
+_ROUTE_STAMP: Optional[str] = None  # network version + weather hash the cache was filled for
 
 # ─────────────────────────────────────────────
 # General utilities (SECURITY ENHANCED)
@@ -80,22 +153,6 @@ def _find_data_file(basename: str) -> str:
             return p
     raise FileNotFoundError(f"Missing data file: {basename} (tried: {', '.join(candidates)})")
 
-def _copy(src: str, dst: str) -> None:
-    src_real = os.path.realpath(src)
-    dst_real = os.path.realpath(dst)
-    base_real = os.path.realpath(BASE_DIR)
-    if not (src_real.startswith(base_real) and dst_real.startswith(base_real)):
-        raise ValueError("Path traversal attempt detected")
-    shutil.copyfile(src, dst)
-
-def _write_empty_fc(dst: str) -> None:
-    dst_real = os.path.realpath(dst)
-    base_real = os.path.realpath(BASE_DIR)
-    if not dst_real.startswith(base_real):
-        raise ValueError("Invalid output path")
-    with open(dst, "w", encoding="utf-8") as f:
-        json.dump({"type": "FeatureCollection", "features": []}, f, ensure_ascii=False)
-
 def _read_fc(name_base: str) -> gpd.GeoDataFrame:
     """Read feature collection from DATA_DIR with support for geojson/json/gpkg"""
     p = _find_data_file(name_base)
@@ -127,12 +184,40 @@ def _to_metric(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
 def _to_wgs84(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     return gdf.to_crs(4326)
 
+def _lines_to_wgs84(lines: List[LineString]) -> List[List[List[float]]]:
+    """
+    Metric (3857) LineStrings → [lon, lat] coordinate lists, reprojected together:
+    coordinates of all lines are concatenated, transformed in one call and split back.
+    """
+    if not lines:
+        return []
+    xy = shapely.get_coordinates(lines)
+    lon, lat = _TO_WGS84.transform(xy[:, 0], xy[:, 1])
+    ll = np.column_stack([lon, lat]).tolist()
+    ends = np.cumsum(shapely.get_num_coordinates(lines)).tolist()
+    return [ll[a:b] for a, b in zip([0] + ends[:-1], ends)]
+
 def _explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """MultiLine → Line and remove empty geometries"""
     gdf = gdf[gdf.geometry.notna()].copy()
     gdf = gdf.explode(index_parts=False, ignore_index=True)
     return gdf[gdf.geometry.type.isin(["LineString"])].reset_index(drop=True)
 
+def _road_levels(roads: gpd.GeoDataFrame) -> Optional[np.ndarray]:
+    """Per-road level for build_topology (None when the data has no level/bridge attribute)"""
+    cols = {str(c).lower(): c for c in roads.columns}
+    for name in TOPOLOGY_LEVEL_COLUMNS:
+        if name in cols:
+            return pd.to_numeric(roads[cols[name]], errors="coerce").fillna(0).to_numpy(dtype="float64")
+    flags = [(cols[name], lv) for name, lv in TOPOLOGY_BRIDGE_COLUMNS.items() if name in cols]
+    if not flags:
+        return None
+    level = np.zeros(len(roads))
+    for col, lv in flags:
+        on = roads[col].astype(str).str.strip().str.lower().isin(["yes", "true", "1", "y"])
+        level[on.to_numpy()] = lv
+    return level
+
 def _err_response(status: int, error: Exception, endpoint: str, extra: Optional[dict] = None) -> JSONResponse:
     """Structured error response for easy frontend consumption. SECURITY: No stack traces in production"""
     if status == 500:
@@ -151,91 +236,36 @@ def _err_response(status: int, error: Exception, endpoint: str, extra: Optional[
     return JSONResponse(status_code=status, content=payload)
 
 # ─────────────────────────────────────────────
-# Simple rate limiting
-# ─────────────────────────────────────────────
-def rate_limit_check() -> bool:
-    """Simple in-memory rate limiting (5 calls per minute)"""
-    global REQUEST_TIMESTAMPS
-    now = time.time()
-    # Keep only timestamps from last minute
-    REQUEST_TIMESTAMPS = [ts for ts in REQUEST_TIMESTAMPS if now - ts < 60]
-    if len(REQUEST_TIMESTAMPS) >= RATE_LIMIT_CALLS:
-        return False
-    REQUEST_TIMESTAMPS.append(now)
-    return True
-
-# ─────────────────────────────────────────────
-# Subprocess timeout handler
+# simulate_agent engine (in-process, warm network)
 # ─────────────────────────────────────────────
-@contextmanager
-def timeout(seconds):
-    def timeout_handler(signum, frame):
-        raise TimeoutError("Subprocess execution timeout")
-    
-    old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(seconds)
-    try:
-        yield
-    finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old_handler)
-
-# ─────────────────────────────────────────────
-# Execute simulate_agent.py (SECURITY ENHANCED)
-# ─────────────────────────────────────────────
-def _prepare_inputs_for_sim() -> None:
+def _routes_fc(gdf: gpd.GeoDataFrame) -> dict:
+    """Routes GeoDataFrame → FeatureCollection (WGS84)"""
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(4326)
+    return json.loads(gdf.to_json())
+
+def _wgs84_transformer(crs: str) -> Optional[Transformer]:
+    """Transformer crs → WGS84 (None when crs already is WGS84)"""
+    if crs not in _TO_WGS84_FROM:
+        wgs84 = CRS.from_user_input(crs).to_epsg() == 4326
+        _TO_WGS84_FROM[crs] = None if wgs84 else Transformer.from_crs(crs, 4326, always_xy=True)
+    return _TO_WGS84_FROM[crs]
+
+def _nan_to_null(table: pa.Table) -> pa.Table:
+    """NaN in float columns → null, so properties encode as JSON null rather than invalid NaN"""
+    for i, f in enumerate(table.schema):
+        if pa.types.is_floating(f.type):
+            col = table.column(i)
+            table = table.set_column(i, f, pc.if_else(pc.is_nan(col), pa.scalar(None, f.type), col))
+    return table
+
+def _routes_fc_from_gpkg(gpkg_path: str) -> bytes:
     """
-    Copies files from app/data to app/src/data with standard simulate_agent.py names.
-    Supports names: roads, nodes/nods, origins, destinations, vegetation, buildings.
+    Read routes_final from GPKG as an encoded FeatureCollection (WGS84).
+    Columnar read (Arrow) of ROUTE_COLUMNS + geometry only, one vectorized reprojection over all
+    coordinates, and GEOS-side GeoJSON encoding of geometries, so no GeoDataFrame or JSON string
+    round trip is built on the way to the response body.
     """
-    _ensure_dirs()
-
-    # nodes or nods
-    nodes_base = "nodes"
-    if not os.path.exists(os.path.join(DATA_DIR, "nodes")) and not os.path.exists(os.path.join(DATA_DIR, "nodes.geojson")):
-        nodes_base = "nods"
-
-    # Required files
-    roads_in = _find_data_file("roads")
-    nodes_in = _find_data_file(nodes_base)
-    origins_in = _find_data_file("origins")
-    destinations_in = _find_data_file("destinations")
-
-    # Optional files
-    try:
-        vegetation_in = _find_data_file("vegetation")
-    except FileNotFoundError:
-        vegetation_in = None
-    try:
-        buildings_in = _find_data_file("buildings")
-    except FileNotFoundError:
-        buildings_in = None
-
-    # Standard destinations for simulate_agent.py
-    roads_dst = os.path.join(SRC_DATA, "roads.geojson")
-    nodes_dst = os.path.join(SRC_DATA, "nodes.geojson")
-    origins_dst = os.path.join(SRC_DATA, "origins.geojson")
-    destinations_dst = os.path.join(SRC_DATA, "destinations.geojson")
-    vegetation_dst = os.path.join(SRC_DATA, "vegetation.geojson")
-    buildings_dst = os.path.join(SRC_DATA, "buildings.geojson")
-
-    _copy(roads_in, roads_dst)
-    _copy(nodes_in, nodes_dst)
-    _copy(origins_in, origins_dst)
-    _copy(destinations_in, destinations_dst)
-
-    if vegetation_in:
-        _copy(vegetation_in, vegetation_dst)
-    else:
-        _write_empty_fc(vegetation_dst)
-
-    if buildings_in:
-        _copy(buildings_in, buildings_dst)
-    else:
-        _write_empty_fc(buildings_dst)
-
-def _routes_fc_from_gpkg(gpkg_path: str) -> dict:
-    """Read routes_final layer from GPKG and return as FeatureCollection (WGS84) with safe file handle closing"""
     gpkg_real = os.path.realpath(gpkg_path)
     src_out_real = os.path.realpath(SRC_OUT)
     data_real = os.path.realpath(DATA_DIR)
@@ -246,171 +276,300 @@ def _routes_fc_from_gpkg(gpkg_path: str) -> dict:
     if not os.path.exists(gpkg_path):
         raise FileNotFoundError(f"Output file not found: {gpkg_path}")
 
-    with fiona.open(gpkg_path, layer="routes_final") as src:
-        gdf = gpd.GeoDataFrame.from_features(src, crs=src.crs)
-        if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
-            gdf = gdf.to_crs(4326)
-        return json.loads(gdf.to_json())
-
-def _run_simulate_agent() -> None:
-    """Execute simulate_agent.py from inside src (no arguments) and handle Windows file locks + SECURITY timeout"""
-    script_path = os.path.join(SRC_DIR, "simulate_agent.py")
-    script_real = os.path.realpath(script_path)
-    src_real = os.path.realpath(SRC_DIR)
-    
-    if not os.path.exists(script_path) or not script_real.startswith(src_real):
-        raise FileNotFoundError(f"Script not found or invalid path: {script_path}")
+    fields = set(pyogrio.read_info(gpkg_path, layer="routes_final")["fields"])
+    columns = [c for c in ROUTE_COLUMNS if c in fields]
+    meta, table = pyogrio.read_arrow(gpkg_path, layer="routes_final", columns=columns)
 
-    # Before execution, try to release lock and remove previous file
-    gpkg = os.path.join(SRC_OUT, "results.gpkg")
-    try:
-        gc.collect()
-        if os.path.exists(gpkg):
-            removed = False
-            for _ in range(12):  # up to ~2.4s with 0.2s intervals
-                try:
-                    os.remove(gpkg)
-                    removed = True
-                    break
-                except PermissionError:
-                    time.sleep(0.2)
-            if not removed and os.path.exists(gpkg):
-                # If still locked, rename so simulate_agent can unlink
-                backup = gpkg.replace(".gpkg", f".bak.{int(time.time())}.gpkg")
-                try:
-                    os.replace(gpkg, backup)
-                except Exception:
-                    pass
-    except Exception:
-        pass
+    geoms = shapely.from_wkb(table.column(meta["geometry_name"] or "wkb_geometry").to_numpy(zero_copy_only=False))
+    tr = _wgs84_transformer(meta["crs"]) if meta["crs"] else None
+    if tr is not None:
+        geoms = shapely.transform(geoms, lambda xy: np.column_stack(tr.transform(xy[:, 0], xy[:, 1])))
 
-    env = {**os.environ, "PYTHONIOENCODING": "utf-8"}
-    
-    # SECURITY: Timeout protection
+    geom_json = shapely.to_geojson(geoms)
+    props = _nan_to_null(table.select(columns)).to_pylist()
+    features = ",".join(
+        '{"type":"Feature","properties":%s,"geometry":%s}' % (json.dumps(p, allow_nan=False), g if g is not None else "null")
+        for p, g in zip(props, geom_json)
+    )
+    return ('{"type":"FeatureCollection","features":[' + features + "]}").encode()
+
+def _get_sim_network() -> tuple:
+    """(SimInputs, SimNetwork) for the current input files, built once per data version"""
+    sources = _network_sources()
+    key = _network_version(sources)
+    with _SIM_LOCK:
+        hit = _SIM_CACHE.get(key)
+        if hit is not None:
+            _SIM_CACHE.move_to_end(key)
+            return hit
+        inputs = simulate_agent.load_inputs(sources, temp_c=25.0)
+        hit = (inputs, simulate_agent.prepare_network(inputs, SIM_NETWORK_BUNDLE or None))
+        _SIM_CACHE[key] = hit
+        while len(_SIM_CACHE) > GRAPH_CACHE_SIZE:
+            _SIM_CACHE.popitem(last=False)
+        return hit
+
+def _submit_simulation(classes: Optional[List[str]]):
+    """Future of _simulate_routes, or Overloaded (→ 503 + Retry-After) while every pool thread is busy"""
+    if not _SIM_SLOTS.acquire(blocking=False):
+        raise Overloaded("simulation")
     try:
-        with timeout(SUBPROCESS_TIMEOUT):
-            proc = subprocess.run(
-                [sys.executable, script_path],
-                cwd=SRC_DIR,
-                check=False,
-                capture_output=True,
-                text=True,
-                env=env,
-                timeout=SUBPROCESS_TIMEOUT,  # Double protection
-            )
-    except TimeoutError:
-        raise RuntimeError("Subprocess execution timeout exceeded")
-    except subprocess.TimeoutExpired:
-        raise RuntimeError("Subprocess execution timeout exceeded")
-    
-    if proc.returncode != 0:
-        raise RuntimeError(
-            "Python script failed (simulate_agent.py)\n"
-            f"STDOUT:\n{proc.stdout[:1000]}\n\nSTDERR:\n{proc.stderr[:1000]}"  # Truncated output
-        )
+        fut = _SIM_POOL.submit(_simulate_routes, classes)
+    except BaseException:
+        _SIM_SLOTS.release()
+        raise
+    fut.add_done_callback(lambda _: _SIM_SLOTS.release())
+    return fut
+
+def _simulate_routes(classes: Optional[List[str]] = None) -> tuple:
+    inputs, network = _get_sim_network()
+    # Weather only re-derives the edge cost array; the warm network is reused as is
+    temp_c = float(_read_weather().get("temp_c", 25.0))
+    routes = simulate_agent.compute_routes(
+        network, inputs.origins, inputs.destinations, temp_c=temp_c, verbose=False, classes=classes,
+    )
+    return inputs, network, routes
 
 # ─────────────────────────────────────────────
-# Build weighted graph (dynamic based on weather/buildings) - UNCHANGED
+# Road graph: geometry-only part (cached) + per-request weights
 # ─────────────────────────────────────────────
-def _build_graph_weighted(
+def _build_graph_base(
     roads_m: gpd.GeoDataFrame,
-    veg_u: Optional[Polygon],
-    bldg_u: Optional[Polygon],
+    veg_m: Optional[gpd.GeoSeries],
+    bldg_m: Optional[gpd.GeoSeries],
+    shade_buf_m: float = 0.8,
+    bldg_buf_m: float = 6.0,
+) -> Tuple[nx.Graph, dict]:
+    """
+    Topology + per-edge geometric attributes, independent of weather and alpha parameters.
+    Nodes are integer ids (attributes x/y) from build_topology: lines are split at crossings and
+    endpoints within TOPOLOGY_SNAP_M merge;
+    a layer/level or bridge/tunnel column keeps roads on different levels from joining at crossings. Each edge carries an integer `eid` indexing the
+    returned arrays (length/shade/near_b); ratios come from indexed intersections with buffers.
+    """
+    topo = build_topology(
+        roads_m.geometry.values,
+        snap_tol=TOPOLOGY_SNAP_M,
+        node_crossings=TOPOLOGY_NODE_CROSSINGS,
+        levels=_road_levels(roads_m),
+    )
+    edge_geoms = topo.edge_geoms
+
+    G = nx.Graph()
+    G.add_nodes_from((i, {"x": x, "y": y}) for i, (x, y) in enumerate(topo.xy.tolist()))
+    lengths = shapely.length(edge_geoms)
+    G.add_edges_from(
+        (u, v, {"eid": k, "length": length, "geometry": geom})
+        for k, (u, v, length, geom) in enumerate(zip(
+            topo.edge_u.tolist(), topo.edge_v.tolist(), lengths.tolist(), edge_geoms))
+    )
+
+    arrays = {
+        "length": np.asarray(lengths, dtype="float64"),
+        "shade_ratio": CoverIndex(veg_m, shade_buf_m).ratios(edge_geoms),
+        "near_b_ratio": CoverIndex(bldg_m, bldg_buf_m).ratios(edge_geoms),
+    }
+    return G, arrays
+
+def _edge_weights(
+    arrays: dict,
     temp_c: float,
     alpha_build_base: float = 0.05,
     alpha_build_heat_coeff: float = 0.02,
-    shade_buf_m: float = 0.8,
-    bldg_buf_m: float = 6.0,
-) -> nx.Graph:
+) -> np.ndarray:
     """
     Edge weight = length × (1 - alpha_shade * shade_ratio) × (1 - alpha_build * near_b_ratio)
     - Shade effect temperature-dependent (heat_scale)
     - Building effect dynamic: alpha_build = alpha_build_base + alpha_build_heat_coeff * heat_scale
     """
-    G = nx.Graph()
     heat_scale = max(0.0, (temp_c - 26.0) / 10.0)  # if 36°C → 1.0
     alpha_shade = 0.25 + 0.25 * heat_scale
     alpha_build = max(0.0, alpha_build_base + alpha_build_heat_coeff * heat_scale)
 
-    # Prepare buffers
-    veg_u_buf = None
-    if veg_u:
+    length = arrays["length"]
+    weight = length * (1.0 - alpha_shade * arrays["shade_ratio"]) * (1.0 - alpha_build * arrays["near_b_ratio"])
+    return np.maximum(length * 0.1, weight)  # Safe floor
+
+def _weight_fn(w: np.ndarray):
+    """networkx weight callable reading the per-request weight vector"""
+    return lambda u, v, d: w[d["eid"]]
+
+def _file_hash(path: str) -> str:
+    """sha1 of file content, re-hashed only when mtime/size change"""
+    st = os.stat(path)
+    memo = _HASH_MEMO.get(path)
+    if memo and memo[0] == st.st_mtime_ns and memo[1] == st.st_size:
+        return memo[2]
+    digest = file_digest(path)
+    _HASH_MEMO[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+def _network_sources() -> dict:
+    """Input files of the transport network (None for missing optional layers)"""
+    sources = {}
+    for name in NETWORK_INPUTS:
         try:
-            if hasattr(veg_u, "geoms"):
-                veg_u_buf = unary_union([g.buffer(shade_buf_m) for g in veg_u.geoms])
+            sources[name] = _find_data_file(name)
+        except FileNotFoundError:
+            if name == "nodes":
+                sources[name] = _find_data_file("nods")
+            elif name in ("vegetation", "buildings"):
+                sources[name] = None
             else:
-                veg_u_buf = veg_u.buffer(shade_buf_m)
-        except Exception:
-            veg_u_buf = None
+                raise
+    return sources
+
+def _network_version(sources: dict) -> str:
+    h = hashlib.sha1()
+    for name in NETWORK_INPUTS:
+        p = sources.get(name)
+        h.update(f"{name}:{_file_hash(p) if p else '-'};".encode())
+    h.update(f"topology:{TOPOLOGY_SNAP_M}:{TOPOLOGY_NODE_CROSSINGS}:{TOPOLOGY_LEVEL_COLUMNS}:{TOPOLOGY_BRIDGE_COLUMNS}".encode())
+    return h.hexdigest()
+
+def _build_network(sources: dict) -> dict:
+    """Read inputs and build the weather-independent network (the expensive part)"""
+    roads = gpd.read_file(sources["roads"])
+    origins = gpd.read_file(sources["origins"])
+    dests = gpd.read_file(sources["destinations"])
+
+    veg_m = None
+    bldg_m = None
+    try:
+        if sources["vegetation"]:
+            vegetation = gpd.read_file(sources["vegetation"])
+            if not vegetation.empty:
+                veg_m = _to_metric(vegetation).geometry
+    except Exception:
+        pass
+    try:
+        if sources["buildings"]:
+            buildings = gpd.read_file(sources["buildings"])
+            if not buildings.empty:
+                bldg_m = _to_metric(buildings).geometry
+    except Exception:
+        pass
 
-    bldg_u_buf = None
-    if bldg_u:
-        try:
-            bldg_u_buf = bldg_u.buffer(bldg_buf_m)
-        except Exception:
-            bldg_u_buf = None
-
-    for _, row in roads_m.iterrows():
-        geom: LineString = row.geometry
-        if geom is None or geom.is_empty or geom.geom_type != "LineString":
-            continue
-
-        coords = list(geom.coords)
-        if len(coords) < 2:
-            continue
-
-        (x1, y1), (x2, y2) = coords[0], coords[-1]
-        u = (round(x1, 3), round(y1, 3))
-        v = (round(x2, 3), round(y2, 3))
-        length = geom.length
-        if length <= 0:
-            continue
-
-        # Shade length ratio
-        shade_ratio = 0.0
-        if veg_u_buf:
-            try:
-                inter = geom.intersection(veg_u_buf)
-                shade_ratio = max(0.0, min(1.0, inter.length / length))
-            except Exception:
-                shade_ratio = 0.0
+    roads_m = _to_metric(_explode_lines(roads))
+    G, arrays = _build_graph_base(roads_m, veg_m, bldg_m)
+    _node_index(G)
 
-        # Near-building length ratio
-        near_b_ratio = 0.0
-        if bldg_u_buf:
-            try:
-                inter_b = geom.intersection(bldg_u_buf)
-                near_b_ratio = max(0.0, min(1.0, inter_b.length / length))
-            except Exception:
-                near_b_ratio = 0.0
-
-        weight = length * (1.0 - alpha_shade * shade_ratio) * (1.0 - alpha_build * near_b_ratio)
-        weight = max(length * 0.1, weight)  # Safe floor
-
-        if u not in G:
-            G.add_node(u, x=u[0], y=u[1])
-        if v not in G:
-            G.add_node(v, x=v[0], y=v[1])
-        G.add_edge(u, v, length=length, weight=weight, geometry=geom)
-
-    return G
-
-def _nearest_graph_node(G: nx.Graph, pt: Point) -> Tuple[float, float]:
-    """Nearest graph node to point (simple search)"""
-    best = None
-    best_d = 1e18
-    x, y = pt.x, pt.y
-    for n, data in G.nodes(data=True):
-        dx = data["x"] - x
-        dy = data["y"] - y
-        d2 = dx * dx + dy * dy
-        if d2 < best_d:
-            best_d = d2
-            best = n
-    return best
-
-def _path_geom_from_nodes(G: nx.Graph, nodes_seq: List[Tuple[float, float]]) -> LineString:
-    """Connect edge geometries based on node sequence"""
+    return {
+        "G": G,
+        "arrays": arrays,
+        "origins": list(_to_metric(origins).geometry),
+        "destinations": list(_to_metric(dests).geometry),
+    }
+
+def _save_network(path: str, version: str, net: dict) -> None:
+    """Write the weather-independent network as a compiled bundle (edges in eid order)"""
+    G = net["G"]
+    pos = {n: i for i, n in enumerate(G.nodes)}
+    node_xy = np.array([(d["x"], d["y"]) for _, d in G.nodes(data=True)], dtype="float64").reshape(-1, 2)
+    m = len(net["arrays"]["length"])
+    edge_u = np.empty(m, dtype=np.int64)
+    edge_v = np.empty(m, dtype=np.int64)
+    geoms = np.empty(m, dtype=object)
+    for u, v, d in G.edges(data=True):
+        k = d["eid"]
+        edge_u[k], edge_v[k], geoms[k] = pos[u], pos[v], d["geometry"]
+    save_bundle(path, version, {
+        "node_xy": node_xy,
+        "edge_u": edge_u,
+        "edge_v": edge_v,
+        **net["arrays"],
+    }, {"edges": geoms, "origins": net["origins"], "destinations": net["destinations"]})
+
+def _load_network(path: str, version: str) -> Optional[dict]:
+    """Network from a compiled bundle of the same input version (None when absent/stale)"""
+    bundle = load_bundle(path, version)
+    if bundle is None:
+        return None
+    a, g = bundle
+    G = nx.Graph()
+    G.add_nodes_from((i, {"x": x, "y": y}) for i, (x, y) in enumerate(a["node_xy"].tolist()))
+    # eid order reproduces the original insertion order (and so the adjacency order)
+    length = a["length"]
+    G.add_edges_from(
+        (u, v, {"eid": k, "length": float(length[k]), "geometry": geom})
+        for k, (u, v, geom) in enumerate(zip(a["edge_u"].tolist(), a["edge_v"].tolist(), g["edges"]))
+    )
+    _node_index(G)
+    return {
+        "G": G,
+        "arrays": {k: a[k] for k in ("length", "shade_ratio", "near_b_ratio")},
+        "origins": list(g["origins"]),
+        "destinations": list(g["destinations"]),
+    }
+
+def build_network_bundle() -> str:
+    """Build step: compile the current inputs into NETWORK_BUNDLE (skipped when up to date)"""
+    sources = _network_sources()
+    version = _network_version(sources)
+    if load_bundle(NETWORK_BUNDLE, version) is None:
+        _save_network(NETWORK_BUNDLE, version, _build_network(sources))
+    return NETWORK_BUNDLE
+
+def _get_network() -> Tuple[dict, str]:
+    """Cached network for the current input files; rebuilt only when a file hash changes"""
+    sources = _network_sources()
+    version = _network_version(sources)
+    with _GRAPH_LOCK:
+        net = _GRAPH_CACHE.get(version)
+        if net is not None:
+            _GRAPH_CACHE.move_to_end(version)
+            return net, version
+        net = _load_network(NETWORK_BUNDLE, version) if NETWORK_BUNDLE else None
+        if net is None:
+            net = _build_network(sources)
+            if NETWORK_BUNDLE:
+                try:
+                    _save_network(NETWORK_BUNDLE, version, net)
+                except OSError:
+                    pass  # read-only deployments just keep the in-memory copy
+        _GRAPH_CACHE[version] = net
+        while len(_GRAPH_CACHE) > GRAPH_CACHE_SIZE:
+            _GRAPH_CACHE.popitem(last=False)
+        return net, version
+
+def _compiled(net: dict) -> dict:
+    """
+    CSR form of a cached network (compiled once, on first use by the csr backend), plus its
+    degree-2 contraction ("core") that point-to-point / pair / matrix searches run on
+    """
+    with _GRAPH_LOCK:
+        csr = net.get("csr")
+        if csr is None:
+            cg, edge_data = compile_graph(net["G"], lambda n, d: (d["x"], d["y"]))
+            csr = {
+                "graph": cg,
+                "core": contract_degree2(cg),
+                "eid": np.array([d["eid"] for d in edge_data], dtype=np.int64),
+                "pos": cg.node_pos(),
+            }
+            net["csr"] = csr
+        return csr
+
+def _node_index(G: nx.Graph) -> NodeIndex:
+    """Spatial index over graph nodes, built once per graph and stored on G.graph"""
+    idx = G.graph.get("node_index")
+    if idx is None or len(idx) != G.number_of_nodes():
+        nodes = list(G.nodes)
+        xy = [(G.nodes[n]["x"], G.nodes[n]["y"]) for n in nodes]
+        idx = NodeIndex(nodes, xy)
+        G.graph["node_index"] = idx
+    return idx
+
+def snap_points(G: nx.Graph, points) -> List[Optional[int]]:
+    """Nearest graph node for every point, resolved in one vectorized query"""
+    return _node_index(G).snap_points(points)
+
+def _nearest_graph_node(G: nx.Graph, pt: Point) -> int:
+    """Nearest graph node to a single point"""
+    return snap_points(G, [pt])[0]
+
+def _path_lines_from_nodes(G: nx.Graph, nodes_seq: List[int]) -> List[LineString]:
+    """Edge geometries along a node sequence"""
     lines: List[LineString] = []
     for i in range(len(nodes_seq) - 1):
         u = nodes_seq[i]
@@ -419,7 +578,11 @@ def _path_geom_from_nodes(G: nx.Graph, nodes_seq: List[Tuple[float, float]]) ->
         geom = data.get("geometry") if isinstance(data, dict) else None
         if geom is not None:
             lines.append(geom)
+    return lines
 
+def _stitch_lines(lines: List[LineString]) -> LineString:
+    """Connect consecutive edge geometries into one LineString"""
+    lines = [ln for ln in lines if ln is not None]
     if not lines:
         return LineString()
 
@@ -431,22 +594,94 @@ def _path_geom_from_nodes(G: nx.Graph, nodes_seq: List[Tuple[float, float]]) ->
         coords.extend(cs[1:])
     return LineString(coords)
 
+def _path_geom_from_nodes(G: nx.Graph, nodes_seq: List[int]) -> LineString:
+    """Connect edge geometries based on node sequence"""
+    return _stitch_lines(_path_lines_from_nodes(G, nodes_seq))
+
+def _route_pairs(
+    net: dict,
+    w: np.ndarray,
+    o_nodes: list,
+    d_nodes: list,
+    backend: str = "networkx",
+    workers: int = 0,
+) -> List[Optional[List[LineString]]]:
+    """
+    Edge geometries of the weighted shortest path for every (origin, destination) pair.
+    One search per unique origin serves all of its destinations. Connectivity does not
+    depend on the weighting, so a pair without a weighted path has no length-only path either.
+    workers > 1 routes disjoint OD batches in worker processes over the shared-memory CSR graph.
+    """
+    n = len(o_nodes)
+    out: List[Optional[List[LineString]]] = [None] * n
+    ok = [i for i in range(n) if o_nodes[i] is not None and d_nodes[i] is not None]
+
+    if backend == "csr" or workers > 1:
+        csr = _compiled(net)
+        cg: CompiledGraph = csr["graph"]
+        pos = csr["pos"]
+        sources = [pos[o_nodes[i]] for i in ok]
+        targets = [pos[d_nodes[i]] for i in ok]
+        if workers > 1:
+            seqs = parallel_shortest_paths(cg, sources, targets, w[csr["eid"]], workers)
+        else:
+            seqs = csr["core"].shortest_paths(sources, targets, w[csr["eid"]])
+        for i, seq in zip(ok, seqs):
+            if seq is not None:
+                out[i] = list(cg.edge_geoms[cg.path_edges(seq)])
+        return out
+
+    G = net["G"]
+    weight = _weight_fn(w)
+    pairs_by_origin = defaultdict(list)
+    for i in ok:
+        pairs_by_origin[o_nodes[i]].append(i)
+    for u, idxs in pairs_by_origin.items():
+        found = shortest_paths_from(G, u, {d_nodes[i] for i in idxs}, weight=weight)
+        for i in idxs:
+            seq = found.get(d_nodes[i])
+            if seq is not None:
+                out[i] = _path_lines_from_nodes(G, seq)
+    return out
+
 # ─────────────────────────────────────────────
 # Endpoints: Agent output and load existing (SECURITY ENHANCED)
 # ─────────────────────────────────────────────
 @router.get("/compute-default")
-def compute_default():
-    """Simple version: copies inputs, runs simulate_agent.py, and returns routes_final from results.gpkg (WGS84)."""
-    if not rate_limit_check():
-        return _err_response(429, Exception("Rate limit exceeded"), "compute-default")
-    
+@guarded("heavy")
+def compute_default(
+    export_gpkg: bool = Query(True, description="Write all layers to src/outputs/results.gpkg (read by /load-existing)"),
+    agent_class: Optional[List[str]] = Query(
+        None, description="Route every pair once per agent class (adult, elderly, child, cyclist)"),
+):
+    """
+    Runs the simulate_agent engine in-process on a warm network and returns routes_final (WGS84).
+    With agent_class, each class gets its own edge-cost vector over the same graph and routes are
+    batched per class; features then carry an `agent_class` property.
+    results.gpkg is written as well (only the layers whose content changed), so /load-existing
+    serves this run; export_gpkg=false skips it. A run past SIM_TIMEOUT answers 504; while
+    earlier runs still occupy every simulation thread, new requests get 503 + Retry-After.
+    """
+    classes = list(dict.fromkeys(agent_class)) if agent_class else None
+    unknown = sorted(set(classes or []) - set(simulate_agent.AGENT_CLASSES))
+    if unknown:
+        return _err_response(400, ValueError(f"Unknown agent class: {', '.join(unknown)}"), "compute-default")
+    fut = _submit_simulation(classes)
     try:
-        _prepare_inputs_for_sim()
-        _run_simulate_agent()
-        gpkg = os.path.join(SRC_OUT, "results.gpkg")
-        routes_fc = _routes_fc_from_gpkg(gpkg)
-        meta = {"source": "simulate_agent.py", "output_file": "results.gpkg", "layer": "routes_final"}
-        return JSONResponse({"routes_final": routes_fc, "meta": meta})
+        inputs, network, routes = fut.result(timeout=SIM_TIMEOUT)
+        meta = {"source": "simulate_agent", "layer": "routes_final", "routes": len(routes)}
+        if classes:
+            meta["agent_classes"] = classes
+        if export_gpkg:
+            gpkg = os.path.join(SRC_OUT, "results.gpkg")
+            _ensure_dirs()
+            with _GPKG_LOCK:
+                meta["layers_written"] = simulate_agent.export_gpkg(gpkg, inputs, network, routes)
+            meta["output_file"] = "results.gpkg"
+        return JSONResponse({"routes_final": _routes_fc(routes), "meta": meta})
+    except FutureTimeout:
+        # the run cannot be interrupted; it keeps its slot until it finishes
+        return _err_response(504, TimeoutError("Simulation timeout exceeded"), "compute-default")
     except FileNotFoundError as e:
         return _err_response(404, e, "compute-default")
     except RuntimeError as e:
@@ -457,9 +692,6 @@ def compute_default():
 @router.get("/load-existing")
 def load_existing_results():
     """If results.gpkg already exists, returns it without running simulation. Checks first in src/outputs then in app/data."""
-    if not rate_limit_check():
-        return _err_response(429, Exception("Rate limit exceeded"), "load-existing")
-    
     try:
         gpkg = os.path.join(SRC_OUT, "results.gpkg")
         if not os.path.exists(gpkg):
@@ -468,10 +700,165 @@ def load_existing_results():
             raise FileNotFoundError("results.gpkg not found in outputs or data")
         routes_fc = _routes_fc_from_gpkg(gpkg)
         meta = {"source": "existing results", "file": os.path.basename(gpkg), "layer": "routes_final"}
-        return JSONResponse({"routes_final": routes_fc, "meta": meta})
+        body = b'{"routes_final":' + routes_fc + b',"meta":' + json.dumps(meta).encode() + b"}"
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         return _err_response(500, e, "load-existing")
 
+# ─────────────────────────────────────────────
+# Hazard exposure
+# ─────────────────────────────────────────────
+def _hazard_path(risk: str) -> Optional[str]:
+    layer = HAZARD_LAYERS.get(risk)
+    if layer is None:
+        return None
+    p = os.path.join(OUT_DIR, layer[0])
+    return p if os.path.exists(p) else None
+
+def _hazard_versions() -> str:
+    """Hashes of all parcel risk layers (part of the route cache stamp)"""
+    return ";".join(f"{r}:{_file_hash(p) if p else '-'}" for r, p in ((r, _hazard_path(r)) for r in HAZARD_LAYERS))
+
+def _edge_geoms(net: dict) -> np.ndarray:
+    """Edge geometries in eid order (computed once per cached network)"""
+    geoms = net.get("edge_geoms")
+    if geoms is None:
+        geoms = np.empty(len(net["arrays"]["length"]), dtype=object)
+        for _, _, d in net["G"].edges(data=True):
+            geoms[d["eid"]] = d["geometry"]
+        net["edge_geoms"] = geoms
+    return geoms
+
+def _hazard_exposure(net: dict, version: str, risk: str) -> Optional[np.ndarray]:
+    """
+    Per-edge exposure (0..1, eid order) to the tab's parcel risk: length-weighted mean of the
+    max-normalised risk of parcels within HAZARD_BUF_M. None when the risk layer is missing,
+    empty or lacks its risk column (that outcome is cached under the same file version too).
+    """
+    p = _hazard_path(risk)
+    if p is None:
+        return None
+    key = f"{version}:{risk}:{_file_hash(p)}"
+    with _GRAPH_LOCK:
+        if key in _HAZARD_CACHE:
+            _HAZARD_CACHE.move_to_end(key)
+            return _HAZARD_CACHE[key]
+
+    parcels = gpd.read_file(p)
+    col = HAZARD_LAYERS[risk][1]
+    if col not in parcels.columns or parcels.empty:
+        exposure = None
+    else:
+        parcels = _to_metric(parcels)
+        values = np.nan_to_num(parcels[col].to_numpy(dtype="float64"), nan=0.0).clip(min=0.0)
+        top = values.max()
+        if top > 0:
+            values = values / top
+        exposure = CoverIndex(parcels.geometry, HAZARD_BUF_M).weighted_values(_edge_geoms(net), values)
+
+    with _GRAPH_LOCK:
+        _HAZARD_CACHE[key] = exposure
+        while len(_HAZARD_CACHE) > HAZARD_CACHE_SIZE:
+            _HAZARD_CACHE.popitem(last=False)
+    return exposure
+
+# ─────────────────────────────────────────────
+# Route result cache
+# ─────────────────────────────────────────────
+def _weather_version() -> str:
+    p = os.path.join(DATA_DIR, "weather_now.json")
+    return _file_hash(p) if os.path.exists(p) else "-"
+
+def _routing_engine(backend: str, workers: int) -> str:
+    """Search that produces the paths: equal-cost ties may resolve differently per engine"""
+    return "parallel" if workers > 1 else backend
+
+def _route_cache_key(stamp: str, risk: str, alpha_build_base: float, alpha_build_heat_coeff: float,
+                     hazard_coeff: float, engine: str, n_pairs: int) -> str:
+    """stamp already covers the weather file, so temp_c needs no part of its own"""
+    raw = (f"{stamp}|{risk}|{alpha_build_base!r}|{alpha_build_heat_coeff!r}|{hazard_coeff!r}|"
+           f"{engine}|{n_pairs}")
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _route_cache_sync(stamp: str) -> None:
+    """Drop every cached result once the inputs or the weather snapshot change (call under _ROUTE_LOCK)"""
+    global _ROUTE_STAMP
+    if _ROUTE_STAMP == stamp:
+        return
+    if _ROUTE_STAMP is not None:
+        _ROUTE_STATS["invalidations"] += 1
+    _ROUTE_CACHE.clear()
+    if ROUTE_CACHE_DIR and os.path.isdir(ROUTE_CACHE_DIR):
+        for name in os.listdir(ROUTE_CACHE_DIR):
+            if name.endswith(".json") and not name.startswith(stamp[:16]):
+                try:
+                    os.remove(os.path.join(ROUTE_CACHE_DIR, name))
+                except OSError:
+                    pass
+    _ROUTE_STAMP = stamp
+
+def _route_cache_path(stamp: str, key: str) -> str:
+    return os.path.join(ROUTE_CACHE_DIR, f"{stamp[:16]}-{key}.json")
+
+def _route_cache_get(stamp: str, key: str) -> Optional[dict]:
+    with _ROUTE_LOCK:
+        _route_cache_sync(stamp)
+        hit = _ROUTE_CACHE.get(key)
+        if hit is not None:
+            _ROUTE_CACHE.move_to_end(key)
+            _ROUTE_STATS["hits"] += 1
+            return hit
+    if ROUTE_CACHE_DIR:
+        try:
+            with open(_route_cache_path(stamp, key), "r", encoding="utf-8") as f:
+                hit = json.load(f)
+        except (OSError, ValueError):
+            hit = None
+        if hit is not None:
+            with _ROUTE_LOCK:
+                _ROUTE_STATS["hits"] += 1
+                _ROUTE_STATS["disk_hits"] += 1
+                _route_cache_put_locked(key, hit)
+            return hit
+    with _ROUTE_LOCK:
+        _ROUTE_STATS["misses"] += 1
+    return None
+
+def _route_cache_put_locked(key: str, entry: dict) -> None:
+    _ROUTE_CACHE[key] = entry
+    _ROUTE_CACHE.move_to_end(key)
+    while len(_ROUTE_CACHE) > ROUTE_CACHE_SIZE:
+        _ROUTE_CACHE.popitem(last=False)
+
+def _route_cache_put(stamp: str, key: str, entry: dict) -> None:
+    with _ROUTE_LOCK:
+        if _ROUTE_STAMP != stamp:  # data changed while computing; result is already stale
+            return
+        _route_cache_put_locked(key, entry)
+    if ROUTE_CACHE_DIR:
+        try:
+            os.makedirs(ROUTE_CACHE_DIR, exist_ok=True)
+            path = _route_cache_path(stamp, key)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+@router.get("/route-cache")
+def route_cache_stats():
+    """Hit/miss counters of the route result cache"""
+    with _ROUTE_LOCK:
+        total = _ROUTE_STATS["hits"] + _ROUTE_STATS["misses"]
+        return {
+            **_ROUTE_STATS,
+            "hit_ratio": (_ROUTE_STATS["hits"] / total) if total else 0.0,
+            "entries": len(_ROUTE_CACHE),
+            "capacity": ROUTE_CACHE_SIZE,
+            "disk": bool(ROUTE_CACHE_DIR),
+        }
+
 # ─────────────────────────────────────────────
 # General endpoint: Route computation with dynamic weighting synced with tabs (SECURITY ENHANCED)
 # ─────────────────────────────────────────────
@@ -480,109 +867,85 @@ def _compute_weighted_internal(
     max_pairs: Optional[int] = None,
     alpha_build_base: float = 0.05,
     alpha_build_heat_coeff: float = 0.02,
+    hazard_coeff: float = 1.0,
+    backend: str = "networkx",
+    workers: int = 0,
 ) -> JSONResponse:
     """
     Route computation incorporating all data:
     - roads, nodes/nods, origins, destinations
     - vegetation (shade/cover), buildings (building buffer), weather_now.json (shade effect intensity with heat)
+    - the tab's parcel risk layer (edge weight × (1 + hazard_coeff × exposure))
     Output: FeatureCollection (CRS=4326) for Leaflet display
     """
-    if not rate_limit_check():
-        return _err_response(429, Exception("Rate limit exceeded"), f"compute-{risk}")
-    
     # SECURITY: Input validation
     max_pairs = min(max_pairs or MAX_PAIRS_LIMIT, MAX_PAIRS_LIMIT) if max_pairs else None
     alpha_build_base = min(max(alpha_build_base, 0.0), MAX_ALPHA_LIMIT)
     alpha_build_heat_coeff = min(max(alpha_build_heat_coeff, 0.0), MAX_ALPHA_LIMIT)
+    hazard_coeff = min(max(hazard_coeff, 0.0), MAX_HAZARD_COEFF)
+    workers = min(max(workers, 0), MAX_ROUTING_WORKERS)
     
     try:
-        # 1) Read data
-        roads = _read_fc("roads")
-        try:
-            _ = _read_fc("nodes")  # Just for data validation; build graph from roads
-        except FileNotFoundError:
-            _ = _read_fc("nods")
-        origins = _read_fc("origins")
-        dests = _read_fc("destinations")
-
-        vegetation = None
-        buildings = None
-        try:
-            vegetation = _read_fc("vegetation")
-        except Exception:
-            pass
-        try:
-            buildings = _read_fc("buildings")
-        except Exception:
-            pass
+        # 1) Cached network (topology + shade/building ratios) and weather
+        net, version = _get_network()
+        G = net["G"]
 
         weather = _read_weather()
         temp_c = float(weather.get("temp_c", 25.0))
 
-        # 2) Metric CRS
-        roads_m = _to_metric(_explode_lines(roads))
-        origins_m = _to_metric(origins)
-        dests_m = _to_metric(dests)
-
-        veg_u = None
-        if vegetation is not None and not vegetation.empty:
-            veg_u = unary_union(_to_metric(vegetation).geometry)
-        bldg_u = None
-        if buildings is not None and not buildings.empty:
-            bldg_u = unary_union(_to_metric(buildings).geometry)
-
-        # 3) Build weighted graph (dynamic)
-        G = _build_graph_weighted(
-            roads_m, veg_u, bldg_u, temp_c,
+        origins_pts = net["origins"]
+        dests_pts = net["destinations"]
+        total_pairs = min(len(origins_pts), len(dests_pts))
+        n_pairs = total_pairs if (max_pairs is None) else min(max_pairs, total_pairs)
+
+        # Finished result for the same tab/weighting on the same data + weather snapshot
+        stamp = hashlib.sha1(f"{version}|{_weather_version()}|{_hazard_versions()}".encode()).hexdigest()
+        cache_key = _route_cache_key(
+            stamp, risk, alpha_build_base, alpha_build_heat_coeff, hazard_coeff,
+            _routing_engine(backend, workers), n_pairs,
+        )
+        cached = _route_cache_get(stamp, cache_key)
+        if cached is not None:
+            meta = {**cached["meta"], "backend": backend, "workers": workers, "cache": "hit"}
+            return JSONResponse({"routes_final": cached["routes_final"], "meta": meta})
+
+        # 2) Per-request weights (dynamic)
+        w = _edge_weights(
+            net["arrays"], temp_c,
             alpha_build_base=alpha_build_base,
             alpha_build_heat_coeff=alpha_build_heat_coeff
         )
+        exposure = _hazard_exposure(net, version, risk) if hazard_coeff > 0 else None
+        if exposure is not None:
+            w = w * (1.0 + hazard_coeff * exposure)
 
-        # 4) Map nearest nodes and route (no 4-pair limit, controllable with max_pairs)
-        origins_pts = list(origins_m.geometry)
-        dests_pts = list(dests_m.geometry)
-        total_pairs = min(len(origins_pts), len(dests_pts))
-        n_pairs = total_pairs if (max_pairs is None) else min(max_pairs, total_pairs)
+        # 3) Map nearest nodes and route (no 4-pair limit, controllable with max_pairs)
 
         features: List[dict] = []
         no_path = 0
 
-        for i in range(n_pairs):
-            o_pt: Point = origins_pts[i]
-            d_pt: Point = dests_pts[i]
-            u = _nearest_graph_node(G, o_pt)
-            v = _nearest_graph_node(G, d_pt)
-            if u is None or v is None:
-                no_path += 1
-                continue
-
-            # Attempt 1: Shortest path with weight (shade/building/weather)
-            nodes_seq = None
-            try:
-                nodes_seq = nx.shortest_path(G, u, v, weight="weight")
-            except nx.NetworkXNoPath:
-                nodes_seq = None
+        # Snap all origins and destinations in a single query
+        snapped = snap_points(G, origins_pts[:n_pairs] + dests_pts[:n_pairs])
+        o_nodes, d_nodes = snapped[:n_pairs], snapped[n_pairs:]
 
-            # Attempt 2 (fallback): Geometric length only
-            if nodes_seq is None:
-                try:
-                    nodes_seq = nx.shortest_path(G, u, v, weight="length")
-                except nx.NetworkXNoPath:
-                    nodes_seq = None
+        path_lines = _route_pairs(net, w, o_nodes, d_nodes, backend=backend, workers=workers)
 
-            if nodes_seq is None:
+        routed: List[Tuple[int, LineString]] = []
+        for i in range(n_pairs):
+            if path_lines[i] is None:
                 no_path += 1
                 continue
 
-            path_geom_m = _path_geom_from_nodes(G, nodes_seq)
+            path_geom_m = _stitch_lines(path_lines[i])
             if path_geom_m.is_empty:
                 no_path += 1
                 continue
+            routed.append((i, path_geom_m))
 
-            gdf_tmp = gpd.GeoDataFrame([{"agentId": i + 1, "risk": risk}], geometry=[path_geom_m], crs=3857)
-            gdf_tmp = _to_wgs84(gdf_tmp)
-            coords = list(gdf_tmp.geometry.iloc[0].coords)  # [lon, lat]
+        # All routes of the request reprojected in one call
+        coords_wgs84 = _lines_to_wgs84([g for _, g in routed])
 
+        for (i, path_geom_m), coords in zip(routed, coords_wgs84):
             features.append({
                 "type": "Feature",
                 "properties": {
@@ -596,6 +959,8 @@ def _compute_weighted_internal(
                         "weather": True,
                         "alpha_build_base": alpha_build_base,
                         "alpha_build_heat_coeff": alpha_build_heat_coeff,
+                        "hazard": exposure is not None,
+                        "hazard_coeff": hazard_coeff,
                         "fallback_if_needed": True
                     }
                 },
@@ -610,8 +975,15 @@ def _compute_weighted_internal(
             "no_path": no_path,
             "temp_c": temp_c,
             "risk": risk,
-            "weights": {"shade": True, "buildings": True, "weather": True}
+            "weights": {"shade": True, "buildings": True, "weather": True, "hazard": exposure is not None},
+            "hazard": None if exposure is None else {
+                "layer": HAZARD_LAYERS[risk][0],
+                "coeff": hazard_coeff,
+                "mean_exposure": round(float(exposure.mean()), 4) if len(exposure) else 0.0,
+            },
         }
+        _route_cache_put(stamp, cache_key, {"routes_final": fc, "meta": meta})
+        meta = {**meta, "backend": backend, "workers": workers, "cache": "miss"}
         return JSONResponse({"routes_final": fc, "meta": meta})
 
     except FileNotFoundError as e:
@@ -623,16 +995,26 @@ def _compute_weighted_internal(
 # Endpoints synced with frontend (tabs) - VALIDATION ENHANCED
 # ─────────────────────────────────────────────
 @router.get("/compute-flood")
+@guarded("heavy")
 def compute_flood(
     max_pairs: Optional[int] = Query(None, ge=1, le=MAX_PAIRS_LIMIT, description="Maximum number of pairs to process"),
+    hazard_coeff: float = Query(1.0, ge=0.0, le=MAX_HAZARD_COEFF, description="Weight of parcel flood risk along edges"),
+    backend: str = Query("networkx", pattern=BACKEND_PATTERN, description="Routing backend"),
+    workers: int = Query(0, ge=0, le=MAX_ROUTING_WORKERS, description="Worker processes for pair routing (0/1 = serial)"),
 ):
-    return _compute_weighted_internal(risk="flood", max_pairs=max_pairs)
+    return _compute_weighted_internal(
+        risk="flood", max_pairs=max_pairs, hazard_coeff=hazard_coeff, backend=backend, workers=workers,
+    )
 
 @router.get("/compute-heat")
+@guarded("heavy")
 def compute_heat(
     max_pairs: Optional[int] = Query(None, ge=1, le=MAX_PAIRS_LIMIT),
     alpha_build_base: float = Query(0.06, ge=0.0, le=MAX_ALPHA_LIMIT),
     alpha_build_heat_coeff: float = Query(0.03, ge=0.0, le=MAX_ALPHA_LIMIT),
+    hazard_coeff: float = Query(1.0, ge=0.0, le=MAX_HAZARD_COEFF),
+    backend: str = Query("networkx", pattern=BACKEND_PATTERN),
+    workers: int = Query(0, ge=0, le=MAX_ROUTING_WORKERS),
 ):
     # In heat, building effect is slightly stronger (different default parameters)
     return _compute_weighted_internal(
@@ -640,13 +1022,20 @@ def compute_heat(
         max_pairs=max_pairs,
         alpha_build_base=alpha_build_base,
         alpha_build_heat_coeff=alpha_build_heat_coeff,
+        hazard_coeff=hazard_coeff,
+        backend=backend,
+        workers=workers,
     )
 
 @router.get("/compute-fire")
+@guarded("heavy")
 def compute_fire(
     max_pairs: Optional[int] = Query(None, ge=1, le=MAX_PAIRS_LIMIT),
     alpha_build_base: float = Query(0.04, ge=0.0, le=MAX_ALPHA_LIMIT),
     alpha_build_heat_coeff: float = Query(0.02, ge=0.0, le=MAX_ALPHA_LIMIT),
+    hazard_coeff: float = Query(1.0, ge=0.0, le=MAX_HAZARD_COEFF),
+    backend: str = Query("networkx", pattern=BACKEND_PATTERN),
+    workers: int = Query(0, ge=0, le=MAX_ROUTING_WORKERS),
 ):
     # In fire, buildings have milder effect (gentler defaults)
     return _compute_weighted_internal(
@@ -654,13 +1043,20 @@ def compute_fire(
         max_pairs=max_pairs,
         alpha_build_base=alpha_build_base,
         alpha_build_heat_coeff=alpha_build_heat_coeff,
+        hazard_coeff=hazard_coeff,
+        backend=backend,
+        workers=workers,
     )
 
 @router.get("/compute-quake")
+@guarded("heavy")
 def compute_quake(
     max_pairs: Optional[int] = Query(None, ge=1, le=MAX_PAIRS_LIMIT),
     alpha_build_base: float = Query(0.03, ge=0.0, le=MAX_ALPHA_LIMIT),
     alpha_build_heat_coeff: float = Query(0.01, ge=0.0, le=MAX_ALPHA_LIMIT),
+    hazard_coeff: float = Query(1.0, ge=0.0, le=MAX_HAZARD_COEFF),
+    backend: str = Query("networkx", pattern=BACKEND_PATTERN),
+    workers: int = Query(0, ge=0, le=MAX_ROUTING_WORKERS),
 ):
     # In earthquake, proximity to buildings has very low effect (adjustable parameters)
     return _compute_weighted_internal(
@@ -668,13 +1064,20 @@ def compute_quake(
         max_pairs=max_pairs,
         alpha_build_base=alpha_build_base,
         alpha_build_heat_coeff=alpha_build_heat_coeff,
+        hazard_coeff=hazard_coeff,
+        backend=backend,
+        workers=workers,
     )
 
 @router.get("/compute-merge")
+@guarded("heavy")
 def compute_merge(
     max_pairs: Optional[int] = Query(None, ge=1, le=MAX_PAIRS_LIMIT),
     alpha_build_base: float = Query(0.05, ge=0.0, le=MAX_ALPHA_LIMIT),
     alpha_build_heat_coeff: float = Query(0.02, ge=0.0, le=MAX_ALPHA_LIMIT),
+    hazard_coeff: float = Query(1.0, ge=0.0, le=MAX_HAZARD_COEFF),
+    backend: str = Query("networkx", pattern=BACKEND_PATTERN),
+    workers: int = Query(0, ge=0, le=MAX_ROUTING_WORKERS),
 ):
     # Comprehensive map: average parameters
     return _compute_weighted_internal(
@@ -682,4 +1085,319 @@ def compute_merge(
         max_pairs=max_pairs,
         alpha_build_base=alpha_build_base,
         alpha_build_heat_coeff=alpha_build_heat_coeff,
+        hazard_coeff=hazard_coeff,
+        backend=backend,
+        workers=workers,
     )
+
+# ─────────────────────────────────────────────
+# Point-to-point route (A* with a Euclidean lower bound)
+# ─────────────────────────────────────────────
+@router.get("/route")
+@guarded("heavy")
+def route_point_to_point(
+    from_lon: float = Query(..., ge=-180, le=180),
+    from_lat: float = Query(..., ge=-90, le=90),
+    to_lon: float = Query(..., ge=-180, le=180),
+    to_lat: float = Query(..., ge=-90, le=90),
+    algorithm: str = Query("astar", pattern="^(astar|dijkstra)$"),
+    alpha_build_base: float = Query(0.05, ge=0.0, le=MAX_ALPHA_LIMIT),
+    alpha_build_heat_coeff: float = Query(0.02, ge=0.0, le=MAX_ALPHA_LIMIT),
+):
+    """
+    Single origin → destination route over the shade/heat-weighted graph.
+    A* uses k × straight-line distance, with k the smallest weight/chord ratio of the current
+    weighting, so the route is the same as Dijkstra's. The search runs on the degree-2 contracted
+    core; meta.settled counts settled core nodes.
+    """
+    try:
+        net, _ = _get_network()
+        temp_c = float(_read_weather().get("temp_c", 25.0))
+        w = _edge_weights(net["arrays"], temp_c, alpha_build_base, alpha_build_heat_coeff)
+        csr = _compiled(net)
+        cg: CompiledGraph = csr["graph"]
+        # slot weights + heuristic scale prepared once per weighting, so A* is all that runs per query
+        weighting = csr["core"].weighting(
+            w[csr["eid"]], key=(temp_c, alpha_build_base, alpha_build_heat_coeff))
+
+        x, y = _TO_METRIC.transform(np.array([from_lon, to_lon]), np.array([from_lat, to_lat]))
+        o_node, d_node = snap_points(net["G"], np.column_stack([x, y]))
+        if o_node is None or d_node is None:
+            raise FileNotFoundError("No graph node near the origin/destination")
+
+        scale = weighting.scale if algorithm == "astar" else 0.0
+        t0 = time.perf_counter()
+        path, cost, settled = csr["core"].point_to_point(csr["pos"][o_node], csr["pos"][d_node], weighting, scale=scale)
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+
+        meta = {
+            "algorithm": algorithm,
+            "settled": settled,
+            "nodes_total": cg.n_nodes,
+            "core_nodes": csr["core"].core.n_nodes,
+            "search_ms": round(elapsed_ms, 3),
+            "heuristic_scale": round(scale, 6),
+            "temp_c": temp_c,
+        }
+        if path is None:
+            return JSONResponse({"route": None, "meta": {**meta, "no_path": True}})
+
+        geom = _stitch_lines([cg.edge_geoms[e] for e in cg.path_edges(path).tolist()])
+        feature = {
+            "type": "Feature",
+            "properties": {"length_m": float(geom.length), "cost": float(cost)},
+            "geometry": {"type": "LineString", "coordinates": _lines_to_wgs84([geom])[0]},
+        }
+        return JSONResponse({"route": feature, "meta": {**meta, "no_path": False}})
+    except FileNotFoundError as e:
+        return _err_response(404, e, "route")
+    except Exception as e:
+        return _err_response(500, e, "route")
+
+# ─────────────────────────────────────────────
+# Isochrones / service areas on the weighted graph
+# ─────────────────────────────────────────────
+def _reached_part(cg: CompiledGraph, eid: int, reverse: bool, lo: float, hi: float) -> LineString:
+    """Fractions lo..hi of an edge, measured from its entry node (whole edge for 0..1)"""
+    geom = cg.edge_geoms[eid]
+    if lo <= 0.0 and hi >= 1.0:
+        return geom
+    entry = cg.xy[cg.edge_v[eid] if reverse else cg.edge_u[eid]]
+    x0, y0 = geom.coords[0][:2]
+    x1, y1 = geom.coords[-1][:2]
+    from_start = (x0 - entry[0]) ** 2 + (y0 - entry[1]) ** 2 <= (x1 - entry[0]) ** 2 + (y1 - entry[1]) ** 2
+    if from_start:
+        return substring(geom, lo, hi, normalized=True)
+    return substring(geom, 1.0 - hi, 1.0 - lo, normalized=True)
+
+@router.get("/isochrone")
+@guarded("heavy")
+def isochrone(
+    lon: List[float] = Query(..., description="Seed longitudes (repeat for several seeds)"),
+    lat: List[float] = Query(..., description="Seed latitudes, same order as lon"),
+    cutoff: float = Query(..., gt=0, description="Travel budget in `unit`"),
+    unit: str = Query("meters", pattern="^(meters|minutes)$"),
+    bands: int = Query(4, ge=1, le=MAX_ISO_BANDS),
+    hull_ratio: float = Query(1.0, ge=0.0, le=1.0, description="1 = convex hull, smaller = tighter concave hull"),
+    alpha_build_base: float = Query(0.05, ge=0.0, le=MAX_ALPHA_LIMIT),
+    alpha_build_heat_coeff: float = Query(0.02, ge=0.0, le=MAX_ALPHA_LIMIT),
+):
+    """
+    Service area of one or more seeds from a single bounded multi-source Dijkstra over the
+    shade/heat-weighted graph. Costs are weighted meters (minutes use WALK_SPEED_MPS).
+    Output: reachable edge pieces, each cut at the band thresholds so it lies in one band (cost
+    range + band; partial = its edge is not reachable end to end), plus one hull polygon per
+    cumulative band (WGS84).
+    """
+    if len(lon) != len(lat) or not lon or len(lon) > MAX_ISO_SEEDS:
+        return _err_response(400, ValueError(f"lon/lat must pair up (1..{MAX_ISO_SEEDS} seeds)"), "isochrone")
+
+    limit = cutoff * 60.0 * WALK_SPEED_MPS if unit == "minutes" else cutoff
+    if limit > MAX_ISO_METERS:
+        return _err_response(400, ValueError(f"cutoff exceeds {MAX_ISO_METERS:.0f} m"), "isochrone")
+    to_unit = (lambda c: c / (60.0 * WALK_SPEED_MPS)) if unit == "minutes" else (lambda c: c)
+
+    try:
+        net, _ = _get_network()
+        temp_c = float(_read_weather().get("temp_c", 25.0))
+        w = _edge_weights(net["arrays"], temp_c, alpha_build_base, alpha_build_heat_coeff)
+        csr = _compiled(net)
+        cg: CompiledGraph = csr["graph"]
+        w_c = w[csr["eid"]]
+
+        x, y = _TO_METRIC.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        seeds = [csr["pos"][n] for n in snap_points(net["G"], np.column_stack([x, y])) if n is not None]
+        if not seeds:
+            raise FileNotFoundError("No graph node near the seeds")
+
+        step = limit / bands
+        area = cg.service_area(seeds, w_c, limit, breaks=step * np.arange(1, bands))
+        band_of = area["band"] + 1
+
+        lines = [
+            _reached_part(cg, e, rev, lo, hi)
+            for e, rev, lo, hi in zip(
+                area["edge"].tolist(), area["reverse"].tolist(), area["lo"].tolist(), area["hi"].tolist()
+            )
+        ]
+        edge_features = [
+            {
+                "type": "Feature",
+                "properties": {
+                    "cost_start": round(float(to_unit(c0)), 3),
+                    "cost_end": round(float(to_unit(c1)), 3),
+                    "band": int(b),
+                    "partial": not full,
+                },
+                "geometry": {"type": "LineString", "coordinates": coords},
+            }
+            for c0, c1, b, full, coords in zip(
+                area["start"], area["end"], band_of, area["full"].tolist(), _lines_to_wgs84(lines)
+            )
+        ]
+
+        # Cumulative hulls over every reached vertex up to each band's threshold
+        band_features = []
+        if lines:
+            pts = shapely.get_coordinates(lines)
+            pt_band = np.repeat(band_of, shapely.get_num_coordinates(lines))
+            for b in range(1, bands + 1):
+                sel = pts[pt_band <= b]
+                if len(sel) < 3:
+                    continue
+                hull = shapely.concave_hull(shapely.multipoints(sel), ratio=hull_ratio)
+                if hull.geom_type != "Polygon":
+                    continue
+                hull = shapely.transform(hull, lambda xy: np.column_stack(_TO_WGS84.transform(xy[:, 0], xy[:, 1])))
+                band_features.append({
+                    "type": "Feature",
+                    "properties": {"band": b, "max_cost": round(float(to_unit(step * b)), 3)},
+                    "geometry": shapely.geometry.mapping(hull),
+                })
+
+        meta = {
+            "seeds": len(seeds),
+            "cutoff": cutoff,
+            "unit": unit,
+            "bands": bands,
+            "nodes_reached": int(np.isfinite(area["node_cost"]).sum()),
+            "edges_reached": int(len(np.unique(area["edge"]))),
+            "temp_c": temp_c,
+        }
+        return JSONResponse({
+            "edges": {"type": "FeatureCollection", "features": edge_features},
+            "bands": {"type": "FeatureCollection", "features": band_features},
+            "meta": meta,
+        })
+    except FileNotFoundError as e:
+        return _err_response(404, e, "isochrone")
+    except Exception as e:
+        return _err_response(500, e, "isochrone")
+
+# ─────────────────────────────────────────────
+# Origin × destination cost matrix
+# ─────────────────────────────────────────────
+def _od_points(layer: str, id_field: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids, metric xy) of a DATA_DIR layer; polygons/lines contribute their centroid"""
+    gdf = _read_fc(layer)
+    gdf = _to_metric(gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty])
+    ids = gdf[id_field].to_numpy() if id_field in gdf.columns else np.arange(1, len(gdf) + 1)
+    return ids, shapely.get_coordinates(shapely.centroid(np.asarray(gdf.geometry.values)))
+
+def _json_id(v):
+    return v.item() if isinstance(v, np.generic) else v
+
+@router.get("/od-matrix")
+@guarded("heavy")
+def od_matrix(
+    origins: str = Query("origins", description="Origin layer in app/data (e.g. parcel centroids)"),
+    destinations: str = Query("destinations", description="Destination layer in app/data (e.g. service points)"),
+    id_field: str = Query("Id", description="Id column of both layers (row number when missing)"),
+    format: str = Query("json", pattern="^(json|npy|arrow)$"),
+    unit: str = Query("meters", pattern="^(meters|minutes)$"),
+    routes: bool = Query(False, description=f"Also return route geometries (json only, ≤ {MAX_OD_ROUTES} pairs)"),
+    alpha_build_base: float = Query(0.05, ge=0.0, le=MAX_ALPHA_LIMIT),
+    alpha_build_heat_coeff: float = Query(0.02, ge=0.0, le=MAX_ALPHA_LIMIT),
+):
+    """
+    Travel cost from every origin to every destination over the shade/heat-weighted graph.
+    Points snap to their nearest graph node in one query each side; costs come from csgraph
+    searches started from the smaller side (weighted meters, or minutes at WALK_SPEED_MPS).
+    - json: {"origins": ids, "destinations": ids, "matrix": rows (null = unreachable), "meta"}
+    - npy: float32 matrix (rows = origins, cols = destinations in layer order, inf = unreachable)
+    - arrow: long table (origin_id, destination_id, cost) of reachable pairs as an Arrow IPC stream
+    """
+    if routes and format != "json":
+        return _err_response(400, ValueError("routes=true requires format=json"), "od-matrix")
+    try:
+        o_ids, o_xy = _od_points(origins, id_field)
+        d_ids, d_xy = _od_points(destinations, id_field)
+        n_o, n_d = len(o_ids), len(d_ids)
+        if n_o * n_d > MAX_OD_CELLS:
+            return _err_response(400, ValueError(f"{n_o} × {n_d} exceeds {MAX_OD_CELLS} cells"), "od-matrix")
+        if routes and n_o * n_d > MAX_OD_ROUTES:
+            return _err_response(400, ValueError(f"routes=true allows at most {MAX_OD_ROUTES} pairs"), "od-matrix")
+
+        net, _ = _get_network()
+        temp_c = float(_read_weather().get("temp_c", 25.0))
+        w = _edge_weights(net["arrays"], temp_c, alpha_build_base, alpha_build_heat_coeff)
+        csr = _compiled(net)
+        cg: CompiledGraph = csr["graph"]
+        w_c = w[csr["eid"]]
+
+        snapped = snap_points(net["G"], np.concatenate([o_xy, d_xy]).reshape(-1, 2))
+        pos = np.array([-1 if n is None else csr["pos"][n] for n in snapped], dtype=np.int64)
+        o_pos, d_pos = pos[:n_o], pos[n_o:]
+        o_ok, d_ok = np.flatnonzero(o_pos >= 0), np.flatnonzero(d_pos >= 0)
+
+        t0 = time.perf_counter()
+        matrix = np.full((n_o, n_d), np.inf)
+        matrix[np.ix_(o_ok, d_ok)] = csr["core"].cost_matrix(o_pos[o_ok], d_pos[d_ok], w_c)
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        if unit == "minutes":
+            matrix /= 60.0 * WALK_SPEED_MPS
+        reachable = np.isfinite(matrix)
+
+        meta = {
+            "origins": n_o,
+            "destinations": n_d,
+            "unsnapped": int(n_o - len(o_ok) + n_d - len(d_ok)),
+            "reachable_pairs": int(reachable.sum()),
+            "unit": unit,
+            "search_ms": round(elapsed_ms, 3),
+            "temp_c": temp_c,
+        }
+
+        if format == "npy":
+            buf = io.BytesIO()
+            np.save(buf, matrix.astype(np.float32))
+            headers = {"X-OD-Shape": f"{n_o},{n_d}", "X-OD-Unit": unit}
+            return Response(content=buf.getvalue(), media_type="application/octet-stream", headers=headers)
+
+        if format == "arrow":
+            oi, di = np.nonzero(reachable)
+            table = pa.table({
+                "origin_id": o_ids[oi],
+                "destination_id": d_ids[di],
+                "cost": matrix[oi, di],
+            }, metadata={k: str(v) for k, v in meta.items()})
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return Response(content=sink.getvalue().to_pybytes(),
+                            media_type="application/vnd.apache.arrow.stream")
+
+        rows = np.where(reachable, np.round(matrix, 3), None).tolist()
+        body = {
+            "origins": [_json_id(v) for v in o_ids.tolist()],
+            "destinations": [_json_id(v) for v in d_ids.tolist()],
+            "matrix": rows,
+            "meta": meta,
+        }
+        if routes:
+            oi, di = np.nonzero(reachable)
+            seqs = csr["core"].shortest_paths(o_pos[oi], d_pos[di], w_c)
+            lines = [_stitch_lines([cg.edge_geoms[e] for e in cg.path_edges(seq).tolist()]) for seq in seqs]
+            body["routes"] = {"type": "FeatureCollection", "features": [
+                {
+                    "type": "Feature",
+                    "properties": {
+                        "origin_id": _json_id(o_ids[i]),
+                        "destination_id": _json_id(d_ids[j]),
+                        "cost": round(float(matrix[i, j]), 3),
+                        "length_m": float(line.length),
+                    },
+                    "geometry": {"type": "LineString", "coordinates": coords},
+                }
+                for i, j, line, coords in zip(oi.tolist(), di.tolist(), lines, _lines_to_wgs84(lines))
+            ]}
+        return JSONResponse(body)
+    except FileNotFoundError as e:
+        return _err_response(404, e, "od-matrix")
+    except Exception as e:
+        return _err_response(500, e, "od-matrix")
+
+
+if __name__ == "__main__":
+    # python -m app.features.transport_agent_api → (re)build the compiled network artifact
+    print(build_network_bundle())
@@ -10,6 +10,7 @@ import sys, os, subprocess
 from app.routers import weather
 from app.features import heat_layer, flood_layer, fire_layer,merge_layer ,quake_router
 from app.features import transport_agent_api
+from app.services.admission import ADMISSION, Overloaded
 
 # ──────────────────────────────────────────────
 # تنظیمات پایه
@@ -89,6 +90,21 @@ def root():
 def health():
     return {"status": "ok"}
 
+# ──────────────────────────────────────────────
+# کنترل پذیرش درخواست‌های سنگین (app/services/admission.py)
+# ──────────────────────────────────────────────
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(exc), "type": "Overloaded", "cost_class": exc.cost_class},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.get("/api/admission")
+def admission_stats():
+    return ADMISSION.stats()
+
 # ──────────────────────────────────────────────
 # APIهای تحلیل اقلیمی — الگوی Run/File (بدون تداخل مسیر)
 # ──────────────────────────────────────────────
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Body
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import APIRouter, Body, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pathlib import Path
-import json, random, csv, os
-import folium
-from folium.plugins import TimestampedGeoJson
+from collections import OrderedDict
+from functools import lru_cache
+import json, random, csv, os, threading, uuid
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+from pyproj import Transformer
+import mapbox_vector_tile
 
 router = APIRouter()
 
@@ -30,6 +36,19 @@ COLORS = {
 # این کاربری‌ها اجازه تغییر ندارند
 LOCKED = {3, 4, 6, 7, 9}
 
+# کاشی‌های برداری (MVT)
+MAX_JOBS = 8              # تعداد اجراهای نگه‌داشته‌شده در حافظه
+MAX_STEPS = 100           # سقف قدم‌های هر اجرا (حافظه‌ی steps × n و لاگ CSV)
+TILE_CACHE_SIZE = 2048    # ظرفیت LRU کاشی‌ها
+TILE_EXTENT = 4096
+TILE_BUFFER_PX = 64       # حاشیه‌ی کاشی تا لبه‌ی پلیگون‌ها بریده دیده نشود
+TILE_LAYER = "buildings"
+WEB_MERCATOR_HALF = 20037508.342789244
+
+# job_id → کاربری هر ساختمان در پایان هر قدم (آرایه‌ی steps × n)
+_JOBS: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_JOBS_LOCK = threading.Lock()  # endpointهای sync در threadpool اجرا می‌شوند
+
 def load_features():
     with open(DATA, "r", encoding="utf-8") as f:
         gj = json.load(f)
@@ -38,17 +57,87 @@ def load_features():
 def color_for(lu: int) -> str:
     return COLORS.get(int(lu), "#CCCCCC")
 
+def _source_crs(gj: dict) -> str:
+    name = (gj.get("crs") or {}).get("properties", {}).get("name")
+    return name or "EPSG:4326"
+
+@lru_cache(maxsize=1)
+def _buildings_mercator() -> tuple[np.ndarray, STRtree]:
+    """
+    هندسه‌ی ساختمان‌ها یک بار خوانده، به EPSG:3857 برده و ایندکس می‌شود.
+    ترتیب آرایه همان ترتیب features (یعنی fid) است.
+    """
+    with open(DATA, "r", encoding="utf-8") as f:
+        gj = json.load(f)
+    geoms = np.array(
+        [shape(ft["geometry"]) if ft.get("geometry") else shapely.Polygon() for ft in gj["features"]],
+        dtype=object,
+    )
+    tr = Transformer.from_crs(_source_crs(gj), 3857, always_xy=True)
+    geoms = shapely.transform(geoms, lambda xy: np.column_stack(tr.transform(xy[:, 0], xy[:, 1])))
+    return geoms, STRtree(geoms)
+
+def _tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    size = 2 * WEB_MERCATOR_HALF / (1 << z)
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+def _remember_job(landuse_steps: np.ndarray) -> str:
+    job_id = uuid.uuid4().hex[:12]
+    with _JOBS_LOCK:
+        _JOBS[job_id] = landuse_steps
+        while len(_JOBS) > MAX_JOBS:
+            _JOBS.popitem(last=False)
+    return job_id
+
+def _job_frames(job: str) -> np.ndarray:
+    """آرایه‌ی steps × n یک اجرا (KeyError اگر نباشد یا بیرون رانده شده باشد)"""
+    with _JOBS_LOCK:
+        return _JOBS[job]
+
+@lru_cache(maxsize=TILE_CACHE_SIZE)
+def _render_tile(job: str, step: int, z: int, x: int, y: int) -> bytes:
+    """کاشی MVT برای یک قدم؛ فقط ساختمان‌های داخل کاشی کد می‌شوند."""
+    landuse = _job_frames(job)[step]
+    geoms, tree = _buildings_mercator()
+
+    minx, miny, maxx, maxy = _tile_bounds(z, x, y)
+    pad = (maxx - minx) * TILE_BUFFER_PX / TILE_EXTENT
+    idx = tree.query(shapely.box(minx - pad, miny - pad, maxx + pad, maxy + pad), predicate="intersects")
+    if len(idx) == 0:
+        return b""
+    idx = np.sort(idx)
+    clipped = shapely.clip_by_rect(geoms[idx], minx - pad, miny - pad, maxx + pad, maxy + pad)
+
+    features = []
+    for fid, geom in zip(idx.tolist(), clipped):
+        if geom.is_empty:
+            continue
+        lu = int(landuse[fid])
+        features.append({
+            "geometry": geom,
+            "properties": {"fid": fid, "landuse": lu, "color": color_for(lu)},
+        })
+    return mapbox_vector_tile.encode(
+        [{"name": TILE_LAYER, "features": features}],
+        default_options={"quantize_bounds": (minx, miny, maxx, maxy), "extents": TILE_EXTENT},
+    )
+
 @router.post("/run")
 def run_simulation(
     agent_id: int | None = Body(default=None),
     scenario_id: int | None = Body(default=None),
-    steps: int = Body(default=5),
+    steps: int = Body(default=5, ge=1, le=MAX_STEPS),
     seed: int | None = Body(default=42),
     map_name: str | None = Body(default="Feizabad"),
+    render_html: bool = Body(default=True),
 ):
     """
     اجرای شبیه‌سازی: روی buildings.geojson اجرا می‌کند و
-    یک HTML با انیمیشن زمانی + CSV لاگ تحویل می‌دهد.
+    کاربری هر قدم را برای سرو به‌صورت کاشی برداری نگه می‌دارد + CSV لاگ.
+    HTML انیمیشن Folium (پیش‌فرض) با render_html=False ساخته نمی‌شود و HTML اجرای قبلی هم پاک
+    می‌شود تا /map نقشه‌ی کهنه سرو نکند.
     """
     if seed is not None:
         random.seed(seed)
@@ -65,6 +154,8 @@ def run_simulation(
 
     # لاگ
     log_rows = []
+    # کاربری هر قدم برای کاشی‌ها
+    landuse_steps = np.empty((steps, len(feats)), dtype=np.int16)
     # برای انیمیشن (FeatureCollection)
     anim_features = []
 
@@ -104,6 +195,10 @@ def run_simulation(
                 "action": action
             })
 
+            landuse_steps[step, idx] = lu_new
+
+            if not render_html:
+                continue
             # یک کپی برای فریم زمانی
             anim_feat = {
                 "type": "Feature",
@@ -121,18 +216,26 @@ def run_simulation(
             }
             anim_features.append(anim_feat)
 
-    # ساخت نقشه Folium + لایه‌ی زمانی
-    m = folium.Map(location=[center_lat, center_lng], zoom_start=14, tiles="cartodbdark_matter")
+    job_id = _remember_job(landuse_steps)
+
+    if render_html:
+        import folium
+        from folium.plugins import TimestampedGeoJson
 
-    TimestampedGeoJson(
-        {"type": "FeatureCollection", "features": anim_features},
-        transition_time=1000,
-        loop=False,
-        auto_play=True,
-        add_last_point=True,
-    ).add_to(m)
+        # ساخت نقشه Folium + لایه‌ی زمانی
+        m = folium.Map(location=[center_lat, center_lng], zoom_start=14, tiles="cartodbdark_matter")
 
-    m.save(OUT_HTML)
+        TimestampedGeoJson(
+            {"type": "FeatureCollection", "features": anim_features},
+            transition_time=1000,
+            loop=False,
+            auto_play=True,
+            add_last_point=True,
+        ).add_to(m)
+
+        m.save(OUT_HTML)
+    else:
+        OUT_HTML.unlink(missing_ok=True)
 
     # ذخیره CSV لاگ
     with open(OUT_LOG, "w", newline="", encoding="utf-8") as fcsv:
@@ -140,14 +243,47 @@ def run_simulation(
         w.writeheader()
         w.writerows(log_rows)
 
-    return JSONResponse({
+    result = {
         "status": "ok",
-        "html_url": "/simulator/map"
-    })
+        "job_id": job_id,
+        "steps": steps,
+        "tiles_url": f"/simulator/tiles/{job_id}/{{step}}/{{z}}/{{x}}/{{y}}.pbf",
+        "tile_layer": TILE_LAYER,
+    }
+    if render_html:
+        result["html_url"] = "/simulator/map"
+    return JSONResponse(result)
 
 @router.get("/map")
 def get_map_html():
     """
-    سرو کردن فایل HTML انیمیشن.
+    سرو کردن فایل HTML انیمیشن (404 اگر آخرین اجرا HTML نساخته باشد).
     """
+    if not OUT_HTML.exists():
+        raise HTTPException(404, "No HTML map for the latest simulation run")
     return FileResponse(OUT_HTML, media_type="text/html")
+
+@router.get("/tiles/{job}/{step}/{z}/{x}/{y}.pbf")
+def get_tile(job: str, step: int, z: int, x: int, y: int):
+    """
+    کاشی برداری (Mapbox Vector Tile) یک قدم شبیه‌سازی.
+    کاشی‌ها به‌صورت تنبل ساخته و در LRU نگه داشته می‌شوند.
+    """
+    try:
+        frames = _job_frames(job)
+    except KeyError:
+        raise HTTPException(404, "Simulation job not found")
+    if not 0 <= step < len(frames):
+        raise HTTPException(404, "Step out of range")
+    if not (0 <= z <= 24 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(400, "Invalid tile coordinates")
+
+    try:
+        content = _render_tile(job, step, z, x, y)
+    except KeyError:  # اجرا بین بررسی بالا و رندر از _JOBS بیرون رانده شد
+        raise HTTPException(404, "Simulation job not found")
+    return Response(
+        content=content,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": "public, max-age=3600"},
+    )
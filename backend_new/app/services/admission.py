@@ -0,0 +1,202 @@
+# backend/app/services/admission.py
+"""
+Shared admission layer for the compute-heavy endpoints.
+
+- Single-flight: concurrent identical requests (same endpoint + same parameters) share one
+  computation; followers just wait for the leader's result. A Response is shared as its
+  payload (body, status, headers) and each follower gets a fresh Response built from it.
+- Cost classes: each class has a bounded number of running computations plus a bounded
+  queue. Requests beyond that are rejected with Overloaded (→ 503 + Retry-After) instead of
+  piling up, so waiting requests never tie up enough threadpool workers to starve cheap reads
+  such as /api/files (which bypass admission entirely).
+
+Usage on a FastAPI endpoint (sync or async):
+
+    @router.get("/compute-heat")
+    @guarded("heavy")
+    def compute_heat(...): ...
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Tuple
+
+from starlette.responses import Response
+
+# name → (concurrent computations, queued requests incl. coalesced followers)
+COST_CLASSES: Dict[str, Tuple[int, int]] = {
+    "heavy": (int(os.getenv("ADMISSION_HEAVY_SLOTS", 2)), int(os.getenv("ADMISSION_HEAVY_QUEUE", 8))),
+    "medium": (int(os.getenv("ADMISSION_MEDIUM_SLOTS", 4)), int(os.getenv("ADMISSION_MEDIUM_QUEUE", 12))),
+}
+QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+RETRY_AFTER_S = 5
+
+
+class Overloaded(RuntimeError):
+    """The cost class is saturated (queue full, or the queue wait timed out)"""
+
+    def __init__(self, cost_class: str):
+        super().__init__(f"Server busy with {cost_class} requests, retry later")
+        self.cost_class = cost_class
+        self.retry_after = RETRY_AFTER_S
+
+
+class _SharedResponse(NamedTuple):
+    body: bytes
+    status_code: int
+    raw_headers: Tuple[Tuple[bytes, bytes], ...]
+
+
+def _share(result: Any) -> Any:
+    """What the leader publishes to followers: never a Response object itself"""
+    if isinstance(result, Response) and isinstance(getattr(result, "body", None), bytes):
+        return _SharedResponse(result.body, result.status_code, tuple(result.raw_headers))
+    return result
+
+
+def _unshare(shared: Any) -> Any:
+    """A follower's own copy: headers set on it later do not leak to other callers"""
+    if isinstance(shared, _SharedResponse):
+        resp = Response(content=shared.body, status_code=shared.status_code)
+        resp.raw_headers = list(shared.raw_headers)
+        return resp
+    return shared
+
+
+class _CostClass:
+    def __init__(self, slots: int, queue: int):
+        self.slots = max(1, slots)
+        self.queue_limit = max(0, queue)
+        self.running = 0
+        self.queued = 0
+        self.stats = {"computed": 0, "coalesced": 0, "rejected": 0, "timeouts": 0}
+
+
+class Admission:
+    def __init__(self, classes: Dict[str, Tuple[int, int]], queue_timeout_s: float):
+        self._classes = {name: _CostClass(*limits) for name, limits in classes.items()}
+        self._timeout = queue_timeout_s
+        self._cond = threading.Condition()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    def _enter(self, cost_class: str, key: Hashable) -> Tuple[Future, bool]:
+        """
+        (future, is_leader). Leaders return holding a slot (waiting in the queue if needed);
+        followers return at once and wait on the leader's future (counted as queued).
+        """
+        cc = self._classes[cost_class]
+        with self._cond:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                if cc.queued >= cc.queue_limit:
+                    cc.stats["rejected"] += 1
+                    raise Overloaded(cost_class)
+                cc.queued += 1
+                cc.stats["coalesced"] += 1
+                return fut, False
+
+            if cc.running >= cc.slots and cc.queued >= cc.queue_limit:
+                cc.stats["rejected"] += 1
+                raise Overloaded(cost_class)
+            fut = self._inflight[key] = Future()  # followers may coalesce while we queue
+            if cc.running >= cc.slots:
+                cc.queued += 1
+                ok = self._cond.wait_for(lambda: cc.running < cc.slots, timeout=self._timeout)
+                cc.queued -= 1
+                if not ok:
+                    cc.stats["timeouts"] += 1
+                    del self._inflight[key]
+                    err = Overloaded(cost_class)
+                    fut.set_exception(err)
+                    raise err
+            cc.running += 1
+            cc.stats["computed"] += 1
+            return fut, True
+
+    def _leave_follower(self, cost_class: str) -> None:
+        with self._cond:
+            self._classes[cost_class].queued -= 1
+
+    def _leave_leader(self, cost_class: str, key: Hashable) -> None:
+        with self._cond:
+            self._classes[cost_class].running -= 1
+            self._inflight.pop(key, None)
+            self._cond.notify_all()
+
+    def run(self, cost_class: str, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn under admission control (blocking; for sync endpoints)"""
+        key = (cost_class, key)
+        fut, leader = self._enter(cost_class, key)
+        if not leader:
+            try:
+                return _unshare(fut.result())
+            finally:
+                self._leave_follower(cost_class)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            self._leave_leader(cost_class, key)
+        fut.set_result(_share(result))
+        return result
+
+    async def run_async(self, cost_class: str, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Async variant: queue waits happen off the event loop"""
+        key = (cost_class, key)
+        fut, leader = await asyncio.to_thread(self._enter, cost_class, key)
+        if not leader:
+            try:
+                return _unshare(await asyncio.wrap_future(fut))
+            finally:
+                self._leave_follower(cost_class)
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            self._leave_leader(cost_class, key)
+        fut.set_result(_share(result))
+        return result
+
+    def stats(self) -> Dict[str, dict]:
+        with self._cond:
+            return {
+                name: {**cc.stats, "running": cc.running, "queued": cc.queued,
+                       "slots": cc.slots, "queue_limit": cc.queue_limit}
+                for name, cc in self._classes.items()
+            }
+
+
+ADMISSION = Admission(COST_CLASSES, QUEUE_TIMEOUT_S)
+
+
+def _request_key(fn: Callable, kwargs: dict) -> Hashable:
+    """Endpoint identity + its (FastAPI keyword) parameters; lists etc. go through repr"""
+    return (fn.__module__, fn.__qualname__, repr(sorted(kwargs.items())))
+
+
+def guarded(cost_class: str) -> Callable:
+    """Endpoint decorator: single-flight + bounded concurrency for `cost_class`"""
+    if cost_class not in COST_CLASSES:
+        raise ValueError(f"Unknown cost class: {cost_class}")
+
+    def deco(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                return await ADMISSION.run_async(cost_class, _request_key(fn, kwargs), fn, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return ADMISSION.run(cost_class, _request_key(fn, kwargs), fn, *args, **kwargs)
+        return wrapper
+
+    return deco
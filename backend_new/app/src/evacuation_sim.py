@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+evacuation_sim.py
+- شبیه‌سازی زمان‌گام تخلیه: هزاران عامل از پارسل‌ها (ستون Pop) به سمت مقصدها
+- مسیر: درخت کوتاه‌ترین مسیر از همه‌ی مقصدها (یک Dijkstra چندمبدأ روی گراف وزن‌دار simulate_agent)
+- هر یال ظرفیت دارد (نفر/متر)؛ سرعت با چگالی کم می‌شود و ورود به یال پر در صف گره می‌ماند (FIFO)
+- وضعیت عامل‌ها و بار یال‌ها آرایه‌های NumPy‌اند و هر گام برداری جلو می‌رود
+- خروجی: منحنی تخلیه (درصد رسیده در زمان) + سری زمانی بار یال‌ها (فقط تغییرها، نه آرایه‌ی گام×یال)
+"""
+
+import argparse, time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import geopandas as gpd
+from scipy.sparse.csgraph import dijkstra
+
+try:
+    from . import simulate_agent as sa
+    from .road_network import NodeIndex, compile_graph
+except ImportError:  # اجرای مستقیم از داخل src
+    import simulate_agent as sa
+    from road_network import NodeIndex, compile_graph
+
+
+ROOT = Path(__file__).parent.resolve()
+FP_PARCELS = sa.pick_first(sa.DATA/"parcels_faizabad.geojson", ROOT.parent/"data"/"parcels_faizabad.geojson")
+OUT_NPZ = str(sa.OUT/"evacuation.npz")
+OUT_EDGES = str(sa.OUT/"evacuation_edges.geojson")
+
+# وضعیت عامل‌ها
+PENDING, WAITING, MOVING, ARRIVED, STRANDED = 0, 1, 2, 3, 4
+
+
+@dataclass
+class EvacParams:
+    dt_s: float = 2.0               # طول هر گام (ثانیه)
+    ticks: int = 1000
+    walk_speed_mps: float = 1.3     # سرعت آزاد
+    jam_density_ppm: float = 2.5    # چگالی انسداد: نفر به ازای هر متر طول
+    max_fill: float = 0.5           # ورود به یال تا این سهم از چگالی انسداد (بیشینه‌ی جریان)
+    min_speed_frac: float = 0.1     # کف سرعت در ازدحام
+    depart_spread_s: float = 120.0  # پخش زمان حرکت (یکنواخت)
+    agents_per_person: float = 1.0  # ضریب تعداد عامل نسبت به Pop
+    record_every: int = 1           # هر چند گام بار یال‌ها ثبت شود
+    seed: int = 0
+
+
+@dataclass
+class EvacResult:
+    t_s: np.ndarray            # زمان هر گام
+    arrived: np.ndarray        # تعداد تجمعی رسیده‌ها در هر گام
+    n_agents: int
+    stranded: int              # عامل‌های بی‌گره یا بدون راه به هیچ مقصدی
+    arrival_s: np.ndarray      # زمان رسیدن هر عامل (nan = نرسیده)
+    load_t_s: np.ndarray       # زمان‌های ثبت بار
+    # سری بار یال‌ها فقط به‌صورت تغییر: از ثبت load_rec[k] به بعد بار یال load_edge[k] برابر load_value[k]
+    load_rec: np.ndarray
+    load_edge: np.ndarray
+    load_value: np.ndarray
+    peak_load: np.ndarray      # بیشینه‌ی بار هر یال
+    mean_load: np.ndarray      # میانگین بار هر یال روی ثبت‌ها
+    busy_share: np.ndarray     # سهم ثبت‌هایی که یال بار داشت
+    edge_eid: np.ndarray       # یال کامپایل‌شده → eid در edges_allowed
+
+    def load_at(self, rec: int) -> np.ndarray:
+        """بار همه‌ی یال‌ها در ثبت rec (بازسازی از تغییرها)."""
+        load = np.zeros(len(self.peak_load), dtype=np.int32)
+        upto = np.searchsorted(self.load_rec, rec, side="right")
+        load[self.load_edge[:upto]] = self.load_value[:upto]  # تغییرهای بعدی روی قبلی‌ها می‌نشینند
+        return load
+
+    def clearance_s(self, share: float) -> float:
+        """زمانی که share از عامل‌های قابل‌تخلیه رسیده‌اند (nan اگر نرسیدند)."""
+        goal = share * (self.n_agents - self.stranded)
+        hit = np.flatnonzero(self.arrived >= goal) if goal > 0 else np.array([0])
+        return float(self.t_s[hit[0]]) if len(hit) else float("nan")
+
+
+# ------------- آماده‌سازی -------------
+def next_hops(cg, cost: np.ndarray, dest_nodes: np.ndarray):
+    """
+    یک Dijkstra چندمبدأ از همه‌ی مقصدها (گراف بی‌جهت است) → برای هر گره: گره‌ی بعدی و یال بعدی
+    به سمت نزدیک‌ترین مقصد. -1 یعنی مقصد یا بدون راه.
+    """
+    dist, pred, _ = dijkstra(cg.matrix(cost), directed=True, indices=np.unique(dest_nodes),
+                             min_only=True, return_predecessors=True)
+    nxt = pred.astype(np.int64)
+    nxt[nxt < 0] = -1
+    has = nxt >= 0
+    # شماره‌ی اسلات CSR هر (گره، گره‌ی بعدی) با یک searchsorted روی کلید سطر×n+ستون
+    n = cg.n_nodes
+    rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(cg.indptr))
+    keys = rows * n + cg.indices.astype(np.int64)
+    edge = np.full(n, -1, dtype=np.int64)
+    nodes = np.flatnonzero(has)
+    edge[nodes] = cg.slot_edge[np.searchsorted(keys, nodes * n + nxt[nodes])]
+    return nxt, edge, dist
+
+
+def seed_agents(parcels: gpd.GeoDataFrame, node_index: NodeIndex, params: EvacParams,
+                rng: np.random.Generator) -> np.ndarray:
+    """
+    گره‌ی شروع هر عامل: Pop هر پارسل × agents_per_person روی نزدیک‌ترین گره.
+    پارسل با هندسه‌ی خالی/اسنپ‌نشده ‎-1 می‌گیرد و عامل‌هایش در simulate گیرافتاده شمرده می‌شوند.
+    """
+    pop = np.nan_to_num(parcels["Pop"].to_numpy(dtype="float64"), nan=0.0).clip(min=0.0)
+    want = pop * params.agents_per_person
+    count = np.floor(want).astype(np.int64)
+    count += rng.random(len(want)) < (want - count)  # گردکردن تصادفی، جمع بدون سوگیری
+    snapped = node_index.snap_points(parcels.geometry.representative_point())
+    start = np.array([-1 if n is None else n for n in snapped], dtype=np.int64)
+    return np.repeat(start, count)
+
+
+# ------------- شبیه‌سازی -------------
+def simulate(cg, cost: np.ndarray, length: np.ndarray, dest_nodes: np.ndarray, start_nodes: np.ndarray,
+             params: Optional[EvacParams] = None) -> EvacResult:
+    """
+    cg/cost/length: گراف کامپایل‌شده و آرایه‌های هم‌ترتیب با یال‌هایش.
+    start_nodes: گره‌ی شروع هر عامل (اندیس cg، ‎-1 = بی‌گره). dest_nodes: گره‌های مقصد.
+    بار یال‌ها در هر ثبت فقط به‌صورت تغییر نسبت به ثبت قبلی نگه داشته می‌شود (+ بیشینه/میانگین/سهم
+    پرباری که در همان حلقه جمع می‌شوند)، پس حافظه با تعداد تغییرها بالا می‌رود نه گام×یال.
+    """
+    p = params or EvacParams()
+    rng = np.random.default_rng(p.seed)
+    nxt_node, nxt_edge, _ = next_hops(cg, cost, dest_nodes)
+    is_dest = np.zeros(cg.n_nodes, dtype=bool)
+    is_dest[dest_nodes] = True
+    jam = np.maximum(1.0, length * p.jam_density_ppm)
+    cap = np.maximum(1, np.floor(jam * p.max_fill)).astype(np.int64)
+    n_edges = cg.n_edges
+
+    n = len(start_nodes)
+    node = start_nodes.astype(np.int64).copy()
+    state = np.full(n, PENDING, dtype=np.int8)
+    edge = np.full(n, -1, dtype=np.int64)
+    to = np.full(n, -1, dtype=np.int64)
+    pos = np.zeros(n, dtype="float64")
+    since = np.zeros(n, dtype=np.int64)
+    depart = rng.uniform(0.0, p.depart_spread_s, n) if p.depart_spread_s > 0 else np.zeros(n)
+    arrival = np.full(n, np.nan)
+
+    # شروع روی مقصد = رسیده؛ بی‌گره یا بدون راه به مقصد = گیرافتاده
+    lost = node < 0
+    at = np.where(lost, 0, node)
+    on_dest = ~lost & is_dest[at]
+    state[on_dest] = ARRIVED
+    arrival[on_dest] = 0.0
+    state[(state == PENDING) & (lost | (nxt_edge[at] < 0))] = STRANDED
+    stranded = int((state == STRANDED).sum())
+
+    prev = np.zeros(n_edges, dtype=np.int32)
+    peak = np.zeros(n_edges, dtype=np.int32)
+    total = np.zeros(n_edges, dtype=np.int64)
+    busy = np.zeros(n_edges, dtype=np.int64)
+    changes = []  # (rec, edges, values) برای هر ثبتی که باری عوض شد
+    n_rec = 0
+    arrived = np.zeros(p.ticks, dtype=np.int64)
+    ids = np.arange(n)
+
+    for tick in range(p.ticks):
+        now = tick * p.dt_s
+
+        # 1) شروع حرکت: PENDING → WAITING (در صف گره‌ی شروع)
+        ready = np.flatnonzero((state == PENDING) & (depart <= now))
+        state[ready] = WAITING
+        since[ready] = tick
+
+        # 2) حرکت روی یال‌ها با سرعت وابسته به چگالی (Greenshields)
+        moving = np.flatnonzero(state == MOVING)
+        if len(moving):
+            e = edge[moving]
+            load = np.bincount(e, minlength=n_edges)
+            speed = p.walk_speed_mps * np.clip(1.0 - load / jam, p.min_speed_frac, 1.0)
+            pos[moving] += speed[e] * p.dt_s
+            done = moving[pos[moving] >= length[e]]
+            node[done] = to[done]
+            edge[done] = -1
+            pos[done] = 0.0
+            reached = done[is_dest[node[done]]]
+            state[reached] = ARRIVED
+            arrival[reached] = now + p.dt_s
+            queued = done[~is_dest[node[done]]]
+            state[queued] = WAITING
+            since[queued] = tick
+
+        # 3) ورود از صف گره به یال بعدی تا سقف ظرفیت آزاد (FIFO بر اساس زمان ورود به صف)
+        waiting = np.flatnonzero(state == WAITING)
+        if len(waiting):
+            want = nxt_edge[node[waiting]]
+            free = cap - np.bincount(edge[state == MOVING], minlength=n_edges)
+            order = np.lexsort((ids[waiting], since[waiting], want))
+            want_s = want[order]
+            first = np.searchsorted(want_s, want_s, side="left")
+            admit = (np.arange(len(order)) - first) < free[want_s]
+            a = waiting[order[admit]]
+            edge[a] = nxt_edge[node[a]]
+            to[a] = nxt_node[node[a]]
+            state[a] = MOVING
+
+        arrived[tick] = np.count_nonzero(state == ARRIVED)
+        if tick % p.record_every == 0:
+            cur = np.bincount(edge[state == MOVING], minlength=n_edges).astype(np.int32)
+            diff = np.flatnonzero(cur != prev)
+            if len(diff):
+                changes.append((n_rec, diff, cur[diff]))
+            np.maximum(peak, cur, out=peak)
+            total += cur
+            busy += cur > 0
+            prev = cur
+            n_rec += 1
+        if arrived[tick] + stranded == n:
+            arrived[tick:] = arrived[tick]
+            break
+
+    t_s = (np.arange(p.ticks) + 1) * p.dt_s
+    rec_of = [np.full(len(e), r, dtype=np.int64) for r, e, _ in changes]
+    return EvacResult(
+        t_s=t_s, arrived=arrived, n_agents=n, stranded=stranded, arrival_s=arrival,
+        load_t_s=np.arange(n_rec) * p.record_every * p.dt_s + p.dt_s,
+        load_rec=np.concatenate(rec_of) if changes else np.empty(0, dtype=np.int64),
+        load_edge=np.concatenate([e for _, e, _ in changes]) if changes else np.empty(0, dtype=np.int64),
+        load_value=np.concatenate([v for _, _, v in changes]) if changes else np.empty(0, dtype=np.int32),
+        peak_load=peak, mean_load=total / max(n_rec, 1), busy_share=busy / max(n_rec, 1),
+        edge_eid=np.empty(0, dtype=np.int64),
+    )
+
+
+def run(inputs: Optional["sa.SimInputs"] = None, network: Optional["sa.SimNetwork"] = None,
+        parcels: Optional[gpd.GeoDataFrame] = None, params: Optional[EvacParams] = None,
+        traits: Optional["sa.AgentTraits"] = None) -> tuple:
+    """گراف گرم simulate_agent + پارسل‌ها → (EvacResult, CompiledGraph)"""
+    params = params or EvacParams()
+    inputs = inputs or sa.load_inputs()
+    network = network or sa.prepare_network(inputs, sa.NETWORK_BUNDLE)
+    if parcels is None:
+        parcels = sa.to_metric(sa.read_geo(FP_PARCELS))
+    parcels = parcels.to_crs(network.edges_allowed.crs)
+
+    cg, edge_data = compile_graph(network.G, lambda n, d: (d["geom"].x, d["geom"].y))
+    eid = np.array([d["eid"] for d in edge_data], dtype=np.int64)
+    cost = sa.edge_costs(network.edges_allowed, traits or sa.AgentTraits(), inputs.temp_c)[eid]
+    length = network.edges_allowed["length"].to_numpy(dtype="float64")[eid]
+
+    node_index = NodeIndex(range(cg.n_nodes), cg.xy)
+    dest_nodes = np.array([n for n in node_index.snap_points(inputs.destinations.geometry) if n is not None],
+                          dtype=np.int64)
+    start_nodes = seed_agents(parcels, node_index, params, np.random.default_rng(params.seed))
+
+    result = simulate(cg, cost, length, dest_nodes, start_nodes, params)
+    result.edge_eid = eid
+    return result, cg
+
+
+def export(result: EvacResult, cg, crs, npz_path: str = OUT_NPZ, edges_path: str = OUT_EDGES) -> None:
+    """منحنی تخلیه + سری بار یال‌ها به‌صورت تغییر (npz) و بار بیشینه/میانگین هر یال (GeoJSON)."""
+    np.savez(npz_path, t_s=result.t_s, arrived=result.arrived, n_agents=result.n_agents,
+             stranded=result.stranded, load_t_s=result.load_t_s, load_rec=result.load_rec,
+             load_edge=result.load_edge, load_value=result.load_value, edge_eid=result.edge_eid)
+    gpd.GeoDataFrame({
+        "eid": result.edge_eid,
+        "peak_load": result.peak_load,
+        "mean_load": result.mean_load,
+        "busy_share": result.busy_share,
+    }, geometry=list(cg.edge_geoms), crs=crs).to_file(edges_path, driver="GeoJSON")
+
+
+# ------------- Main -------------
+def main():
+    ap = argparse.ArgumentParser(description="Time-stepped evacuation flow on the road network.")
+    ap.add_argument("--agents-per-person", type=float, default=1.0)
+    ap.add_argument("--ticks", type=int, default=1000)
+    ap.add_argument("--dt", type=float, default=2.0, help="seconds per tick")
+    ap.add_argument("--record-every", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    params = EvacParams(dt_s=args.dt, ticks=args.ticks, agents_per_person=args.agents_per_person,
+                        record_every=args.record_every, seed=args.seed)
+    inputs = sa.load_inputs()
+    t0 = time.perf_counter()
+    result, cg = run(inputs=inputs, params=params)
+    print(f"🚶 {result.n_agents} عامل، {result.stranded} بدون راه — {time.perf_counter() - t0:.2f}s")
+    for share in (0.5, 0.9, 1.0):
+        t = result.clearance_s(share)
+        print(f"⏱️ تخلیه‌ی {share:.0%}: " + (f"{t:.0f}s" if np.isfinite(t) else "در بازه‌ی شبیه‌سازی نرسید"))
+
+    export(result, cg, inputs.roads.crs)
+    print(f"🟢 خروجی → {OUT_NPZ} , {OUT_EDGES}")
+
+
+if __name__ == "__main__":
+    main()
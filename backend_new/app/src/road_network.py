@@ -0,0 +1,1183 @@
+# backend/app/src/road_network.py
+"""
+road_network.py
+- Shared road-network helpers for features/transport_agent_api.py and simulate_agent.py
+- Array-based structures built once per graph and reused for every query
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import multiprocessing as mp
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from itertools import count
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+from shapely.strtree import STRtree
+
+ROUTING_BACKENDS = ("networkx", "csr")
+CSR_SOURCE_BLOCK = 64  # sources per csgraph call (bounds the k × n distance matrix)
+BATCHES_PER_WORKER = 4  # OD batches per worker process (load balancing)
+MAX_ROUTING_WORKERS = os.cpu_count() or 1  # size of the one shared routing process pool
+WEIGHTING_CACHE_SIZE = 8  # prepared weight vectors kept per graph (point-to-point searches)
+BUNDLE_FORMAT = 1  # bump when the layout of compiled network bundles changes
+
+
+# ------------- Topology -------------
+@dataclass
+class Topology:
+    """
+    Noded road network with integer node ids 0..n-1, ready for a CSR graph.
+    - node i at xy[i]; edge k: edge_u[k]–edge_v[k], geometry edge_geoms[k]
+    """
+    xy: np.ndarray
+    edge_u: np.ndarray
+    edge_v: np.ndarray
+    edge_geoms: np.ndarray
+
+
+def build_topology(lines, snap_tol: float = 0.5, node_crossings: bool = True, levels=None) -> Topology:
+    """
+    Road LineStrings → integer-id edges, with vectorized shapely/NumPy steps only:
+    1) MultiLineStrings are exploded into their parts; other geometry types are ignored
+    2) node_crossings: shapely.node splits lines at every interior intersection (duplicate
+       segments dissolve); otherwise the lines are used as they are
+    3) endpoints within snap_tol of each other merge into one node (cluster_within, complete
+       linkage, so close endpoints do not chain); a node sits at its cluster's lowest (x, y) endpoint
+    4) zero-length/self-loop edges are dropped; parallel edges keep the shortest geometry
+
+    The network is planar within a level: without `levels` every crossing becomes a junction,
+    bridges and underpasses included. `levels` (one number per input line, e.g. an OSM `layer`)
+    restricts the splitting to lines of the same level (NaN counts as 0), so lines on different levels connect
+    only where their endpoints meet. Z values are not used for topology.
+    """
+    geoms = np.asarray(list(lines), dtype=object)
+    level = np.zeros(len(geoms)) if levels is None else np.nan_to_num(np.asarray(levels, dtype="float64"))
+    if len(level) != len(geoms):
+        raise ValueError("levels must have one value per line")
+    if len(geoms):
+        geoms, part_of = shapely.get_parts(geoms, return_index=True)
+        level = level[part_of]
+        ok = (shapely.get_type_id(geoms) == 1) & (shapely.length(geoms) > 0)
+        geoms, level = np.asarray(geoms[ok], dtype=object), level[ok]
+    if len(geoms) and node_crossings:
+        geoms = np.concatenate([
+            np.asarray(shapely.get_parts(shapely.node(shapely.multilinestrings(geoms[level == lv]))), dtype=object)
+            for lv in np.unique(level)
+        ])
+    m = len(geoms)
+    if not m:
+        empty = np.empty(0, dtype=np.int64)
+        return Topology(np.empty((0, 2)), empty, empty.copy(), np.empty(0, dtype=object))
+
+    ends = shapely.get_coordinates(np.concatenate([shapely.get_point(geoms, 0), shapely.get_point(geoms, -1)]))
+    uniq, inverse = np.unique(ends, axis=0, return_inverse=True)
+    cluster = cluster_within(uniq, snap_tol)
+    node_of = cluster[inverse.ravel()]
+    u, v = node_of[:m], node_of[m:]
+
+    keep = np.flatnonzero(u != v)
+    lo, hi = np.minimum(u[keep], v[keep]), np.maximum(u[keep], v[keep])
+    order = np.lexsort((shapely.length(geoms[keep]), hi, lo))
+    first = order[np.r_[True, (lo[order][1:] != lo[order][:-1]) | (hi[order][1:] != hi[order][:-1])]]
+    keep = keep[np.sort(first)]  # input order, one edge per node pair
+
+    # compact ids over the nodes still in use; coordinates from each cluster's first endpoint
+    used, ids = np.unique(np.concatenate([u[keep], v[keep]]), return_inverse=True)
+    _, rep = np.unique(cluster, return_index=True)
+    return Topology(
+        xy=uniq[rep[used]],
+        edge_u=ids[:len(keep)].astype(np.int64),
+        edge_v=ids[len(keep):].astype(np.int64),
+        edge_geoms=geoms[keep],
+    )
+
+
+def cluster_within(xy: np.ndarray, tol: float, groups: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Cluster label (0..k-1) per point with complete linkage: every two points of a cluster are
+    within tol, so a chain of close points never merges end to end. KD-tree pairs are merged
+    closest first; a merge that would stretch the cluster beyond tol is skipped, and so is one
+    that would put two points of the same group (e.g. both ends of one line) in one cluster.
+    tol ≤ 0 keeps every point on its own.
+    """
+    xy = np.asarray(xy, dtype="float64").reshape(-1, 2)
+    n = len(xy)
+    if tol <= 0 or n < 2:
+        return np.arange(n)
+    pairs = cKDTree(xy).query_pairs(float(tol), output_type="ndarray")
+    if not len(pairs):
+        return np.arange(n)
+    d = np.hypot(*(xy[pairs[:, 0]] - xy[pairs[:, 1]]).T)
+    label = np.arange(n)
+    members: Dict[int, List[int]] = {}
+    for a, b in pairs[np.argsort(d, kind="stable")].tolist():
+        ca, cb = label[a], label[b]
+        if ca == cb:
+            continue
+        ma, mb = members.get(ca, [ca]), members.get(cb, [cb])
+        if groups is not None and not set(groups[ma].tolist()).isdisjoint(groups[mb].tolist()):
+            continue
+        gap = xy[ma][:, None, :] - xy[mb][None, :, :]
+        if np.hypot(gap[..., 0], gap[..., 1]).max() > tol:
+            continue
+        if len(ma) < len(mb):
+            ca, cb, ma, mb = cb, ca, mb, ma
+        label[mb] = ca
+        members[ca] = ma + mb
+        members.pop(cb, None)
+    return np.unique(label, return_inverse=True)[1].ravel()
+
+
+# ------------- Nearest-node snapping -------------
+class NodeIndex:
+    """
+    Node coordinates as an (n, 2) array + STRtree, built once per graph.
+    snap_points() resolves any number of points with a single nearest query.
+    """
+
+    def __init__(self, node_ids: Sequence[Hashable], xy: np.ndarray):
+        self.node_ids: List[Hashable] = list(node_ids)
+        self.xy = np.asarray(xy, dtype="float64").reshape(-1, 2)
+        self._tree = STRtree(shapely.points(self.xy))
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def snap_points(self, points) -> List[Optional[Hashable]]:
+        """
+        points: sequence of shapely Points or an (n, 2) coordinate array.
+        Returns the nearest node id per point (None for empty/missing points).
+        """
+        pts = _as_points(points)
+        out: List[Optional[Hashable]] = [None] * len(pts)
+        if not len(pts) or not len(self.node_ids):
+            return out
+        in_idx, tree_idx = self._tree.query_nearest(pts, all_matches=False)
+        for i, j in zip(in_idx.tolist(), tree_idx.tolist()):
+            out[i] = self.node_ids[j]
+        return out
+
+
+# ------------- One-to-many search -------------
+def shortest_paths_from(
+    G,
+    source: Hashable,
+    targets: Iterable[Hashable],
+    weight: Union[str, Callable] = "weight",
+) -> Dict[Hashable, List[Hashable]]:
+    """
+    Single-source Dijkstra on a networkx graph that stops once every target is settled.
+    Returns {target: node path} for the reachable targets (one search serves all of them).
+    """
+    if isinstance(weight, str):
+        key = weight
+
+        def by_key(u, v, d):
+            return d.get(key, 1.0)
+        weight = by_key
+
+    remaining = set(targets)
+    if source not in G:
+        return {}
+    dist = {source: 0.0}
+    pred: Dict[Hashable, Hashable] = {}
+    settled = set()
+    tie = count()
+    heap = [(0.0, next(tie), source)]
+    found: Dict[Hashable, List[Hashable]] = {}
+    adj = G._adj
+
+    while heap and remaining:
+        d, _, n = heapq.heappop(heap)
+        if n in settled:
+            continue
+        settled.add(n)
+        if n in remaining:
+            remaining.discard(n)
+            path = [n]
+            while path[-1] != source:
+                path.append(pred[path[-1]])
+            found[n] = path[::-1]
+        for m, data in adj[n].items():
+            if m in settled:
+                continue
+            nd = d + weight(n, m, data)
+            if nd < dist.get(m, float("inf")):
+                dist[m] = nd
+                pred[m] = n
+                heapq.heappush(heap, (nd, next(tie), m))
+    return found
+
+
+# ------------- CSR routing backend -------------
+@dataclass
+class Weighting:
+    """
+    One weight vector prepared for repeated point-to-point searches: per-slot weights of the
+    searched graph as a Python list and the A* heuristic scale (plus, on a Contraction, prefix
+    sums of member weights for attaching chain nodes). Built once per weighting, not per query.
+    """
+    edge_weights: np.ndarray
+    slot_w: List[float]
+    scale: float
+    prefix: Optional[np.ndarray] = None
+
+
+_WEIGHTING_LOCK = threading.Lock()
+
+
+def _cached_weighting(cache: "OrderedDict[Hashable, Weighting]", key: Optional[Hashable],
+                      build: Callable[[], Weighting]) -> Weighting:
+    """LRU of prepared weightings per graph; key=None always builds (nothing is stored)"""
+    if key is None:
+        return build()
+    with _WEIGHTING_LOCK:
+        hit = cache.get(key)
+        if hit is not None:
+            cache.move_to_end(key)
+            return hit
+    hit = build()
+    with _WEIGHTING_LOCK:
+        cache[key] = hit
+        while len(cache) > WEIGHTING_CACHE_SIZE:
+            cache.popitem(last=False)
+    return hit
+
+
+@dataclass
+class CompiledGraph:
+    """
+    Undirected road graph compiled to integer ids and CSR arrays.
+    - node i ↔ node_ids[i], coordinates xy[i]
+    - edge k: edge_u[k]–edge_v[k], geometry edge_geoms[k]
+    - CSR slot j (one per direction): neighbour indices[j], edge slot_edge[j]
+    Weights are plain per-edge arrays, so one compiled graph serves any weighting.
+    A* reads list adjacency (adjacency(), built once) and prepared weightings (weighting()).
+    """
+    node_ids: List[Hashable]
+    xy: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    slot_edge: np.ndarray
+    edge_u: np.ndarray
+    edge_v: np.ndarray
+    edge_geoms: np.ndarray
+    shared: Optional["SharedGraph"] = field(default=None, repr=False, compare=False)
+    lists: Optional[tuple] = field(default=None, repr=False, compare=False)
+    weightings: "OrderedDict[Hashable, Weighting]" = field(default_factory=OrderedDict, repr=False, compare=False)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.xy)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edge_u)
+
+    def node_pos(self) -> Dict[Hashable, int]:
+        return {n: i for i, n in enumerate(self.node_ids)}
+
+    def matrix(self, edge_weights: np.ndarray) -> csr_matrix:
+        w = np.asarray(edge_weights, dtype="float64")[self.slot_edge]
+        return csr_matrix((w, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))
+
+    def shortest_paths(
+        self,
+        sources: Sequence[int],
+        targets: Sequence[int],
+        edge_weights: np.ndarray,
+    ) -> List[Optional[List[int]]]:
+        """Node-index path per (source, target) pair; one csgraph search per unique source"""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        out: List[Optional[List[int]]] = [None] * len(sources)
+        if not len(sources):
+            return out
+        mat = self.matrix(edge_weights)
+        uniq, inv = np.unique(sources, return_inverse=True)
+        for b in range(0, len(uniq), CSR_SOURCE_BLOCK):
+            block = uniq[b:b + CSR_SOURCE_BLOCK]
+            dist, pred = dijkstra(mat, directed=True, indices=block, return_predecessors=True)
+            for i in np.flatnonzero((inv >= b) & (inv < b + len(block))).tolist():
+                row, t = inv[i] - b, int(targets[i])
+                if np.isfinite(dist[row, t]):
+                    out[i] = _walk_predecessors(pred[row], int(sources[i]), t)
+        return out
+
+    def cost_matrix(
+        self,
+        sources: Sequence[int],
+        targets: Sequence[int],
+        edge_weights: np.ndarray,
+    ) -> np.ndarray:
+        """
+        (len(sources), len(targets)) shortest-path costs, inf when unreachable. The graph is
+        undirected, so csgraph searches start from whichever side has fewer unique nodes.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        if not len(sources) or not len(targets):
+            return np.full((len(sources), len(targets)), np.inf)
+        us, inv_s = np.unique(sources, return_inverse=True)
+        ut, inv_t = np.unique(targets, return_inverse=True)
+        flip = len(ut) < len(us)
+        seeds, other = (ut, us) if flip else (us, ut)
+        mat = self.matrix(edge_weights)
+        costs = np.empty((len(seeds), len(other)))
+        for b in range(0, len(seeds), CSR_SOURCE_BLOCK):
+            dist = dijkstra(mat, directed=True, indices=seeds[b:b + CSR_SOURCE_BLOCK])
+            costs[b:b + len(dist)] = dist[:, other]
+        if flip:
+            costs = costs.T
+        return costs[np.ix_(inv_s, inv_t)]
+
+    def bounded_costs(self, seeds: Sequence[int], edge_weights: np.ndarray, limit: float) -> np.ndarray:
+        """Cost from the nearest seed to every node (one multi-source search, inf beyond limit)"""
+        seeds = np.unique(np.asarray(seeds, dtype=np.int64))
+        return dijkstra(self.matrix(edge_weights), directed=True, indices=seeds,
+                        limit=float(limit), min_only=True)
+
+    def service_area(
+        self,
+        seeds: Sequence[int],
+        edge_weights: np.ndarray,
+        limit: float,
+        breaks: Optional[Sequence[float]] = None,
+    ) -> dict:
+        """
+        Edge pieces reachable within `limit` from any seed. Each piece is entered from one end of
+        its edge (reverse=True: from edge_v) and covers the fractions lo..hi of the edge measured
+        from that end; its cost rises from `start` to `end` along it.
+        From each reached end the reach runs until the budget is spent or, when the other end is
+        reached too, until the point where the costs from both ends meet ((du + dv + w) / 2), so a
+        fully reachable edge is two pieces and a partly reachable one leaves its middle uncovered.
+        breaks: ascending cost thresholds inside (0, limit); pieces are cut where they cross one
+        and `band` is the index of the interval each piece lies in (0 without breaks).
+        full: the piece's edge is reachable end to end.
+        """
+        w = np.asarray(edge_weights, dtype="float64")
+        dist = self.bounded_costs(seeds, w, limit)
+        du, dv = dist[self.edge_u], dist[self.edge_v]
+        fu, fv = np.isfinite(du), np.isfinite(dv)
+        meet = (du + dv + w) / 2.0
+        safe_w = np.maximum(w, 1e-12)
+        with np.errstate(invalid="ignore"):
+            hi_u = np.where(fu, np.clip((np.where(fv, np.minimum(meet, limit), limit) - du) / safe_w, 0.0, 1.0), 0.0)
+            hi_v = np.where(fv, np.clip((np.where(fu, np.minimum(meet, limit), limit) - dv) / safe_w, 0.0, 1.0), 0.0)
+        full_edge = hi_u + hi_v >= 1.0 - 1e-9
+
+        from_u, from_v = np.flatnonzero(hi_u > 0), np.flatnonzero(hi_v > 0)
+        edge = np.concatenate([from_u, from_v])
+        reverse = np.r_[np.zeros(len(from_u), dtype=bool), np.ones(len(from_v), dtype=bool)]
+        entry = np.concatenate([du[from_u], dv[from_v]])
+        ew = safe_w[edge]
+        start = entry
+        end = entry + np.concatenate([hi_u[from_u], hi_v[from_v]]) * ew
+        band = np.zeros(len(edge), dtype=np.int64)
+
+        cuts = np.asarray(breaks if breaks is not None else [], dtype="float64")
+        if len(cuts) and len(edge):
+            first = np.searchsorted(cuts, start, side="right")  # band of each piece's entry
+            n_cut = np.maximum(np.searchsorted(cuts, end, side="left") - first, 0)
+            piece = np.repeat(np.arange(len(edge)), n_cut + 1)
+            k = np.arange(len(piece)) - np.repeat(np.cumsum(n_cut + 1) - (n_cut + 1), n_cut + 1)
+            band = first[piece] + k
+            top = len(cuts) - 1
+            seg_start = np.where(k == 0, start[piece], cuts[np.clip(band - 1, 0, top)])
+            seg_end = np.where(k == n_cut[piece], end[piece], cuts[np.clip(band, 0, top)])
+            edge, reverse, entry, ew = edge[piece], reverse[piece], entry[piece], ew[piece]
+            start, end = seg_start, seg_end
+
+        lo = np.clip((start - entry) / ew, 0.0, 1.0)
+        hi = np.clip((end - entry) / ew, 0.0, 1.0)
+        order = np.argsort(edge, kind="stable")
+        order = order[hi[order] > lo[order]]
+        return {
+            "node_cost": dist,
+            "edge": edge[order],
+            "reverse": reverse[order],
+            "lo": lo[order],
+            "hi": hi[order],
+            "start": start[order],
+            "end": end[order],
+            "band": band[order],
+            "full": full_edge[edge[order]],
+        }
+
+    def heuristic_scale(self, edge_weights: np.ndarray) -> float:
+        """
+        Largest k with k × chord(u, v) ≤ w(u, v) on every edge. Then k × euclid(n, target) never
+        overestimates and is consistent (weights ≥ 0.1 × length ≥ 0.1 × chord keep k > 0).
+        """
+        w = np.asarray(edge_weights, dtype="float64")
+        d = self.xy[self.edge_u] - self.xy[self.edge_v]
+        chord = np.hypot(d[:, 0], d[:, 1])
+        ok = chord > 0
+        return float(np.min(w[ok] / chord[ok])) if ok.any() else 0.0
+
+    def adjacency(self) -> Tuple[List[int], List[int], List[float], List[float]]:
+        """(indptr, indices, xs, ys) as Python lists, built once per graph for A*"""
+        if self.lists is None:
+            self.lists = (self.indptr.tolist(), self.indices.tolist(),
+                          self.xy[:, 0].tolist(), self.xy[:, 1].tolist())
+        return self.lists
+
+    def weighting(self, edge_weights: np.ndarray, key: Optional[Hashable] = None) -> Weighting:
+        """edge_weights prepared for point_to_point; with a key, kept in a small per-graph LRU"""
+        def build() -> Weighting:
+            w = np.asarray(edge_weights, dtype="float64")
+            return Weighting(w, w[self.slot_edge].tolist(), self.heuristic_scale(w))
+        return _cached_weighting(self.weightings, key, build)
+
+    def point_to_point(
+        self,
+        source: int,
+        target: int,
+        edge_weights: Union[np.ndarray, Weighting],
+        scale: Optional[float] = None,
+    ) -> Tuple[Optional[List[int]], float, int]:
+        """
+        A* from source to target with the Euclidean heuristic scale × distance
+        (scale=None → heuristic_scale of the weighting, scale=0 → plain Dijkstra).
+        Pass a prepared Weighting so only the search itself runs per query.
+        Returns (node-index path or None, cost, nodes settled).
+        """
+        wt = edge_weights if isinstance(edge_weights, Weighting) else self.weighting(edge_weights)
+        if scale is None:
+            scale = wt.scale
+        indptr, indices, xs, ys = self.adjacency()
+        slot_w = wt.slot_w
+        tx, ty = xs[target], ys[target]
+
+        def h(n: int) -> float:
+            return scale * math.hypot(xs[n] - tx, ys[n] - ty)
+
+        dist = {source: 0.0}
+        pred: Dict[int, int] = {}
+        settled = set()
+        heap = [(h(source), 0.0, source)]
+        while heap:
+            _, d, n = heapq.heappop(heap)
+            if n in settled:
+                continue
+            settled.add(n)
+            if n == target:
+                path = [n]
+                while path[-1] != source:
+                    path.append(pred[path[-1]])
+                return path[::-1], d, len(settled)
+            for j in range(indptr[n], indptr[n + 1]):
+                m = indices[j]
+                if m in settled:
+                    continue
+                nd = d + slot_w[j]
+                if nd < dist.get(m, math.inf):
+                    dist[m] = nd
+                    pred[m] = n
+                    heapq.heappush(heap, (nd + h(m), nd, m))
+        return None, math.inf, len(settled)
+
+    def path_edges(self, path: Sequence[int]) -> np.ndarray:
+        """Edge ids along a node-index path"""
+        eids = np.empty(max(len(path) - 1, 0), dtype=np.int64)
+        for k in range(len(eids)):
+            u, v = path[k], path[k + 1]
+            lo, hi = self.indptr[u], self.indptr[u + 1]
+            j = lo + np.searchsorted(self.indices[lo:hi], v)
+            eids[k] = self.slot_edge[j]
+        return eids
+
+
+def compile_graph(
+    G,
+    xy_of: Callable[[Hashable, dict], Tuple[float, float]],
+) -> Tuple[CompiledGraph, List[dict]]:
+    """
+    networkx Graph → CompiledGraph. Also returns the edge attribute dicts in edge-id order,
+    so callers can lift any attribute into an array aligned with the compiled edges.
+    """
+    node_ids = list(G.nodes)
+    pos = {n: i for i, n in enumerate(node_ids)}
+    xy = np.array([xy_of(n, G.nodes[n]) for n in node_ids], dtype="float64").reshape(-1, 2)
+
+    edge_data = []
+    eu, ev = [], []
+    for u, v, d in G.edges(data=True):
+        eu.append(pos[u])
+        ev.append(pos[v])
+        edge_data.append(d)
+    edge_u = np.asarray(eu, dtype=np.int64)
+    edge_v = np.asarray(ev, dtype=np.int64)
+    geoms = np.empty(len(edge_data), dtype=object)
+    geoms[:] = [d.get("geometry") for d in edge_data]
+
+    indptr, indices, slot_edge = _csr_arrays(len(node_ids), edge_u, edge_v)
+    cg = CompiledGraph(node_ids, xy, indptr, indices, slot_edge, edge_u, edge_v, geoms)
+    return cg, edge_data
+
+
+def _csr_arrays(n: int, edge_u: np.ndarray, edge_v: np.ndarray):
+    """Both directions of every edge, rows sorted by (source, neighbour)"""
+    m = len(edge_u)
+    rows = np.concatenate([edge_u, edge_v])
+    cols = np.concatenate([edge_v, edge_u])
+    slot_edge = np.concatenate([np.arange(m), np.arange(m)])
+    order = np.lexsort((cols, rows))
+    rows, cols, slot_edge = rows[order], cols[order], slot_edge[order]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols.astype(np.int32), slot_edge.astype(np.int64)
+
+
+def _walk_predecessors(pred_row: np.ndarray, source: int, target: int) -> List[int]:
+    path = [target]
+    while path[-1] != source:
+        path.append(int(pred_row[path[-1]]))
+    return path[::-1]
+
+
+# ------------- Degree-2 contraction -------------
+@dataclass
+class Contraction:
+    """
+    CompiledGraph with its degree-2 chains folded into single edges: same costs and paths,
+    far fewer nodes to settle.
+    - core: CompiledGraph over the kept nodes (junctions, dead ends); core node i ↔ full node kept[i]
+    - chain c (= core edge c): full edges members[ptr[c]:ptr[c+1]], walked from core.edge_u[c]
+      to core.edge_v[c]; member j ends at full node reach[j] (interior nodes, then the far end)
+    - an interior full node n lies on chain node_chain[n] at member slot node_slot[n]
+      (both -1 for kept nodes); a kept full node n is core node node_core[n] (else -1)
+    Per-request weights stay per full edge; chain weights are their segment sums. Searches attach
+    interior sources/targets to both ends of their chain and report paths as full node indices,
+    so callers keep rendering full edges (full.path_edges) exactly as before.
+    """
+    full: CompiledGraph
+    core: CompiledGraph
+    kept: np.ndarray
+    ptr: np.ndarray
+    members: np.ndarray
+    reach: np.ndarray
+    node_chain: np.ndarray
+    node_slot: np.ndarray
+    node_core: np.ndarray
+    weightings: "OrderedDict[Hashable, Weighting]" = field(default_factory=OrderedDict, repr=False, compare=False)
+
+    def chain_weights(self, edge_weights: np.ndarray) -> np.ndarray:
+        """Core edge weights: sum of member weights per chain"""
+        w = np.asarray(edge_weights, dtype="float64")[self.members]
+        return np.add.reduceat(w, self.ptr[:-1]) if len(w) else w
+
+    def _prefix(self, edge_weights: np.ndarray) -> np.ndarray:
+        """Prefix sums of member weights in chain order (cost along a chain = difference)"""
+        return np.r_[0.0, np.cumsum(np.asarray(edge_weights, dtype="float64")[self.members])]
+
+    def weighting(self, edge_weights: np.ndarray, key: Optional[Hashable] = None) -> Weighting:
+        """Core slot weights + member prefix sums + full-graph heuristic scale, cached per key"""
+        def build() -> Weighting:
+            w = np.asarray(edge_weights, dtype="float64")
+            return Weighting(w, self.chain_weights(w)[self.core.slot_edge].tolist(),
+                             self.full.heuristic_scale(w), self._prefix(w))
+        return _cached_weighting(self.weightings, key, build)
+
+    def _attach(self, nodes: np.ndarray, prefix: np.ndarray) -> dict:
+        """
+        Both ways onto the core for every full node: (end0, off0) towards the chain start,
+        (end1, off1) towards the chain end; kept nodes attach to themselves at cost 0.
+        pos = cost from the chain start (for same-chain pairs). prefix: _prefix(edge_weights).
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        chain = self.node_chain[nodes]
+        inner = chain >= 0
+        end0 = self.node_core[nodes]
+        end1 = end0.copy()
+        off0 = np.zeros(len(nodes))
+        off1 = np.zeros(len(nodes))
+        pos = np.zeros(len(nodes))
+        if inner.any():
+            c = chain[inner]
+            pos[inner] = prefix[self.node_slot[nodes[inner]] + 1] - prefix[self.ptr[c]]
+            end0[inner], end1[inner] = self.core.edge_u[c], self.core.edge_v[c]
+            off0[inner] = pos[inner]
+            off1[inner] = prefix[self.ptr[c + 1]] - prefix[self.ptr[c]] - pos[inner]
+        return {"chain": chain, "pos": pos, "end": (end0, end1), "off": (off0, off1)}
+
+    def cost_matrix(self, sources: Sequence[int], targets: Sequence[int], edge_weights: np.ndarray) -> np.ndarray:
+        """Same result as full.cost_matrix, searched on the core"""
+        prefix = self._prefix(edge_weights)
+        s = self._attach(sources, prefix)
+        t = self._attach(targets, prefix)
+        s_nodes = np.unique(np.concatenate(s["end"]))
+        t_nodes = np.unique(np.concatenate(t["end"]))
+        core = self.core.cost_matrix(s_nodes, t_nodes, self.chain_weights(edge_weights))
+        out = np.full((len(s["pos"]), len(t["pos"])), np.inf)
+        for se, so in zip(s["end"], s["off"]):
+            for te, to in zip(t["end"], t["off"]):
+                sub = core[np.ix_(np.searchsorted(s_nodes, se), np.searchsorted(t_nodes, te))]
+                np.minimum(out, so[:, None] + sub + to[None, :], out=out)
+        same = (s["chain"][:, None] == t["chain"][None, :]) & (s["chain"][:, None] >= 0)
+        if same.any():
+            direct = np.abs(s["pos"][:, None] - t["pos"][None, :])
+            out = np.where(same, np.minimum(out, direct), out)
+        return out
+
+    def _chain_nodes(self, c: int) -> List[int]:
+        """Full nodes of chain c from its start to its end"""
+        return [int(self.kept[self.core.edge_u[c]])] + self.reach[self.ptr[c]:self.ptr[c + 1]].tolist()
+
+    def _leg(self, node: int, to_end: int) -> List[int]:
+        """Full nodes from `node` along its chain to chain end 0/1 (just [node] for kept nodes)"""
+        c = int(self.node_chain[node])
+        if c < 0:
+            return [node]
+        seq = self._chain_nodes(c)
+        i = int(self.node_slot[node] - self.ptr[c]) + 1
+        return seq[i::-1] if to_end == 0 else seq[i:]
+
+    def _expand(self, core_path: Sequence[int]) -> List[int]:
+        """Core node path → full node path"""
+        out = [int(self.kept[core_path[0]])]
+        for a, c in zip(core_path[:-1], self.core.path_edges(core_path).tolist()):
+            seq = self._chain_nodes(c)
+            out.extend(seq[1:] if self.core.edge_u[c] == a else seq[-2::-1])
+        return out
+
+    def _join(self, source: int, target: int, se: int, te: int, core_path: Sequence[int]) -> List[int]:
+        head = self._leg(source, se)
+        tail = self._leg(target, te)[::-1]
+        return head[:-1] + self._expand(core_path) + tail[1:]
+
+    def _same_chain_path(self, source: int, target: int) -> List[int]:
+        seq = self._chain_nodes(int(self.node_chain[source]))
+        i, j = seq.index(source), seq.index(target)
+        return seq[i:j + 1] if i <= j else seq[i:j - 1 if j else None:-1]
+
+    def shortest_paths(
+        self,
+        sources: Sequence[int],
+        targets: Sequence[int],
+        edge_weights: np.ndarray,
+    ) -> List[Optional[List[int]]]:
+        """Same contract as CompiledGraph.shortest_paths (full node-index paths)"""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        out: List[Optional[List[int]]] = [None] * len(sources)
+        if not len(sources):
+            return out
+        prefix = self._prefix(edge_weights)
+        s = self._attach(sources, prefix)
+        t = self._attach(targets, prefix)
+        s_nodes = np.unique(np.concatenate(s["end"]))
+        t_nodes = np.unique(np.concatenate(t["end"]))
+        wc = self.chain_weights(edge_weights)
+        core = self.core.cost_matrix(s_nodes, t_nodes, wc)
+
+        # best (source end, target end) per pair, or the direct chain stretch
+        best = np.full(len(sources), np.inf)
+        pick = np.zeros((len(sources), 2), dtype=np.int64)
+        for a in (0, 1):
+            for b in (0, 1):
+                cost = (s["off"][a] + t["off"][b]
+                        + core[np.searchsorted(s_nodes, s["end"][a]), np.searchsorted(t_nodes, t["end"][b])])
+                better = cost < best
+                best[better], pick[better] = cost[better], (a, b)
+        direct = (s["chain"] == t["chain"]) & (s["chain"] >= 0)
+        direct &= np.abs(s["pos"] - t["pos"]) <= best
+        ok = np.flatnonzero(np.isfinite(best) & ~direct)
+        core_paths = self.core.shortest_paths(
+            [s["end"][pick[i, 0]][i] for i in ok], [t["end"][pick[i, 1]][i] for i in ok], wc,
+        )
+        for i, cp in zip(ok.tolist(), core_paths):
+            if cp is not None:
+                out[i] = self._join(int(sources[i]), int(targets[i]), int(pick[i, 0]), int(pick[i, 1]), cp)
+        for i in np.flatnonzero(direct).tolist():
+            out[i] = self._same_chain_path(int(sources[i]), int(targets[i]))
+        return out
+
+    def point_to_point(
+        self,
+        source: int,
+        target: int,
+        edge_weights: Union[np.ndarray, Weighting],
+        scale: Optional[float] = None,
+    ) -> Tuple[Optional[List[int]], float, int]:
+        """
+        CompiledGraph.point_to_point on the core: A* starts from both ends of the source's chain
+        and finishes through both ends of the target's chain (each with its partial chain cost).
+        k × euclid(n, target) stays a lower bound because chain weights sum member weights.
+        Pass a prepared Weighting (self.weighting) so only the search itself runs per query.
+        """
+        wt = edge_weights if isinstance(edge_weights, Weighting) else self.weighting(edge_weights)
+        if scale is None:
+            scale = wt.scale
+        s = self._attach([source], wt.prefix)
+        t = self._attach([target], wt.prefix)
+        best, best_end = math.inf, None
+        if s["chain"][0] >= 0 and s["chain"][0] == t["chain"][0]:
+            best = abs(float(s["pos"][0] - t["pos"][0]))
+        goals: Dict[int, Tuple[float, int]] = {}  # core node → (cost on to the target, target end)
+        for b in (0, 1):
+            n, off = int(t["end"][b][0]), float(t["off"][b][0])
+            if off < goals.get(n, (math.inf, b))[0]:
+                goals[n] = (off, b)
+
+        indptr, indices, xs, ys = self.core.adjacency()
+        slot_w = wt.slot_w
+        tx, ty = self.full.xy[target]
+
+        def h(n: int) -> float:
+            return scale * math.hypot(xs[n] - tx, ys[n] - ty)
+
+        dist: Dict[int, float] = {}
+        start_end: Dict[int, int] = {}
+        pred: Dict[int, int] = {}
+        heap = []
+        for a in (0, 1):
+            n, off = int(s["end"][a][0]), float(s["off"][a][0])
+            if off < dist.get(n, math.inf):
+                dist[n], start_end[n] = off, a
+                heapq.heappush(heap, (off + h(n), off, n))
+        settled = set()
+        while heap:
+            f, d, n = heapq.heappop(heap)
+            if f >= best:
+                break
+            if n in settled:
+                continue
+            settled.add(n)
+            if n in goals and d + goals[n][0] < best:
+                best, best_end = d + goals[n][0], n
+            for j in range(indptr[n], indptr[n + 1]):
+                m = indices[j]
+                if m in settled:
+                    continue
+                nd = d + slot_w[j]
+                if nd < dist.get(m, math.inf):
+                    dist[m] = nd
+                    pred[m] = n
+                    start_end.pop(m, None)
+                    heapq.heappush(heap, (nd + h(m), nd, m))
+
+        if not math.isfinite(best):
+            return None, math.inf, len(settled)
+        if best_end is None:
+            return self._same_chain_path(source, target), best, len(settled)
+        core_path = [best_end]
+        while core_path[-1] not in start_end:
+            core_path.append(pred[core_path[-1]])
+        core_path.reverse()
+        return self._join(source, target, start_end[core_path[0]], goals[best_end][1], core_path), best, len(settled)
+
+
+def contract_degree2(cg: CompiledGraph) -> Contraction:
+    """
+    Fold every chain of degree-2 nodes into one core edge. Chains that would close on
+    themselves or duplicate another core edge keep their first interior node, so the core
+    stays a simple graph (pure cycles keep one node, then split the same way).
+    """
+    n, m = cg.n_nodes, cg.n_edges
+    indptr, indices, slot_edge = cg.indptr.tolist(), cg.indices.tolist(), cg.slot_edge.tolist()
+    keep = np.diff(cg.indptr) != 2
+
+    while True:
+        chains = _walk_chains(keep, indptr, indices, slot_edge, cg.edge_u, m)
+        promote = []
+        by_pair: Dict[Tuple[int, int], List[int]] = {}
+        for k, (a, b, _, nodes) in enumerate(chains):
+            if a == b:
+                promote.append(nodes[0])
+            else:
+                by_pair.setdefault((min(a, b), max(a, b)), []).append(k)
+        for group in by_pair.values():
+            if len(group) > 1:
+                long = [k for k in group if chains[k][3]]
+                if len(long) == len(group):
+                    long = long[1:]  # no direct edge in the group: one chain may stay
+                promote.extend(chains[k][3][0] for k in long)
+        if not promote:
+            break
+        keep[promote] = True
+
+    kept = np.flatnonzero(keep)
+    node_core = np.full(n, -1, dtype=np.int64)
+    node_core[kept] = np.arange(len(kept))
+    lens = np.array([len(c[2]) for c in chains], dtype=np.int64)
+    ptr = np.zeros(len(chains) + 1, dtype=np.int64)
+    np.cumsum(lens, out=ptr[1:])
+    members = np.array([e for c in chains for e in c[2]], dtype=np.int64)
+    reach = np.array([v for c in chains for v in c[3] + [c[1]]], dtype=np.int64)
+    node_chain = np.full(n, -1, dtype=np.int64)
+    node_slot = np.full(n, -1, dtype=np.int64)
+    if len(chains):
+        interior = np.ones(len(reach), dtype=bool)
+        interior[ptr[1:] - 1] = False
+        node_chain[reach[interior]] = np.repeat(np.arange(len(chains)), lens - 1)
+        node_slot[reach[interior]] = np.flatnonzero(interior)
+
+    edge_u = node_core[np.array([c[0] for c in chains], dtype=np.int64)]
+    edge_v = node_core[np.array([c[1] for c in chains], dtype=np.int64)]
+    c_indptr, c_indices, c_slot = _csr_arrays(len(kept), edge_u, edge_v)
+    core = CompiledGraph(
+        [cg.node_ids[k] for k in kept.tolist()], cg.xy[kept], c_indptr, c_indices, c_slot,
+        edge_u, edge_v, np.empty(len(chains), dtype=object),
+    )
+    return Contraction(cg, core, kept, ptr, members, reach, node_chain, node_slot, node_core)
+
+
+def _walk_chains(keep: np.ndarray, indptr: list, indices: list, slot_edge: list,
+                 edge_u: np.ndarray, m: int) -> List[Tuple[int, int, List[int], List[int]]]:
+    """(start, end, member edges, interior nodes) per chain, walked out of every kept node"""
+    keep_l = keep.tolist()
+    visited = [False] * m
+    chains = []
+
+    def walk(a: int) -> None:
+        for j in range(indptr[a], indptr[a + 1]):
+            e = slot_edge[j]
+            if visited[e]:
+                continue
+            visited[e] = True
+            members, nodes, cur = [e], [], indices[j]
+            while not keep_l[cur]:
+                lo = indptr[cur]
+                k = lo if slot_edge[lo] != members[-1] else lo + 1
+                members.append(slot_edge[k])
+                visited[slot_edge[k]] = True
+                nodes.append(cur)
+                cur = indices[k]
+            chains.append((a, cur, members, nodes))
+
+    for a in np.flatnonzero(keep).tolist():
+        walk(a)
+    for e in range(m):  # pure cycles: no kept node reached them
+        if not visited[e]:
+            a = int(edge_u[e])
+            keep[a] = keep_l[a] = True
+            walk(a)
+    return chains
+
+
+# ------------- Parallel routing over shared memory -------------
+class SharedGraph:
+    """
+    Static CSR arrays (indptr / indices) of one compiled graph, copied once into
+    multiprocessing shared memory. Workers attach by name, so the graph is never pickled;
+    each request only publishes its slot weight vector (weights()).
+    The blocks are unlinked when the compiled graph is dropped (or at interpreter exit).
+    """
+
+    def __init__(self, cg: CompiledGraph):
+        blocks, self.spec = _publish({"indptr": cg.indptr, "indices": cg.indices})
+        self._finalizer = weakref.finalize(self, _unlink, blocks)
+
+    def weights(self, cg: CompiledGraph, edge_weights: np.ndarray) -> "_SharedWeights":
+        """Context manager: spec of the static arrays + this request's slot weights"""
+        return _SharedWeights(self.spec, np.asarray(edge_weights, dtype="float64")[cg.slot_edge])
+
+
+class _SharedWeights:
+    def __init__(self, static: Dict[str, tuple], slot_weights: np.ndarray):
+        self._blocks, spec = _publish({"weights": slot_weights})
+        self.spec = {**static, **spec}
+
+    def __enter__(self) -> "_SharedWeights":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _unlink(self._blocks)
+        self._blocks = []
+
+
+def _publish(arrays: Dict[str, np.ndarray]) -> Tuple[List[shared_memory.SharedMemory], Dict[str, tuple]]:
+    blocks, spec = [], {}
+    for key, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        blocks.append(shm)
+        spec[key] = (shm.name, arr.shape, arr.dtype.str)
+    return blocks, spec
+
+
+def _unlink(blocks: List[shared_memory.SharedMemory]) -> None:
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _shared_graph(cg: CompiledGraph) -> SharedGraph:
+    """Static shared-memory copy of cg, published on first parallel use"""
+    with _POOL_LOCK:
+        if cg.shared is None:
+            cg.shared = SharedGraph(cg)
+        return cg.shared
+
+
+def _attach(spec: Dict[str, tuple]):
+    blocks, arrays = [], {}
+    for key, (name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=name)  # spawn workers share the parent's tracker
+        blocks.append(shm)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return blocks, arrays
+
+
+def _route_batch(spec: Dict[str, tuple], sources: np.ndarray, targets: np.ndarray) -> List[Optional[np.ndarray]]:
+    """Worker: shortest paths for one OD batch, returned as compact int32 node sequences"""
+    blocks, a = _attach(spec)
+    try:
+        n = len(a["indptr"]) - 1
+        mat = csr_matrix((a["weights"], a["indices"], a["indptr"]), shape=(n, n))
+        out: List[Optional[np.ndarray]] = [None] * len(sources)
+        uniq, inv = np.unique(sources, return_inverse=True)
+        for b in range(0, len(uniq), CSR_SOURCE_BLOCK):
+            block = uniq[b:b + CSR_SOURCE_BLOCK]
+            dist, pred = dijkstra(mat, directed=True, indices=block, return_predecessors=True)
+            for i in np.flatnonzero((inv >= b) & (inv < b + len(block))).tolist():
+                row, t = inv[i] - b, int(targets[i])
+                if np.isfinite(dist[row, t]):
+                    out[i] = np.asarray(_walk_predecessors(pred[row], int(sources[i]), t), dtype=np.int32)
+        del mat, a
+        return out
+    finally:
+        for shm in blocks:
+            shm.close()
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    """
+    The one long-lived spawn pool (fork is unsafe inside a threaded server), sized at
+    MAX_ROUTING_WORKERS and never recreated, so concurrent requests never cancel each other
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=MAX_ROUTING_WORKERS, mp_context=mp.get_context("spawn"))
+        return _POOL
+
+
+def parallel_shortest_paths(
+    cg: CompiledGraph,
+    sources: Sequence[int],
+    targets: Sequence[int],
+    edge_weights: np.ndarray,
+    workers: int,
+) -> List[Optional[List[int]]]:
+    """
+    Same result as CompiledGraph.shortest_paths, with disjoint OD batches routed in the shared
+    worker pool. Pairs are grouped by source, so every source is searched in exactly one batch.
+    At most `workers` batches of this request are in flight at a time.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    out: List[Optional[List[int]]] = [None] * len(sources)
+    if not len(sources):
+        return out
+    workers = max(1, min(int(workers), MAX_ROUTING_WORKERS))
+
+    order = np.argsort(sources, kind="stable")
+    uniq_starts = np.flatnonzero(np.r_[True, np.diff(sources[order]) != 0])
+    n_batches = min(len(uniq_starts), workers * BATCHES_PER_WORKER)
+    cuts = uniq_starts[np.linspace(0, len(uniq_starts), n_batches, endpoint=False).astype(int)]
+    batches = np.split(order, cuts[1:])
+
+    pool = _process_pool()
+    def collect(idx: np.ndarray, seqs: List[Optional[np.ndarray]]) -> None:
+        for i, seq in zip(idx.tolist(), seqs):
+            out[i] = seq.tolist() if seq is not None else None
+
+    with _shared_graph(cg).weights(cg, edge_weights) as shared:
+        pending = {}
+        for idx in batches:
+            if len(pending) >= workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    collect(pending.pop(fut), fut.result())
+            pending[pool.submit(_route_batch, shared.spec, sources[idx], targets[idx])] = idx
+        for fut, idx in pending.items():
+            collect(idx, fut.result())
+    return out
+
+
+def _as_points(points) -> np.ndarray:
+    arr = np.asarray(points)
+    if arr.dtype != object and arr.ndim == 2 and arr.shape[1] == 2:
+        return shapely.points(arr.astype("float64"))
+    return np.asarray(list(points), dtype=object)
+
+
+# ------------- Shade / near-building cover -------------
+class CoverIndex:
+    """
+    Individually buffered polygons + STRtree (no global unary_union).
+    ratios(lines) = share of each line's length inside the union of the buffers,
+    computed only for candidate (line, polygon) pairs and aggregated per line with NumPy.
+    """
+
+    def __init__(self, polygons, buf_m: float):
+        geoms = np.asarray(list(polygons) if polygons is not None else [], dtype=object)
+        self.source_idx = np.arange(len(geoms))  # buffer i ↔ input polygon source_idx[i]
+        if len(geoms):
+            keep = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+            geoms, self.source_idx = geoms[keep], self.source_idx[keep]
+        self.buffers = shapely.buffer(geoms, float(buf_m)) if len(geoms) else geoms
+        self._tree = STRtree(self.buffers) if len(self.buffers) else None
+
+    def __bool__(self) -> bool:
+        return self._tree is not None
+
+    def ratios(self, lines) -> np.ndarray:
+        lines = np.asarray(list(lines), dtype=object)
+        out = np.zeros(len(lines), dtype="float64")
+        if self._tree is None or not len(lines):
+            return out
+        lengths = shapely.length(lines)
+        valid = ~shapely.is_missing(lines) & (lengths > 0)
+        if not valid.any():
+            return out
+
+        li, pj = self._tree.query(lines, predicate="intersects")
+        keep = valid[li]
+        li, pj = li[keep], pj[keep]
+        if not len(li):
+            return out
+
+        # Along-line intervals only work for simple open lines; the rest are unioned exactly
+        exact = ~shapely.is_simple(lines) | shapely.is_closed(lines)
+        on_exact = exact[li]
+        covered = _covered_length(lines, li[~on_exact], self.buffers[pj[~on_exact]])
+        for e in np.unique(li[on_exact]).tolist():
+            cover = shapely.union_all(self.buffers[pj[li == e]])
+            covered[e] = shapely.length(shapely.intersection(lines[e], cover))
+
+        out[valid] = np.clip(covered[valid] / lengths[valid], 0.0, 1.0)
+        return out
+
+    def weighted_values(self, lines, values) -> np.ndarray:
+        """
+        Length-weighted mean of a per-polygon value along each line (values aligned with the
+        input polygons). Where buffers overlap, the overlapping lengths share the weight;
+        a line only partly covered is diluted by its uncovered length (which counts as 0).
+        """
+        lines = np.asarray(list(lines), dtype=object)
+        out = np.zeros(len(lines), dtype="float64")
+        if self._tree is None or not len(lines):
+            return out
+        vals = np.asarray(values, dtype="float64")[self.source_idx]
+        li, pj = self._tree.query(lines, predicate="intersects")
+        if not len(li):
+            return out
+        part = shapely.length(shapely.intersection(lines[li], self.buffers[pj]))
+        num = np.bincount(li, weights=part * vals[pj], minlength=len(lines))
+        den = np.bincount(li, weights=part, minlength=len(lines))
+        den = np.maximum(den, shapely.length(lines))
+        np.divide(num, den, out=out, where=den > 0)
+        return out
+
+
+def _covered_length(lines: np.ndarray, li: np.ndarray, bufs: np.ndarray) -> np.ndarray:
+    """
+    Length of each line inside the union of its candidate buffers.
+    Intersection pieces become [start, end] intervals along the line; overlapping intervals
+    are merged per line with a running maximum (lines offset apart so groups never mix).
+    """
+    n = len(lines)
+    if not len(li):
+        return np.zeros(n, dtype="float64")
+
+    pieces = shapely.intersection(lines[li], bufs)
+    parts, part_of = shapely.get_parts(pieces, return_index=True)
+    linear = shapely.length(parts) > 0
+    parts, edge = parts[linear], li[part_of[linear]]
+    if not len(parts):
+        return np.zeros(n, dtype="float64")
+
+    s = shapely.line_locate_point(lines[edge], shapely.get_point(parts, 0))
+    e = shapely.line_locate_point(lines[edge], shapely.get_point(parts, -1))
+    lo, hi = np.minimum(s, e), np.maximum(s, e)
+
+    span = float(np.nanmax(shapely.length(lines[edge]))) * 2.0 + 1.0
+    order = np.lexsort((lo, edge))
+    edge, lo, hi = edge[order], lo[order] + edge[order] * span, hi[order] + edge[order] * span
+    reach = np.concatenate(([-np.inf], np.maximum.accumulate(hi)[:-1]))
+    gain = np.maximum(0.0, hi - np.maximum(lo, reach))
+    return np.bincount(edge, weights=gain, minlength=n)
+
+
+# ------------- Compiled network bundles -------------
+def file_digest(path: str) -> str:
+    """sha1 of a file's content"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def sources_version(paths: Dict[str, Optional[str]], extra: str = "") -> str:
+    """One hash over named source files (None = missing optional layer) + build parameters"""
+    h = hashlib.sha1(f"bundle-v{BUNDLE_FORMAT};{extra};".encode())
+    for name in sorted(paths):
+        p = paths[name]
+        h.update(f"{name}:{file_digest(p) if p else '-'};".encode())
+    return h.hexdigest()
+
+
+def save_bundle(path: str, version: str, arrays: Dict[str, np.ndarray],
+                geoms: Optional[Dict[str, Sequence]] = None) -> None:
+    """
+    Write plain arrays + geometry columns (as WKB blobs with offsets) to one uncompressed .npz.
+    The file is replaced atomically, so concurrent readers never see a partial bundle.
+    """
+    payload = {f"a_{k}": np.asarray(v) for k, v in arrays.items()}
+    for k, col in (geoms or {}).items():
+        wkb = shapely.to_wkb(np.asarray(col, dtype=object))
+        sizes = np.fromiter((len(b) for b in wkb), dtype=np.int64, count=len(wkb))
+        offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        payload[f"g_{k}"] = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+        payload[f"o_{k}"] = offsets
+    payload["meta"] = np.array(json.dumps({"format": BUNDLE_FORMAT, "version": version}))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **payload)
+    os.replace(tmp, path)
+
+
+def load_bundle(path: str, version: str) -> Optional[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]]:
+    """(arrays, geometry columns) of a bundle built from the same sources, else None"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(str(z["meta"]))
+            if meta.get("format") != BUNDLE_FORMAT or meta.get("version") != version:
+                return None
+            arrays = {k[2:]: z[k] for k in z.files if k.startswith("a_")}
+            geoms = {}
+            for k in z.files:
+                if k.startswith("g_"):
+                    blob, offsets = z[k].tobytes(), z[f"o_{k[2:]}"]
+                    wkb = [blob[a:b] for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+                    geoms[k[2:]] = shapely.from_wkb(np.asarray(wkb, dtype=object))
+    except (OSError, ValueError, KeyError):
+        return None
+    return arrays, geoms
@@ -8,18 +8,27 @@ simulate_agent.py
 - Pathfinding uses only User==1; User==0 only for visualization
 """
 
-import os, json, math
+import os, sys, json, math, hashlib, sqlite3
 from pathlib import Path
 from dataclasses import dataclass
 from typing import Optional, Tuple, Iterable
-from shapely.ops import unary_union
 import numpy as np
+import pandas as pd
 import geopandas as gpd
 import networkx as nx
+import fiona
+import shapely
 from shapely.geometry import Point, LineString, shape, base
-from shapely.ops import linemerge
+from shapely.ops import linemerge, substring
 from pyproj import CRS
 
+try:
+    from .road_network import (ROUTING_BACKENDS, CoverIndex, cluster_within, compile_graph, load_bundle,
+                               save_bundle, shortest_paths_from, sources_version)
+except ImportError:  # اجرای مستقیم از داخل src
+    from road_network import (ROUTING_BACKENDS, CoverIndex, cluster_within, compile_graph, load_bundle,
+                              save_bundle, shortest_paths_from, sources_version)
+
 
 ROOT = Path(__file__).parent.resolve()
 DATA = ROOT / "data"
@@ -38,10 +47,18 @@ FP_VEG   = pick_first(DATA/"vegetation.geojson", DATA/"vegetation.shp")
 FP_ORG   = pick_first(DATA/"origins.geojson", DATA/"origins.shp")
 FP_DST   = pick_first(DATA/"destinations.geojson", DATA/"destinations.shp")
 OUT_GPKG = str(OUT/"results.gpkg")
+# شبکه‌ی کامپایل‌شده (npz)؛ تا وقتی هش ورودی‌ها عوض نشده به‌جای ساخت دوباره خوانده می‌شود
+NETWORK_BUNDLE = str(OUT/"sim_network.npz")
+NETWORK_SOURCES = ("roads", "nodes", "buildings", "vegetation")  # فقط این‌ها روی گراف اثر دارند
+SNAP_RAD_NODE = 15.0
+GRAPH_REV = 4  # با هر تغییر در خروجی build_graph بالا برود تا باندل‌های قدیمی کنار گذاشته شوند
 
 ALLOWED = {1}   # انسان فقط روی User=1
 BLOCKED = {0}   # برای نمایش در خروجی، نه مسیر‌یابی
 
+# موتور مسیر‌یابی: networkx (پیش‌فرض) یا csr (scipy.sparse.csgraph)
+ROUTING_BACKEND = os.environ.get("SIM_ROUTING_BACKEND", "networkx")
+
 
 # ------------- IO & CRS -------------
 def read_geo(path: Optional[str]) -> gpd.GeoDataFrame:
@@ -109,6 +126,15 @@ class AgentTraits:
         heat = self.norm_temp(t_c)
         return self.alpha_shade_base + self.alpha_shade_range * heat
 
+
+# کلاس‌های عامل: هر کلاس فقط ضرایب خودش را دارد؛ گراف و نسبت‌های سایه/ساختمان مشترک‌اند
+AGENT_CLASSES: dict[str, AgentTraits] = {
+    "adult":   AgentTraits(),
+    "elderly": AgentTraits(alpha_shade_base=0.40, alpha_shade_range=0.35, alpha_build=0.15),
+    "child":   AgentTraits(alpha_shade_base=0.35, alpha_shade_range=0.30, alpha_build=0.05),
+    "cyclist": AgentTraits(alpha_shade_base=0.10, alpha_shade_range=0.10, alpha_build=0.0),
+}
+
 class ShadowProbe:
     """
     برآورد نسبت طولِ داخل "سایه درختان" و "حریم ساختمان".
@@ -121,26 +147,16 @@ class ShadowProbe:
         self.shade_buf_m = float(shade_buf_m)
         self.bldg_buf_m  = float(bldg_buf_m)
 
-        self._shade_union = None
-        self._bldg_union  = None
+        # بافر تک‌تک پلیگون‌ها + STRtree (بدون unary_union سراسری)
+        self._shade = CoverIndex(trees.geometry if trees is not None else None, self.shade_buf_m)
+        self._bldg  = CoverIndex(buildings.geometry if buildings is not None else None, self.bldg_buf_m)
 
-        # Union امن با بافر
-        try:
-            if trees is not None and len(trees):
-                geoms = [g for g in trees.geometry if g is not None and not g.is_empty]
-                if geoms:
-                    bufs = [g.buffer(self.shade_buf_m) for g in geoms]
-                    self._shade_union = unary_union(bufs)
-        except Exception:
-            self._shade_union = None
-
-        try:
-            if buildings is not None and len(buildings):
-                geoms = [g for g in buildings.geometry if g is not None and not g.is_empty]
-                if geoms:
-                    self._bldg_union = unary_union([g.buffer(self.bldg_buf_m) for g in geoms])
-        except Exception:
-            self._bldg_union = None
+    def ratios_for_lines(self, lines) -> tuple[np.ndarray, np.ndarray]:
+        """
+        نسخه‌ی برداری برای همه‌ی خطوط با هم.
+        خروجی: (shade_ratios, near_build_ratios) — آرایه‌های 0..1
+        """
+        return self._shade.ratios(lines), self._bldg.ratios(lines)
 
     def ratios_for_line(self, line: LineString) -> tuple[float, float]:
         """
@@ -148,28 +164,8 @@ class ShadowProbe:
         """
         if line is None or line.is_empty or line.length <= 0:
             return 0.0, 0.0
-
-        L = float(line.length)
-        shade_ratio = 0.0
-        bldg_ratio  = 0.0
-
-        if self._shade_union is not None:
-            try:
-                inter = line.intersection(self._shade_union)
-                shade_len = float(inter.length) if inter and not inter.is_empty else 0.0
-                shade_ratio = max(0.0, min(1.0, shade_len / L))
-            except Exception:
-                pass
-
-        if self._bldg_union is not None:
-            try:
-                inter_b = line.intersection(self._bldg_union)
-                bldg_len = float(inter_b.length) if inter_b and not inter_b.is_empty else 0.0
-                bldg_ratio = max(0.0, min(1.0, bldg_len / L))
-            except Exception:
-                pass
-
-        return shade_ratio, bldg_ratio
+        shade, bldg = self.ratios_for_lines([line])
+        return float(shade[0]), float(bldg[0])
 
 # ------------- Helpers -------------
 def iter_line_parts(geom: base.BaseGeometry) -> Iterable[LineString]:
@@ -193,10 +189,91 @@ def connect_endpoints_exact(route: LineString, o: Point, d: Point, tol: float =
 # ------------- Graph build -------------
 def build_graph(roads_all: gpd.GeoDataFrame, nodes_all: gpd.GeoDataFrame,
                 buildings: Optional[gpd.GeoDataFrame], trees: Optional[gpd.GeoDataFrame],
-                traits: AgentTraits, temp_c: float,
                 snap_rad_node: float = 15.0) -> tuple[nx.Graph, gpd.GeoDataFrame, gpd.GeoDataFrame,
                                                       gpd.GeoDataFrame, gpd.GeoDataFrame]:
-    """برگشتی‌ها: G, nodes_allowed, edges_allowed, nodes_blocked, edges_blocked"""
+    """
+    برگشتی‌ها: G, nodes_allowed, edges_allowed, nodes_blocked, edges_blocked
+    گراف فقط هندسی است (مستقل از دما): هر یال eid = ردیفش در edges_allowed؛
+    length/shade_ratio/near_b_ratio ستون‌های edges_allowed‌اند و هزینه با edge_costs() ساخته می‌شود.
+    """
+    roads_allowed, roads_blocked, nodes_allowed, nodes_blocked = split_by_user(roads_all, nodes_all)
+
+    # پروب سایه/ساختمان
+    probe = ShadowProbe(buildings=buildings, trees=trees, shade_buf_m=0.8, bldg_buf_m=6.0)
+
+    lines = [line for geom in roads_allowed.geometry for line in iter_line_parts(geom)
+             if line and not line.is_empty]
+    shade_ratios, near_b_ratios = probe.ratios_for_lines(lines)
+
+    # اسنپ یکجای همه‌ی سرهای خطوط: [شروع‌ها..., پایان‌ها...] → id گره
+    nodes_allowed, end_ids = snap_endpoints(lines, nodes_allowed, snap_rad_node)
+    n_lines = len(lines)
+
+    G = nx.Graph()
+    G.add_nodes_from((int(nid), {"geom": geom}) for nid, geom in zip(nodes_allowed.index, nodes_allowed.geometry))
+
+    edges_allowed = []
+    # فقط خطی که هر دو سرش به یک گره‌ی موجود اسنپ شده جمع می‌شود (مثل قبل)؛ تعدادش گزارش می‌شود
+    n_loops = int((end_ids[:n_lines] == end_ids[n_lines:]).sum())
+    if n_loops:
+        print(f"⚠️ {n_loops} خط کوتاه با هر دو سر روی یک گره کنار گذاشته شد (snap_rad_node={snap_rad_node}).")
+
+    for i, (line, shade_ratio, near_b_ratio) in enumerate(zip(lines, shade_ratios.tolist(), near_b_ratios.tolist())):
+        u, v = int(end_ids[i]), int(end_ids[n_lines + i])
+        if u == v:
+            continue
+
+        length = float(line.length)
+
+        G.add_edge(u, v, eid=len(edges_allowed), geometry=line,
+                   length=length, shade_ratio=shade_ratio, near_b_ratio=near_b_ratio)
+        edges_allowed.append({"u": u, "v": v, "geometry": line, "user": 1,
+                              "length": length, "shade_ratio": shade_ratio, "near_b_ratio": near_b_ratio})
+
+    edges_allowed_gdf = gpd.GeoDataFrame(edges_allowed, geometry="geometry", crs=roads_all.crs)
+
+    # فقط برای نمایش
+    edges_blocked_gdf = roads_blocked[["geometry", "user"]].copy()
+    nodes_blocked_gdf = nodes_blocked[["geometry", "user"]].copy()
+
+    return G, nodes_allowed, edges_allowed_gdf, nodes_blocked_gdf, edges_blocked_gdf
+
+
+def snap_endpoints(lines: list, nodes_allowed: gpd.GeoDataFrame,
+                   snap_rad_node: float) -> Tuple[gpd.GeoDataFrame, np.ndarray]:
+    """
+    سرهای همه‌ی خطوط با یک پرس‌وجوی nearest (حداکثر snap_rad_node) به گره‌های مجاز اسنپ می‌شوند.
+    سرهای بی‌گره بر اساس فاصله خوشه می‌شوند (cluster_within با پیوند کامل: هر دو سرِ یک خوشه
+    نزدیک‌تر از snap_rad_node‌اند، پس زنجیره‌ای از تکه‌های کوتاه در یک گره جمع نمی‌شود) و دو سرِ
+    یک خط هیچ‌گاه هم‌خوشه نمی‌شوند. هر خوشه یک گره‌ی تازه (با id پشت سر بزرگ‌ترین id) در محل
+    نخستین سرش می‌گیرد، پس سر هر خط حداکثر snap_rad_node با گره‌اش فاصله دارد.
+    ردیف‌های تازه یک‌جا به nodes_allowed اضافه می‌شوند.
+    برگشتی: (nodes_allowed, ids) که ids[i] گره‌ی شروع خط i و ids[n+i] گره‌ی پایانش است.
+    """
+    geoms = np.asarray(lines, dtype=object)
+    ends = np.concatenate([shapely.get_point(geoms, 0), shapely.get_point(geoms, -1)])
+    ids = np.full(len(ends), -1, dtype=np.int64)
+    if len(ends) and len(nodes_allowed):
+        i_end, i_node = nodes_allowed.sindex.nearest(ends, max_distance=snap_rad_node, return_all=False)
+        ids[i_end] = nodes_allowed.index.to_numpy(dtype=np.int64)[i_node]
+
+    miss = np.flatnonzero(ids < 0)
+    if len(miss):
+        # دو سرِ یک خط هرگز در یک خوشه نمی‌افتند (groups = شماره‌ی خط)
+        cluster = cluster_within(shapely.get_coordinates(ends[miss]), snap_rad_node, groups=miss % len(geoms))
+        _, first, inverse = np.unique(cluster, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        start = int(nodes_allowed.index.max()) + 1 if len(nodes_allowed) else 1000000
+        new_ids = np.arange(start, start + len(first), dtype=np.int64)
+        ids[miss] = new_ids[inverse]
+        created = gpd.GeoDataFrame({"user": 1}, geometry=ends[miss][first], index=new_ids,
+                                   crs=nodes_allowed.crs)
+        nodes_allowed = pd.concat([nodes_allowed, created])
+    return nodes_allowed, ids
+
+
+def split_by_user(roads_all: gpd.GeoDataFrame, nodes_all: gpd.GeoDataFrame):
+    """(roads_allowed, roads_blocked, nodes_allowed, nodes_blocked)؛ جاده‌ها explode شده"""
     roads_all = ensure_user_col(roads_all)
     nodes_all = ensure_user_col(nodes_all)
 
@@ -213,180 +290,313 @@ def build_graph(roads_all: gpd.GeoDataFrame, nodes_all: gpd.GeoDataFrame,
             gdf_ex = gdf.explode().reset_index(drop=True)
         if name == "roads_allowed": roads_allowed = gdf_ex
         else: roads_blocked = gdf_ex
+    return roads_allowed, roads_blocked, nodes_allowed, nodes_blocked
 
-    # پروب سایه/ساختمان
-    probe = ShadowProbe(buildings=buildings, trees=trees, shade_buf_m=0.8, bldg_buf_m=6.0)
-    G = nx.Graph()
-
-    # add allowed nodes
-    for nid, r in nodes_allowed.iterrows():
-        G.add_node(int(nid), geom=r.geometry)
 
-    # nearest helper روی گره‌های مجاز
-    nidx = nodes_allowed.sindex
-    def nearest_or_create(pt: Point) -> int:
-        try:
-            cand = list(nidx.query(pt.buffer(snap_rad_node)))
-        except Exception:
-            cand = []
-        if cand:
-            best, bid = 1e18, None
-            for i in cand:
-                nid = int(nodes_allowed.index[i])
-                d = pt.distance(nodes_allowed.geometry.iloc[i])
-                if d < best:
-                    best, bid = d, nid
-            return bid
-        new_id = int(max(G.nodes) + 1) if len(G.nodes) else 1000000
-        G.add_node(new_id, geom=pt)
-        nodes_allowed.loc[new_id, "geometry"] = pt
-        nodes_allowed.loc[new_id, "user"] = 1
-        return new_id
+def edge_costs(edges_allowed: gpd.GeoDataFrame, traits: AgentTraits, temp_c: float) -> np.ndarray:
+    """
+    هزینه‌ی همه‌ی یال‌ها (به ترتیب eid) به‌صورت برداری؛ با تغییر دما فقط همین دوباره حساب می‌شود.
+    وزن ضربی: هرچه سایه/نزدیکی بیشتر → وزن کمتر، با کف ایمنی 0.1×طول.
+    """
+    length = edges_allowed["length"].to_numpy(dtype="float64")
+    shade = edges_allowed["shade_ratio"].to_numpy(dtype="float64")
+    near_b = edges_allowed["near_b_ratio"].to_numpy(dtype="float64")
 
-    edges_allowed = []
-    # ضرایب وابسته به دما
     a_shade = traits.alpha_shade(temp_c)  # 0.25..0.50 بسته به گرما
     a_bldg  = traits.alpha_build          # ثابت 0.10
+    weight = length * (1.0 - a_shade * shade) * (1.0 - a_bldg * near_b)
+    return traits.w_len * np.maximum(length * 0.1, weight)
 
-    for _, r in roads_allowed.iterrows():
-        for line in iter_line_parts(r.geometry):
-            if not line or line.is_empty:
-                continue
-            u = nearest_or_create(Point(line.coords[0]))
-            v = nearest_or_create(Point(line.coords[-1]))
-            if u == v:
-                continue
-
-            length = float(line.length)
-            shade_ratio, near_b_ratio = probe.ratios_for_line(line)
-
-            # وزن ضربی (هرچه سایه/نزدیکی بیشتر → وزن کمتر)
-            weight = length * (1.0 - a_shade * shade_ratio) * (1.0 - a_bldg * near_b_ratio)
-            # کف ایمنی تا صفر نشود
-            weight = max(length * 0.1, weight)
-
-            # اگر خواستی به شیوه‌ی جمعی هم نگاه کنی: cost = traits.w_len*weight  (ساده)
-            cost = traits.w_len * weight
-
-            G.add_edge(u, v, cost=cost, geometry=line,
-                       length=length, shade_ratio=shade_ratio, near_b_ratio=near_b_ratio)
-            edges_allowed.append({"u": u, "v": v, "geometry": line, "user": 1,
-                                  "length": length, "shade_ratio": shade_ratio, "near_b_ratio": near_b_ratio})
 
-    edges_allowed_gdf = gpd.GeoDataFrame(edges_allowed, geometry="geometry", crs=roads_all.crs)
-
-    # فقط برای نمایش
-    edges_blocked_gdf = roads_blocked[["geometry", "user"]].copy()
-    nodes_blocked_gdf = nodes_blocked[["geometry", "user"]].copy()
-
-    return G, nodes_allowed, edges_allowed_gdf, nodes_blocked_gdf, edges_blocked_gdf
+def _cost_of(cost: np.ndarray):
+    """همه‌ی یال‌ها eid دارند؛ تکه‌های مجازی اسنپ سهم طولی‌شان (share) از یال اصلی را هم."""
+    return lambda u, v, d: cost[d["eid"]] * d.get("share", 1.0)
 
 
 # ------------- Snap to graph -------------
-def snap_point_to_graph(pt: Point, nodes_gdf: gpd.GeoDataFrame,
-                        edges_gdf: gpd.GeoDataFrame, G: nx.Graph,
-                        traits: AgentTraits, rad_nodes=30.0, rad_edge=100.0) -> Tuple[Optional[int], bool]:
+def snap_points_to_graph(points: Iterable[Point], G: nx.Graph, nodes_gdf: gpd.GeoDataFrame,
+                         edges_gdf: gpd.GeoDataFrame,
+                         rad_nodes: float = 30.0, rad_edge: float = 100.0) -> np.ndarray:
+    """
+    اسنپ یکجای نقاط: اول نزدیک‌ترین گره (تا rad_nodes)، بعد برای بقیه نزدیک‌ترین یال (تا rad_edge)
+    و نقطه‌ی تصویرشان روی آن. نقاط تصویرشده گره‌ی مجازی می‌شوند و یالشان در همان نقطه شکسته
+    می‌شود (u → مجازی‌ها به ترتیب روی خط → v؛ هر تکه eid یال اصلی و سهم طولی‌اش را دارد، پس
+    مستقل از آرایه‌ی هزینه است و برای همه‌ی کلاس‌های عامل مشترک)؛
+    همه‌ی گره/یال‌های مجازی یک‌جا به G اضافه می‌شوند. edges_gdf باید edges_allowed باشد (ردیف = eid).
+    برگشتی: id گره برای هر نقطه (‎-1 یعنی اسنپ نشد).
+    """
+    pts = np.asarray(list(points), dtype=object)
+    ids = np.full(len(pts), -1, dtype=np.int64)
+    if not len(pts):
+        return ids
+
     # node-first
-    try:
-        sidx = nodes_gdf.sindex
-        cand = list(sidx.query(pt.buffer(rad_nodes)))
-    except Exception:
-        cand = []
-    if cand:
-        best, bid = 1e18, None
-        for i in cand:
-            nid = int(nodes_gdf.index[i])
-            d = pt.distance(nodes_gdf.geometry.iloc[i])
-            if d < best:
-                best, bid = d, nid
-        return bid, False
+    if len(nodes_gdf):
+        i_pt, i_node = nodes_gdf.sindex.nearest(pts, max_distance=rad_nodes, return_all=False)
+        ids[i_pt] = nodes_gdf.index.to_numpy(dtype=np.int64)[i_node]
 
     # edge-second
-    if edges_gdf is None or edges_gdf.empty:
-        return None, False
-    try:
-        eidx = edges_gdf.sindex
-        cand = list(eidx.query(pt.buffer(rad_edge)))
-    except Exception:
-        cand = []
-    if not cand:
-        return None, False
-
-    best_d, best_i = 1e18, None
-    for i in cand:
-        geom = edges_gdf.geometry.iloc[i]
-        d = pt.distance(geom)
-        if d < best_d:
-            best_d, best_i = d, i
-
-    row = edges_gdf.iloc[best_i]
-    u, v = int(row.get("u")), int(row.get("v"))
-    vid = (max(G.nodes) + 1) if len(G.nodes) else 2000000
-    G.add_node(vid, geom=pt)
-
-    # وصل به نزدیک‌ترِ u/v
-    du = pt.distance(G.nodes[u]["geom"]); dv = pt.distance(G.nodes[v]["geom"])
-    t  = u if du <= dv else v
-    seg = LineString([pt, G.nodes[t]["geom"]])
-    length = float(seg.length); cost = length
-    G.add_edge(vid, t, cost=cost, geometry=seg)
-
-    # در nodes_gdf هم نشانش بده تا در خروجی دیده شود
-    nodes_gdf.loc[vid, "geometry"] = pt
-    nodes_gdf.loc[vid, "user"] = 1
-    return vid, True
+    miss = np.flatnonzero(ids < 0)
+    if not len(miss) or edges_gdf is None or edges_gdf.empty:
+        return ids
+    i_pt, eid = edges_gdf.sindex.nearest(pts[miss], max_distance=rad_edge, return_all=False)
+    if not len(i_pt):
+        return ids
+    miss = miss[i_pt]
+    lines = np.asarray(edges_gdf.geometry.values)[eid]
+    frac = shapely.line_locate_point(lines, pts[miss], normalized=True)
+    u = edges_gdf["u"].to_numpy(dtype=np.int64)[eid]
+    v = edges_gdf["v"].to_numpy(dtype=np.int64)[eid]
+
+    # سرهای یال همان گره‌های u/v‌اند؛ فقط نقاط میانی گره‌ی مجازی می‌گیرند (یکی برای هر (eid, frac))
+    ids[miss[frac <= 0.0]] = u[frac <= 0.0]
+    ids[miss[frac >= 1.0]] = v[frac >= 1.0]
+    inner = (frac > 0.0) & (frac < 1.0)
+    if not inner.any():
+        return ids
+    splits, inverse = np.unique(np.column_stack([eid[inner], frac[inner]]), axis=0, return_inverse=True)
+    start = (max(G.nodes) + 1) if len(G.nodes) else 2000000
+    vids = np.arange(start, start + len(splits), dtype=np.int64)
+    ids[miss[inner]] = vids[inverse.ravel()]
+
+    split_eid = splits[:, 0].astype(np.int64)
+    split_pts = shapely.line_interpolate_point(np.asarray(edges_gdf.geometry.values)[split_eid],
+                                               splits[:, 1], normalized=True)
+    new_edges = []
+    # splits مرتب بر اساس (eid, frac) است → هر یال یک تکه‌ی پیوسته از آرایه
+    bounds = np.flatnonzero(np.r_[True, split_eid[1:] != split_eid[:-1], True])
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        e = int(split_eid[a])
+        line = edges_gdf.geometry.values[e]
+        chain = [int(edges_gdf["u"].iat[e]), *vids[a:b].tolist(), int(edges_gdf["v"].iat[e])]
+        fr = [0.0, *splits[a:b, 1].tolist(), 1.0]
+        for k in range(len(chain) - 1):
+            new_edges.append((chain[k], chain[k + 1], {
+                "eid": e, "share": fr[k + 1] - fr[k],
+                "geometry": substring(line, fr[k], fr[k + 1], normalized=True),
+            }))
+    G.add_nodes_from((int(vid), {"geom": pt}) for vid, pt in zip(vids, split_pts))
+    G.add_edges_from(new_edges)
+    return ids
+
+
+# ------------- Routing -------------
+def route_pairs_by_cost(G: nx.Graph, jobs: list[tuple[np.ndarray, list[tuple[int, int]]]],
+                        backend: str = "networkx") -> list[list[Optional[list[int]]]]:
+    """
+    چند دسته‌ی (آرایه‌ی هزینه، جفت‌های (u, v)) روی یک گراف — معمولاً یک دسته برای هر کلاس عامل.
+    csr: گراف فقط یک بار کامپایل می‌شود و هر دسته فقط وزن یال‌ها را عوض می‌کند (cost[eid] * share).
+    برگشتی: برای هر دسته، مسیر (دنباله‌ی گره) هر جفت؛ در هر دسته برای هر مبدا یکتا یک جست‌وجو.
+    """
+    if backend not in ROUTING_BACKENDS:
+        raise ValueError(f"Unknown routing backend: {backend}")
+
+    if backend == "csr":
+        cg, edge_data = compile_graph(G, lambda n, d: (d["geom"].x, d["geom"].y))
+        eid = np.array([d["eid"] for d in edge_data], dtype=np.int64)
+        share = np.array([d.get("share", 1.0) for d in edge_data], dtype="float64")
+        pos = cg.node_pos()
+        out = []
+        for cost, uv_pairs in jobs:
+            seqs = cg.shortest_paths([pos[u] for u, _ in uv_pairs], [pos[v] for _, v in uv_pairs],
+                                     np.asarray(cost, dtype="float64")[eid] * share)
+            out.append([[cg.node_ids[k] for k in seq] if seq is not None else None for seq in seqs])
+        return out
+
+    out = []
+    for cost, uv_pairs in jobs:
+        weight = _cost_of(cost)
+        targets_by_origin = {}
+        for u, v in uv_pairs:
+            targets_by_origin.setdefault(u, set()).add(v)
+        paths_by_origin = {u: shortest_paths_from(G, u, vs, weight=weight)
+                           for u, vs in targets_by_origin.items()}
+        out.append([paths_by_origin[u].get(v) for u, v in uv_pairs])
+    return out
+
+
+def route_pairs(G: nx.Graph, uv_pairs: list[tuple[int, int]], cost: np.ndarray,
+                backend: str = "networkx") -> list[Optional[list[int]]]:
+    """مسیر (دنباله‌ی گره) برای هر جفت (u, v) با یک آرایه‌ی هزینه."""
+    return route_pairs_by_cost(G, [(cost, uv_pairs)], backend=backend)[0]
+
+
+# ------------- Engine -------------
+@dataclass
+class SimInputs:
+    """لایه‌های ورودی (CRS متریک) + دما؛ بدون وابستگی به مسیر فایل‌ها."""
+    roads: gpd.GeoDataFrame
+    nodes: gpd.GeoDataFrame
+    origins: gpd.GeoDataFrame
+    destinations: gpd.GeoDataFrame
+    buildings: Optional[gpd.GeoDataFrame] = None
+    vegetation: Optional[gpd.GeoDataFrame] = None
+    temp_c: float = 25.0
+    version: str = ""  # هش فایل‌های NETWORK_SOURCES (کلید باندل کامپایل‌شده)
 
 
-# ------------- Main -------------
-def main():
-    print("🚀 شروع: بارگذاری لایه‌ها")
-    roads_all = to_metric(ensure_user_col(read_geo(FP_ROADS)))
-    nodes_all = to_metric(ensure_user_col(read_geo(FP_NODES)))
-    bldg = to_metric(read_geo(FP_BLDG)) if FP_BLDG else None
-    veg  = to_metric(read_geo(FP_VEG))  if FP_VEG  else None
-    org  = to_metric(read_geo(FP_ORG))
-    dst  = to_metric(read_geo(FP_DST))
-    temp_c = read_weather_temp(default_c=25.0)
+@dataclass
+class SimNetwork:
+    """
+    گراف گرم: یک بار برای هر نسخه‌ی داده ساخته و برای اجراهای بعدی دوباره استفاده می‌شود
+    (فقط‌خواندنی و مستقل از دما؛ هزینه‌ها در هر اجرا با edge_costs()).
+    """
+    G: nx.Graph
+    nodes_allowed: gpd.GeoDataFrame
+    edges_allowed: gpd.GeoDataFrame
+    nodes_blocked: gpd.GeoDataFrame
+    edges_blocked: gpd.GeoDataFrame
 
-    traits = AgentTraits()
+
+def load_inputs(paths: Optional[dict] = None, temp_c: Optional[float] = None) -> SimInputs:
+    """
+    paths: {"roads", "nodes", "origins", "destinations", "buildings", "vegetation"} → فایل
+    (پیش‌فرض: فایل‌های داخل src/data). buildings/vegetation اختیاری‌اند.
+    """
+    paths = paths or {
+        "roads": FP_ROADS, "nodes": FP_NODES, "origins": FP_ORG,
+        "destinations": FP_DST, "buildings": FP_BLDG, "vegetation": FP_VEG,
+    }
+    return SimInputs(
+        roads=to_metric(ensure_user_col(read_geo(paths["roads"]))),
+        nodes=to_metric(ensure_user_col(read_geo(paths["nodes"]))),
+        origins=to_metric(read_geo(paths["origins"])),
+        destinations=to_metric(read_geo(paths["destinations"])),
+        buildings=to_metric(read_geo(paths["buildings"])) if paths.get("buildings") else None,
+        vegetation=to_metric(read_geo(paths["vegetation"])) if paths.get("vegetation") else None,
+        temp_c=read_weather_temp(default_c=25.0) if temp_c is None else float(temp_c),
+        version=sources_version({k: paths.get(k) for k in NETWORK_SOURCES}, extra=f"snap={SNAP_RAD_NODE};rev={GRAPH_REV}"),
+    )
+
+
+def prepare_network(inputs: SimInputs, bundle_path: Optional[str] = None) -> SimNetwork:
+    """
+    گراف از باندل کامپایل‌شده (اگر با همین نسخه‌ی ورودی‌ها ساخته شده باشد)، وگرنه ساخت کامل
+    و نوشتن باندل برای اجرای بعدی.
+    """
+    if bundle_path and inputs.version:
+        network = load_network(bundle_path, inputs)
+        if network is not None:
+            return network
 
     G, nodes_allowed, edges_allowed, nodes_blocked, edges_blocked = build_graph(
-    roads_all, nodes_all, bldg, veg, traits, temp_c, snap_rad_node=15.0
-)
+        inputs.roads, inputs.nodes, inputs.buildings, inputs.vegetation, snap_rad_node=SNAP_RAD_NODE,
+    )
+    network = SimNetwork(G, nodes_allowed, edges_allowed, nodes_blocked, edges_blocked)
+    if bundle_path and inputs.version:
+        try:
+            save_network(bundle_path, inputs, network)
+        except OSError:
+            pass  # فقط‌خواندنی: همان نسخه‌ی حافظه کافی است
+    return network
+
+
+def save_network(bundle_path: str, inputs: SimInputs, network: SimNetwork) -> None:
+    """یال‌ها (به ترتیب eid) + گره‌های ساخته‌شده در اسنپ → npz"""
+    n_input = int(ensure_user_col(inputs.nodes)["user"].isin(ALLOWED).sum())
+    created = network.nodes_allowed.iloc[n_input:]
+    e = network.edges_allowed
+    save_bundle(bundle_path, inputs.version, {
+        "created_ids": created.index.to_numpy(dtype=np.int64),
+        "edge_u": e["u"].to_numpy(dtype=np.int64),
+        "edge_v": e["v"].to_numpy(dtype=np.int64),
+        "length": e["length"].to_numpy(dtype="float64"),
+        "shade_ratio": e["shade_ratio"].to_numpy(dtype="float64"),
+        "near_b_ratio": e["near_b_ratio"].to_numpy(dtype="float64"),
+    }, {"created": created.geometry.values, "edges": e.geometry.values})
+
+
+def load_network(bundle_path: str, inputs: SimInputs) -> Optional[SimNetwork]:
+    """SimNetwork از باندل، بدون بافر/اسنپ دوباره؛ None اگر باندل نبود یا کهنه بود."""
+    bundle = load_bundle(bundle_path, inputs.version)
+    if bundle is None:
+        return None
+    a, g = bundle
+    _, roads_blocked, nodes_allowed, nodes_blocked = split_by_user(inputs.roads, inputs.nodes)
+    if len(a["created_ids"]):
+        created = gpd.GeoDataFrame({"user": 1}, geometry=g["created"], index=a["created_ids"],
+                                   crs=nodes_allowed.crs)
+        nodes_allowed = pd.concat([nodes_allowed, created])
+
+    edges_allowed = gpd.GeoDataFrame({
+        "u": a["edge_u"], "v": a["edge_v"], "geometry": g["edges"], "user": 1,
+        "length": a["length"], "shade_ratio": a["shade_ratio"], "near_b_ratio": a["near_b_ratio"],
+    }, geometry="geometry", crs=inputs.roads.crs)
 
-    print(f"✅ گراف ساخته شد → nodes_allowed: {len(nodes_allowed)}, edges_allowed: {len(edges_allowed)}")
+    G = nx.Graph()
+    G.add_nodes_from((int(nid), {"geom": geom}) for nid, geom in zip(nodes_allowed.index, nodes_allowed.geometry))
+    # ترتیب eid همان ترتیب درج اصلی است (یال‌های تکراری مثل قبل با آخرین eid بازنویسی می‌شوند)
+    for k, (u, v, line, length, sr, nr) in enumerate(zip(
+            a["edge_u"].tolist(), a["edge_v"].tolist(), g["edges"], a["length"].tolist(),
+            a["shade_ratio"].tolist(), a["near_b_ratio"].tolist())):
+        G.add_edge(u, v, eid=k, geometry=line, length=length, shade_ratio=sr, near_b_ratio=nr)
 
-    # ذخیره همه‌ی لایه‌ها (۱ و ۰)
-    if Path(OUT_GPKG).exists():
-        Path(OUT_GPKG).unlink()
-    nodes_allowed.to_file(OUT_GPKG, layer="graph_nodes_allowed", driver="GPKG")
-    edges_allowed.to_file(OUT_GPKG, layer="graph_edges_allowed", driver="GPKG")
-    if len(nodes_blocked): nodes_blocked.to_file(OUT_GPKG, layer="graph_nodes_blocked", driver="GPKG")
-    if len(edges_blocked): edges_blocked.to_file(OUT_GPKG, layer="graph_edges_blocked", driver="GPKG")
+    return SimNetwork(G, nodes_allowed, edges_allowed,
+                      nodes_blocked[["geometry", "user"]].copy(), roads_blocked[["geometry", "user"]].copy())
 
-    if org is not None: org.to_file(OUT_GPKG, layer="origins", driver="GPKG")
-    if dst is not None: dst.to_file(OUT_GPKG, layer="destinations", driver="GPKG")
-    if bldg is not None: bldg.to_file(OUT_GPKG, layer="buildings", driver="GPKG")
-    if veg  is not None: veg.to_file(OUT_GPKG, layer="vegetation", driver="GPKG")
-    print(f"🟢 خروجی لایه‌ها نوشته شد → {OUT_GPKG}")
 
-    # مسیر‌یابی
-    print("🚶 در حال محاسبه مسیر بین مبدا و مقصدها...")
+def compute_routes(network: SimNetwork, origins: gpd.GeoDataFrame, destinations: gpd.GeoDataFrame,
+                   temp_c: float = 25.0, traits: Optional[AgentTraits] = None,
+                   backend: str = ROUTING_BACKEND, verbose: bool = True,
+                   classes: Optional[Iterable[str]] = None) -> gpd.GeoDataFrame:
+    """
+    مسیر بین مبدا و مقصدهای هم‌Id. گراف ورودی دست نمی‌خورد (گره‌های مجازی روی یک کپی).
+    فقط آرایه‌ی هزینه از دمای فعلی ساخته می‌شود؛ توپولوژی و نسبت‌ها از قبل آماده‌اند.
+    کلاس‌های عامل (AGENT_CLASSES): با classes هر جفت برای تک‌تک کلاس‌ها مسیر می‌گیرد؛ وگرنه اگر
+    مبداها ستون agent_class داشته باشند هر جفت با کلاس خودش. برای هر کلاس یک آرایه‌ی هزینه و
+    یک دسته مسیر‌یابی روی همان گراف.
+    خروجی: GeoDataFrame با ستون‌های Id, geometry (+ agent_class وقتی کلاس‌ها در کارند)، CRS ورودی
+    """
+    classes = list(classes) if classes is not None else None
+    for name in classes or []:
+        if name not in AGENT_CLASSES:
+            raise ValueError(f"Unknown agent class: {name}")
+    say = print if verbose else (lambda *a, **k: None)
+    G = network.G.copy()
+    edges_allowed = network.edges_allowed
+
+    org = origins.copy()
+    dst = destinations.copy()
     if "Id" not in org.columns: org["Id"] = np.arange(1, len(org)+1, dtype=int)
     if "Id" not in dst.columns: dst["Id"] = np.arange(1, len(dst)+1, dtype=int)
 
+    # اول همه‌ی مبدا/مقصدها یکجا اسنپ می‌شوند، بعد برای هر مبدا یکتا فقط یک جست‌وجو
+    oids = sorted(set(org["Id"]).intersection(set(dst["Id"])))
+    o_pts = org.drop_duplicates("Id").set_index("Id").geometry.reindex(oids).to_numpy()
+    d_pts = dst.drop_duplicates("Id").set_index("Id").geometry.reindex(oids).to_numpy()
+    snapped = snap_points_to_graph(np.concatenate([o_pts, d_pts]), G, network.nodes_allowed,
+                                   edges_allowed, rad_nodes=30.0, rad_edge=120.0)
+    by_class = classes is not None or "agent_class" in org.columns
+    if classes is None and by_class:
+        own = org.drop_duplicates("Id").set_index("Id")["agent_class"].reindex(oids)
+        unknown = sorted(set(own.dropna()) - set(AGENT_CLASSES))
+        if unknown:
+            raise ValueError(f"Unknown agent class: {', '.join(map(str, unknown))}")
+        pair_classes = [[c if isinstance(c, str) else "adult"] for c in own]
+    else:
+        pair_classes = [classes or [None]] * len(oids)
+
+    # گروه‌بندی جفت‌ها بر اساس کلاس (None = traits ورودی، رفتار تک‌کلاسه)
+    groups: dict[Optional[str], list] = {}
+    for k, oid in enumerate(oids):
+        u, v = int(snapped[k]), int(snapped[len(oids) + k])
+        if u < 0 or v < 0:
+            say(f"⚠️ اسنپ Id={oid} شکست خورد.")
+            continue
+        for name in pair_classes[k]:
+            groups.setdefault(name, []).append((oid, o_pts[k], d_pts[k], u, v))
+
+    jobs = [(edge_costs(edges_allowed, AGENT_CLASSES[name] if name else (traits or AgentTraits()), temp_c),
+             [(u, v) for _, _, _, u, v in pairs]) for name, pairs in groups.items()]
+    paths_by_class = route_pairs_by_cost(G, jobs, backend=backend)
+
     routes = []
-    for oid in sorted(set(org["Id"]).intersection(set(dst["Id"]))):
+    results = [(name, pair, path) for (name, pairs), paths in zip(groups.items(), paths_by_class)
+               for pair, path in zip(pairs, paths)]
+    for name, (oid, o_pt, d_pt, u, v), path in results:
         try:
-            o_pt = org.loc[org["Id"]==oid].geometry.values[0]
-            d_pt = dst.loc[dst["Id"]==oid].geometry.values[0]
-            u,_ = snap_point_to_graph(o_pt, nodes_allowed, edges_allowed, G, traits, 30.0, 120.0)
-            v,_ = snap_point_to_graph(d_pt, nodes_allowed, edges_allowed, G, traits, 30.0, 120.0)
-            if u is None or v is None:
-                print(f"⚠️ اسنپ Id={oid} شکست خورد.")
-                continue
-
-            path = nx.shortest_path(G, source=u, target=v, weight="cost")
+            if path is None:
+                raise nx.NetworkXNoPath(f"No path between {u} and {v}.")
             # جمع‌کردن خطوط مسیر و linemerge
             segs = []
             for i in range(len(path)-1):
@@ -405,14 +615,149 @@ def main():
                     coords.extend(list(s.coords) if not coords else list(s.coords)[1:])
                 line = connect_endpoints_exact(LineString(coords), o_pt, d_pt, tol=0.3)
 
-            routes.append({"Id": int(oid), "geometry": line})
-            print(f"✅ مسیر Id={oid} ساخته و متصل شد.")
+            routes.append({"Id": int(oid), "agent_class": name, "geometry": line})
+            say(f"✅ مسیر Id={oid}{f' ({name})' if name else ''} ساخته و متصل شد.")
         except Exception as e:
-            print(f"⚠️ مسیر برای Id={oid} پیدا نشد: {e}")
+            say(f"⚠️ مسیر برای Id={oid}{f' ({name})' if name else ''} پیدا نشد: {e}")
+
+    crs = org.crs or dst.crs or edges_allowed.crs
+    columns = ["Id", "agent_class", "geometry"] if by_class else ["Id", "geometry"]
+    return gpd.GeoDataFrame(routes, columns=columns, geometry="geometry", crs=crs)
+
+
+GPKG_HASH_SUFFIX = ".hashes.json"  # فایل کناری GPKG: layer → هش محتوا، همراه اندازه/زمان خود GPKG
+LEGACY_HASH_TABLE = "layer_hashes"  # جدول قدیمی داخل GPKG (بی‌ردیف در gpkg_contents) که پاک می‌شود
+
+
+def layer_digest(gdf: gpd.GeoDataFrame) -> str:
+    """هش محتوای لایه: CRS + ستون‌ها/نوع‌ها + مقادیر (با ایندکس) + WKB هندسه‌ها"""
+    h = hashlib.sha1()
+    h.update(f"{gdf.crs}|{[(c, str(t)) for c, t in gdf.dtypes.items()]}".encode())
+    attrs = gdf.drop(columns=gdf.geometry.name)
+    h.update(pd.util.hash_pandas_object(attrs if len(attrs.columns) else attrs.index, index=True)
+             .to_numpy().tobytes())
+    for wkb in shapely.to_wkb(np.asarray(gdf.geometry.values)):
+        h.update(wkb or b"\0")
+    return h.hexdigest()
+
+
+def _gpkg_stamp(gpkg_path: str) -> list:
+    st = os.stat(gpkg_path)
+    return [st.st_size, st.st_mtime_ns]
 
-    if routes:
-        routes_gdf = gpd.GeoDataFrame(routes, geometry="geometry", crs=org.crs or dst.crs or edges_allowed.crs)
-        routes_gdf.to_file(OUT_GPKG, layer="routes_final", driver="GPKG")
+
+def _read_layer_hashes(gpkg_path: str) -> dict:
+    """هش‌های فایل کناری؛ اگر GPKG بعد از آخرین ثبت عوض شده باشد (اندازه/زمان) هیچ هشی معتبر نیست"""
+    try:
+        data = json.loads(Path(gpkg_path + GPKG_HASH_SUFFIX).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("stamp") != _gpkg_stamp(gpkg_path):
+        return {}
+    return dict(data.get("layers") or {})
+
+
+def _write_layer_hashes(gpkg_path: str, hashes: dict) -> None:
+    """ثبت اتمیک (tmp + replace) هش‌ها همراه مهر فعلی GPKG"""
+    side = gpkg_path + GPKG_HASH_SUFFIX
+    if not Path(gpkg_path).exists():
+        Path(side).unlink(missing_ok=True)
+        return
+    tmp = side + ".tmp"
+    Path(tmp).write_text(json.dumps({"stamp": _gpkg_stamp(gpkg_path), "layers": hashes}), encoding="utf-8")
+    os.replace(tmp, side)
+
+
+def _gpkg_state(gpkg_path: str) -> Tuple[set, dict]:
+    """
+    (لایه‌های موجود از gpkg_contents، هش‌های ثبت‌شده در فایل کناری GPKG_HASH_SUFFIX).
+    فقط فایلی که GeoPackage نیست یا خراب است کنار گذاشته می‌شود (به ‎.corrupt تغییر نام، نه حذف)
+    تا از نو ساخته شود؛ خطای قفل/IO (مثل database is locked) بالا می‌رود و فایل دست نمی‌خورد.
+    """
+    if not Path(gpkg_path).exists():
+        return set(), {}
+    con = sqlite3.connect(gpkg_path)
+    try:
+        with con:
+            layers = {str(r[0]) for r in con.execute("SELECT table_name FROM gpkg_contents")}
+            legacy = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (LEGACY_HASH_TABLE,)).fetchone()
+            if legacy and LEGACY_HASH_TABLE not in layers:
+                con.execute(f"DROP TABLE {LEGACY_HASH_TABLE}")
+        return layers, _read_layer_hashes(gpkg_path)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise  # قفل، دیسک پر، دسترسی ...
+    except sqlite3.DatabaseError:
+        pass  # file is not a database / database disk image is malformed
+    finally:
+        con.close()
+    os.replace(gpkg_path, f"{gpkg_path}.corrupt")
+    return set(), {}
+
+
+def export_gpkg(gpkg_path: str, inputs: SimInputs, network: SimNetwork,
+                routes: Optional[gpd.GeoDataFrame] = None) -> list[str]:
+    """
+    ذخیره همه‌ی لایه‌ها (۱ و ۰) + routes_final در یک GPKG (اختیاری)، به‌صورت افزایشی:
+    فقط لایه‌هایی که هش محتوایشان با فایل کناری هش‌ها فرق دارد بازنویسی می‌شوند (هر لایه در
+    یک تراکنش)، لایه‌هایی که این بار خالی/ناموجودند حذف می‌شوند و فایل دیگر پاک نمی‌شود.
+    برگشتی: نام لایه‌های نوشته یا حذف‌شده.
+    """
+    layers = {
+        "graph_nodes_allowed": network.nodes_allowed,
+        "graph_edges_allowed": network.edges_allowed,
+        "graph_nodes_blocked": network.nodes_blocked,
+        "graph_edges_blocked": network.edges_blocked,
+        "origins": inputs.origins,
+        "destinations": inputs.destinations,
+        "buildings": inputs.buildings,
+        "vegetation": inputs.vegetation,
+        "routes_final": routes,
+    }
+    present, hashes = _gpkg_state(gpkg_path)
+    changed = []
+    for name, gdf in layers.items():
+        if gdf is None or not len(gdf):
+            if name in present:
+                fiona.remove(gpkg_path, layer=name)
+                changed.append(name)
+            hashes.pop(name, None)
+            continue
+        digest = layer_digest(gdf)
+        if name in present and hashes.get(name) == digest:
+            continue
+        gdf.to_file(gpkg_path, layer=name, driver="GPKG", engine="pyogrio")
+        hashes[name] = digest
+        changed.append(name)
+    # اگر اجرا وسط کار قطع شود مهر GPKG با فایل کناری نمی‌خواند و دفعه‌ی بعد همه دوباره نوشته می‌شوند
+    if changed or not Path(gpkg_path + GPKG_HASH_SUFFIX).exists():
+        _write_layer_hashes(gpkg_path, hashes)
+    return changed
+
+
+# ------------- Main -------------
+def main():
+    print("🚀 شروع: بارگذاری لایه‌ها")
+    inputs = load_inputs()
+    traits = AgentTraits()
+
+    network = prepare_network(inputs, NETWORK_BUNDLE)
+    if "--build-network" in sys.argv[1:]:
+        print(f"🟢 شبکه‌ی کامپایل‌شده → {NETWORK_BUNDLE}")
+        return
+    print(f"✅ گراف ساخته شد → nodes_allowed: {len(network.nodes_allowed)}, edges_allowed: {len(network.edges_allowed)}")
+
+    # مسیر‌یابی
+    print("🚶 در حال محاسبه مسیر بین مبدا و مقصدها...")
+    # --classes=elderly,child → هر جفت برای هر کلاس (AGENT_CLASSES)
+    classes = next((a.split("=", 1)[1].split(",") for a in sys.argv[1:] if a.startswith("--classes=")), None)
+    routes_gdf = compute_routes(network, inputs.origins, inputs.destinations, inputs.temp_c, traits,
+                                classes=classes)
+
+    written = export_gpkg(OUT_GPKG, inputs, network, routes_gdf)
+    print(f"🟢 خروجی لایه‌ها به‌روز شد → {OUT_GPKG} ({', '.join(written) or 'بدون تغییر'})")
+    if len(routes_gdf):
         print(f"🟢 مسیر نهایی ذخیره شد → routes_final ({len(routes_gdf)} مسیر)")
     else:
         print("⚠️ هیچ مسیری ساخته نشد.")
@@ -421,4 +766,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
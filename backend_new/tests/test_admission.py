@@ -0,0 +1,135 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from app.main import overloaded_handler
+from app.services import admission as adm
+
+
+def _blocked(admission, cost_class, key, gate, calls):
+    """Start a leader that holds its slot until `gate` is set"""
+    started = threading.Event()
+
+    def work():
+        started.set()
+        calls.append(key)
+        gate.wait(5)
+        return JSONResponse({"key": key})
+
+    t = threading.Thread(target=lambda: admission.run(cost_class, key, work))
+    t.start()
+    started.wait(5)
+    return t
+
+
+def test_full_class_rejects_with_overloaded():
+    a = adm.Admission({"heavy": (1, 0)}, queue_timeout_s=5)
+    gate, calls = threading.Event(), []
+    leader = _blocked(a, "heavy", "a", gate, calls)
+    with pytest.raises(adm.Overloaded) as exc:
+        a.run("heavy", "b", lambda: None)
+    gate.set()
+    leader.join()
+    assert exc.value.cost_class == "heavy"
+    assert a.stats()["heavy"] == {"computed": 1, "coalesced": 0, "rejected": 1, "timeouts": 0,
+                                  "running": 0, "queued": 0, "slots": 1, "queue_limit": 0}
+
+
+def test_queue_wait_times_out():
+    a = adm.Admission({"medium": (1, 1)}, queue_timeout_s=0.05)
+    gate, calls = threading.Event(), []
+    leader = _blocked(a, "medium", "a", gate, calls)
+    with pytest.raises(adm.Overloaded):
+        a.run("medium", "b", lambda: None)
+    gate.set()
+    leader.join()
+    assert a.stats()["medium"]["timeouts"] == 1
+    assert a.run("medium", "b", lambda: "free again") == "free again"
+
+
+def test_guarded_endpoint_answers_503_with_retry_after(monkeypatch):
+    a = adm.Admission({"heavy": (1, 0)}, queue_timeout_s=5)
+    monkeypatch.setattr(adm, "ADMISSION", a)
+    app = FastAPI()
+    app.add_exception_handler(adm.Overloaded, overloaded_handler)
+
+    @app.get("/slow")
+    @adm.guarded("heavy")
+    def slow(n: int = 0):
+        return {"n": n}
+
+    client = TestClient(app)
+    assert client.get("/slow").json() == {"n": 0}
+    gate = threading.Event()
+    leader = _blocked(a, "heavy", "other", gate, [])
+    r = client.get("/slow")
+    gate.set()
+    leader.join()
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == str(adm.RETRY_AFTER_S)
+    assert r.json()["cost_class"] == "heavy"
+
+
+def test_guarded_rejects_unknown_class():
+    with pytest.raises(ValueError):
+        adm.guarded("gigantic")
+
+
+def test_identical_requests_share_one_computation_but_not_the_response():
+    a = adm.Admission({"heavy": (1, 4)}, queue_timeout_s=5)
+    gate, calls, out = threading.Event(), [], []
+
+    def work():
+        calls.append(1)
+        gate.wait(5)
+        return JSONResponse({"routes": 3}, headers={"X-Source": "leader"})
+
+    leader = threading.Thread(target=lambda: out.append(a.run("heavy", "k", work)))
+    leader.start()
+    with ThreadPoolExecutor(3) as pool:
+        followers = [pool.submit(a.run, "heavy", "k", work) for _ in range(3)]
+        while a.stats()["heavy"]["coalesced"] < 3:
+            threading.Event().wait(0.01)
+        gate.set()
+        out += [f.result() for f in followers]
+    leader.join()
+
+    assert len(calls) == 1 and len(out) == 4
+    assert len({id(r) for r in out}) == 4
+    assert {r.body for r in out} == {b'{"routes":3}'}
+    assert all(r.status_code == 200 and r.headers["x-source"] == "leader" for r in out)
+
+    out[1].headers["X-Cache"] = "hit"  # e.g. a middleware tagging one caller's response
+    assert all("x-cache" not in r.headers for r in out if r is not out[1])
+
+
+def test_async_followers_get_their_own_response():
+    a = adm.Admission({"medium": (2, 4)}, queue_timeout_s=5)
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return JSONResponse({"ok": True}, status_code=202)
+
+    async def main():
+        return await asyncio.gather(*(a.run_async("medium", "k", work) for _ in range(3)))
+
+    out = asyncio.run(main())
+    assert len(calls) == 1
+    assert len({id(r) for r in out}) == 3
+    assert all(r.status_code == 202 and r.body == b'{"ok":true}' for r in out)
+    assert all(r.headers["content-type"] == "application/json" for r in out)
+
+
+def test_plain_results_and_errors_are_shared_as_is():
+    a = adm.Admission({"medium": (1, 1)}, queue_timeout_s=5)
+    assert a.run("medium", "k", lambda: {"x": 1}) == {"x": 1}
+    with pytest.raises(ZeroDivisionError):
+        a.run("medium", "k", lambda: 1 / 0)
+    assert a.stats()["medium"]["running"] == 0
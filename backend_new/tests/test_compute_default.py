@@ -0,0 +1,34 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.features import transport_agent_api as t
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(t, "SRC_OUT", str(tmp_path))
+    monkeypatch.setattr(t, "NETWORK_BUNDLE", "")
+    app = FastAPI()
+    app.include_router(t.router)
+    return TestClient(app)
+
+
+def test_load_existing_serves_the_latest_run(client, tmp_path):
+    run = client.get("/transport/compute-default")
+    assert run.status_code == 200
+    assert run.json()["meta"]["output_file"] == "results.gpkg"
+    assert (tmp_path / "results.gpkg").exists()
+
+    loaded = client.get("/transport/load-existing")
+    assert loaded.status_code == 200
+    body = loaded.json()
+    assert body["meta"]["file"] == "results.gpkg"
+    assert len(body["routes_final"]["features"]) == run.json()["meta"]["routes"] > 0
+
+
+def test_export_can_be_skipped(client, tmp_path):
+    run = client.get("/transport/compute-default", params={"export_gpkg": False})
+    assert run.status_code == 200
+    assert "output_file" not in run.json()["meta"]
+    assert not (tmp_path / "results.gpkg").exists()
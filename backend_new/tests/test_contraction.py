@@ -0,0 +1,121 @@
+import math
+from itertools import pairwise
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from app.src.road_network import WEIGHTING_CACHE_SIZE, compile_graph, contract_degree2
+
+N_GRAPHS = 300
+
+
+def _subdivided_graph(rng: np.random.Generator) -> nx.Graph:
+    """Random planar-ish graph whose edges are split into chains of degree-2 nodes"""
+    n = int(rng.integers(2, 12))
+    base = nx.gnm_random_graph(n, int(rng.integers(1, 2 * n)), seed=int(rng.integers(1 << 31)))
+    pos = {i: rng.uniform(0, 100, 2) for i in base.nodes}
+    G = nx.Graph()
+    G.add_nodes_from((i, {"x": p[0], "y": p[1]}) for i, p in pos.items())
+    nxt = n
+    for u, v in base.edges:
+        k = int(rng.integers(0, 5))  # interior nodes on this edge
+        chain = [u]
+        for t in np.linspace(0, 1, k + 2)[1:-1]:
+            p = pos[u] + t * (pos[v] - pos[u]) + rng.normal(0, 1, 2)
+            G.add_node(nxt, x=p[0], y=p[1])
+            chain.append(nxt)
+            nxt += 1
+        chain.append(v)
+        G.add_edges_from(pairwise(chain))
+    return G
+
+
+def _weights(cg, rng: np.random.Generator) -> np.ndarray:
+    """Per-edge costs at or above the straight-line length, as the router's weights are"""
+    a, b = cg.xy[cg.edge_u], cg.xy[cg.edge_v]
+    return np.hypot(*(a - b).T) * rng.uniform(1.0, 3.0, cg.n_edges) + 1e-3
+
+
+def _path_cost(cg, path, w) -> float:
+    return float(w[cg.path_edges(path)].sum()) if len(path) > 1 else 0.0
+
+
+def _assert_path(cg, path, source, target, w, expected):
+    assert path[0] == source and path[-1] == target
+    assert _path_cost(cg, path, w) == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_contraction_matches_full_graph():
+    rng = np.random.default_rng(7)
+    for _ in range(N_GRAPHS):
+        G = _subdivided_graph(rng)
+        cg, _ = compile_graph(G, lambda n, d: (d["x"], d["y"]))
+        con = contract_degree2(cg)
+        w = _weights(cg, rng)
+        nodes = np.arange(cg.n_nodes)
+        src = rng.choice(nodes, min(6, cg.n_nodes), replace=False)
+        dst = rng.choice(nodes, min(6, cg.n_nodes), replace=False)
+
+        full = cg.cost_matrix(src, dst, w)
+        np.testing.assert_allclose(con.cost_matrix(src, dst, w), full, rtol=1e-9, atol=1e-9)
+
+        s_pairs, t_pairs = np.repeat(src, len(dst)), np.tile(dst, len(src))
+        expected = full.ravel()
+        for i, path in enumerate(con.shortest_paths(s_pairs, t_pairs, w)):
+            if math.isinf(expected[i]):
+                assert path is None
+            else:
+                _assert_path(cg, path, s_pairs[i], t_pairs[i], w, expected[i])
+
+        weighting = con.weighting(w, key="test")
+        for s, t, cost in zip(s_pairs[:8], t_pairs[:8], expected[:8]):
+            for ww in (w, weighting):
+                path, c, _ = con.point_to_point(int(s), int(t), ww)
+                assert c == pytest.approx(cost, rel=1e-9, abs=1e-9)
+                if path is not None:
+                    _assert_path(cg, path, s, t, w, cost)
+            _, c, _ = cg.point_to_point(int(s), int(t), w)
+            assert c == pytest.approx(cost, rel=1e-9, abs=1e-9)
+
+
+def _compiled(G):
+    return compile_graph(G, lambda n, d: (d["x"], d["y"]))[0]
+
+
+def _line_graph(n):
+    G = nx.path_graph(n)
+    nx.set_node_attributes(G, {i: float(i) for i in G}, "x")
+    nx.set_node_attributes(G, 0.0, "y")
+    return G
+
+
+def test_path_folds_into_one_core_edge():
+    cg = _compiled(_line_graph(6))
+    con = contract_degree2(cg)
+    assert con.core.n_nodes == 2 and con.core.n_edges == 1
+    assert con.members.tolist() in ([0, 1, 2, 3, 4], [4, 3, 2, 1, 0])
+    np.testing.assert_allclose(con.chain_weights(np.arange(1.0, 6.0)), [15.0])
+    assert con.shortest_paths([1], [4], np.ones(5)) == [[1, 2, 3, 4]]
+
+
+def test_cycle_and_parallel_chains_keep_a_simple_core():
+    square = nx.cycle_graph(4)
+    nx.set_node_attributes(square, {0: 0.0, 1: 1.0, 2: 1.0, 3: 0.0}, "x")
+    nx.set_node_attributes(square, {0: 0.0, 1: 0.0, 2: 1.0, 3: 1.0}, "y")
+    con = contract_degree2(_compiled(square))
+    core = set(zip(con.core.edge_u.tolist(), con.core.edge_v.tolist()))
+    assert all(u != v for u, v in core)
+    assert len({tuple(sorted(e)) for e in core}) == len(core)
+    assert con.cost_matrix([0], [2], np.ones(4)).item() == 2.0
+
+
+def test_weighting_cache_is_keyed_and_bounded():
+    con = contract_degree2(_compiled(_line_graph(4)))
+    w = np.ones(3)
+    first = con.weighting(w, key="a")
+    assert con.weighting(w * 5, key="a") is first
+    assert con.weighting(w, key=None) is not first
+    for k in range(WEIGHTING_CACHE_SIZE):
+        con.weighting(w, key=k)
+    assert "a" not in con.weightings and len(con.weightings) == WEIGHTING_CACHE_SIZE
@@ -0,0 +1,68 @@
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Point, Polygon
+
+from app.src import evacuation_sim as ev
+from app.src.road_network import NodeIndex, compile_graph
+
+
+def _corridor(n=6, edge_m=20.0):
+    """A street of n edges (nodes 0..n along x) plus a detached block 100-101"""
+    G = nx.Graph()
+    for i in range(n):
+        G.add_edge(i, i + 1, geometry=LineString([(i * edge_m, 0), ((i + 1) * edge_m, 0)]))
+    G.add_edge(100, 101, geometry=LineString([(0, 500), (edge_m, 500)]))
+    xy = {i: (i * edge_m, 0.0) for i in range(n + 1)} | {100: (0.0, 500.0), 101: (edge_m, 500.0)}
+    cg, _ = compile_graph(G, lambda node, d: xy[node])
+    pos = cg.node_pos()
+    length = np.full(cg.n_edges, edge_m)
+    return cg, pos, length
+
+
+def test_seed_agents_rounds_population_without_bias():
+    index = NodeIndex([0, 1], [(0, 0), (100, 0)])
+    parcels = gpd.GeoDataFrame({"Pop": [3.0, 0.0, np.nan, -4.0, 1.0]}, geometry=[
+        Point(1, 1).buffer(1), Point(99, 0).buffer(1), Point(50, 0).buffer(1), Point(0, 0).buffer(1), Polygon(),
+    ])
+    start = ev.seed_agents(parcels, index, ev.EvacParams(), np.random.default_rng(0))
+    assert start.tolist() == [0, 0, 0, -1]  # the empty parcel's agent has no start node
+
+    many = gpd.GeoDataFrame({"Pop": np.full(4000, 0.25)}, geometry=[Point(0, 0)] * 4000)
+    n = len(ev.seed_agents(many, index, ev.EvacParams(agents_per_person=2.0), np.random.default_rng(1)))
+    assert n == pytest.approx(2000, rel=0.05)
+
+
+def test_everyone_reachable_arrives_and_the_rest_are_stranded():
+    cg, pos, length = _corridor()
+    start = np.r_[np.full(30, pos[0]), np.full(5, pos[100]), [-1, -1], [pos[6]]]
+    result = ev.simulate(cg, length, length, np.array([pos[6]]), start,
+                         ev.EvacParams(ticks=400, depart_spread_s=10.0))
+    assert result.n_agents == 38 and result.stranded == 7
+    assert result.arrived[-1] == 31
+    assert result.arrival_s[-1] == 0.0  # started on the destination
+    assert np.isnan(result.arrival_s[30:37]).all()
+    # 120 m at walking speed is the lower bound for anyone who had to walk
+    assert np.nanmin(result.arrival_s[:30]) >= 120 / ev.EvacParams().walk_speed_mps
+    # clearance counts only agents that can get out
+    assert result.clearance_s(1.0) == result.t_s[np.argmax(result.arrived == 31)]
+
+
+def test_sparse_load_record_replays_the_per_edge_statistics():
+    cg, pos, length = _corridor()
+    params = ev.EvacParams(ticks=300, depart_spread_s=30.0, record_every=3, seed=4)
+    start = np.repeat([pos[0], pos[2], pos[3]], [60, 25, 25])
+    result = ev.simulate(cg, length, length, np.array([pos[6]]), start, params)
+
+    n_rec = len(result.load_t_s)
+    dense = np.stack([result.load_at(r) for r in range(n_rec)])
+    np.testing.assert_array_equal(dense.max(axis=0), result.peak_load)
+    np.testing.assert_allclose(dense.mean(axis=0), result.mean_load)
+    np.testing.assert_allclose((dense > 0).mean(axis=0), result.busy_share)
+    assert len(result.load_value) < dense.size  # only the changes are stored
+
+    jam = np.maximum(1.0, length * params.jam_density_ppm)
+    cap = np.maximum(1, np.floor(jam * params.max_fill))
+    assert (dense <= cap).all()
+    assert (dense[-1] == 0).all()
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+
+import geopandas as gpd
+import pyogrio
+import pytest
+from shapely.geometry import LineString, Point
+
+from app.src import simulate_agent as sa
+
+CRS = 3857
+
+
+@pytest.fixture
+def scene():
+    roads = gpd.GeoDataFrame({"User": [1, 1, 0]}, crs=CRS, geometry=[
+        LineString([(0, 0), (100, 0)]), LineString([(100, 0), (100, 100)]), LineString([(0, 50), (50, 50)]),
+    ])
+    nodes = gpd.GeoDataFrame({"User": [1, 1]}, crs=CRS, geometry=[Point(0, 0), Point(100, 100)])
+    origins = gpd.GeoDataFrame({"Id": [1]}, crs=CRS, geometry=[Point(1, 1)])
+    destinations = gpd.GeoDataFrame({"Id": [1]}, crs=CRS, geometry=[Point(99, 99)])
+    inputs = sa.SimInputs(roads=roads, nodes=nodes, origins=origins, destinations=destinations)
+    network = sa.SimNetwork(*sa.build_graph(roads, nodes, None, None))
+    routes = gpd.GeoDataFrame({"Id": [1]}, crs=CRS, geometry=[LineString([(0, 0), (100, 0), (100, 100)])])
+    return inputs, network, routes
+
+
+@pytest.fixture
+def gpkg(tmp_path):
+    return str(tmp_path / "results.gpkg")
+
+
+def _tables(path):
+    con = sqlite3.connect(path)
+    try:
+        return {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        con.close()
+
+
+def test_unchanged_layers_are_not_rewritten(scene, gpkg):
+    inputs, network, routes = scene
+    first = sa.export_gpkg(gpkg, inputs, network, routes)
+    assert "routes_final" in first and "graph_edges_allowed" in first
+    stamp = os.stat(gpkg).st_mtime_ns
+
+    assert sa.export_gpkg(gpkg, inputs, network, routes) == []
+    assert os.stat(gpkg).st_mtime_ns == stamp
+
+    moved = routes.copy()
+    moved.geometry = moved.translate(1.0, 0.0)
+    assert sa.export_gpkg(gpkg, inputs, network, moved) == ["routes_final"]
+
+
+def test_emptied_layer_is_removed(scene, gpkg):
+    inputs, network, routes = scene
+    sa.export_gpkg(gpkg, inputs, network, routes)
+    assert sa.export_gpkg(gpkg, inputs, network, None) == ["routes_final"]
+    assert "routes_final" not in pyogrio.list_layers(gpkg)[:, 0]
+
+
+def test_hashes_live_outside_the_geopackage(scene, gpkg):
+    inputs, network, routes = scene
+    sa.export_gpkg(gpkg, inputs, network, routes)
+    assert os.path.exists(gpkg + sa.GPKG_HASH_SUFFIX)
+    assert sa.LEGACY_HASH_TABLE not in _tables(gpkg)
+    assert sa.LEGACY_HASH_TABLE not in pyogrio.list_layers(gpkg)[:, 0]
+
+
+def test_legacy_hash_table_is_dropped(scene, gpkg):
+    inputs, network, routes = scene
+    sa.export_gpkg(gpkg, inputs, network, routes)
+    con = sqlite3.connect(gpkg)
+    with con:
+        con.execute(f"CREATE TABLE {sa.LEGACY_HASH_TABLE} (layer TEXT PRIMARY KEY, digest TEXT)")
+    con.close()
+    sa.export_gpkg(gpkg, inputs, network, routes)
+    assert sa.LEGACY_HASH_TABLE not in _tables(gpkg)
+
+
+def test_gpkg_changed_behind_our_back_is_rewritten(scene, gpkg):
+    inputs, network, routes = scene
+    written = sa.export_gpkg(gpkg, inputs, network, routes)
+    os.utime(gpkg, ns=(0, 0))
+    assert sorted(sa.export_gpkg(gpkg, inputs, network, routes)) == sorted(written)
+
+
+def test_corrupt_gpkg_is_set_aside(scene, gpkg):
+    inputs, network, routes = scene
+    with open(gpkg, "wb") as f:
+        f.write(b"not a geopackage" * 64)
+    assert "routes_final" in sa.export_gpkg(gpkg, inputs, network, routes)
+    assert os.path.exists(gpkg + ".corrupt")
+
+
+def test_layer_digest_tracks_content(scene):
+    _, _, routes = scene
+    assert sa.layer_digest(routes) == sa.layer_digest(routes.copy())
+    renamed = routes.assign(Id=[2])
+    assert sa.layer_digest(renamed) != sa.layer_digest(routes)
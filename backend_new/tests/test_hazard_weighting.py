@@ -0,0 +1,99 @@
+import json
+from collections import OrderedDict
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pytest
+from shapely.geometry import LineString, box
+
+from app.features import transport_agent_api as t
+
+
+@pytest.fixture
+def net():
+    G = nx.Graph()
+    G.add_edge(0, 1, eid=0, geometry=LineString([(0, 0), (100, 0)]))
+    G.add_edge(1, 2, eid=1, geometry=LineString([(100, 0), (100, 100)]))
+    G.add_edge(2, 3, eid=2, geometry=LineString([(100, 100), (200, 100)]))
+    return {"G": G, "arrays": {"length": np.full(3, 100.0)}}
+
+
+@pytest.fixture
+def out_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(t, "OUT_DIR", str(tmp_path))
+    monkeypatch.setattr(t, "_HAZARD_CACHE", OrderedDict())
+    return tmp_path
+
+
+def _write_parcels(path, risks, geoms):
+    gdf = gpd.GeoDataFrame({"risk_flood": risks}, geometry=geoms, crs=3857)
+    path.write_text(gdf.to_json())
+
+
+def test_exposure_is_length_weighted_and_normalised(net, out_dir):
+    # one parcel along edge 0 (half the top risk), the riskiest one far from every edge
+    _write_parcels(out_dir / "parcel_flood_risk.geojson", [2.0, 4.0],
+                   [box(0, -5, 100, 5), box(1000, 1000, 1010, 1010)])
+    exposure = t._hazard_exposure(net, "v1", "flood")
+    # edge 1 runs 5 + HAZARD_BUF_M metres inside the buffered parcel
+    np.testing.assert_allclose(exposure, [0.5, 0.5 * (5 + t.HAZARD_BUF_M) / 100, 0.0])
+
+
+def test_missing_risk_column_is_cached_as_none(net, out_dir, monkeypatch):
+    layer = out_dir / "parcel_flood_risk.geojson"
+    layer.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"other": 1}, "geometry": box(0, 0, 1, 1).__geo_interface__},
+    ]}))
+    assert t._hazard_exposure(net, "v1", "flood") is None
+    assert list(t._HAZARD_CACHE.values()) == [None]
+
+    def fail(*a, **kw):
+        raise AssertionError("layer re-read although its version did not change")
+
+    monkeypatch.setattr(t.gpd, "read_file", fail)
+    assert t._hazard_exposure(net, "v1", "flood") is None
+
+
+def test_no_layer_means_no_exposure(net, out_dir):
+    assert t._hazard_exposure(net, "v1", "flood") is None
+    assert t._hazard_exposure(net, "v1", "not-a-risk") is None
+    assert not t._HAZARD_CACHE
+
+
+def test_new_file_version_is_joined_again(net, out_dir, monkeypatch):
+    monkeypatch.setattr(t, "HAZARD_CACHE_SIZE", 1)
+    layer = out_dir / "parcel_flood_risk.geojson"
+    _write_parcels(layer, [1.0], [box(0, -5, 100, 5)])
+    first = t._hazard_exposure(net, "v1", "flood")
+    _write_parcels(layer, [1.0], [box(100, 95, 200, 105)])
+    second = t._hazard_exposure(net, "v1", "flood")
+    assert first[0] == pytest.approx(1.0) and second[0] == 0.0
+    assert second[2] == pytest.approx(1.0)
+    assert len(t._HAZARD_CACHE) == 1
+
+
+def test_edge_weights_scale_with_exposure(monkeypatch):
+    monkeypatch.setattr(t, "NETWORK_BUNDLE", "")
+    monkeypatch.setattr(t, "ROUTE_CACHE_DIR", "")
+    monkeypatch.setattr(t, "_ROUTE_CACHE", OrderedDict())
+    weights = {}
+    route_pairs = t._route_pairs
+
+    def capture(net, w, *args, **kw):
+        weights[coeff] = w
+        return route_pairs(net, w, *args, **kw)
+
+    monkeypatch.setattr(t, "_route_pairs", capture)
+    metas = {}
+    for coeff in (0.0, 2.5):
+        r = t._compute_weighted_internal("flood", max_pairs=2, hazard_coeff=coeff)
+        assert r.status_code == 200
+        metas[coeff] = json.loads(r.body)["meta"]
+
+    assert metas[0.0]["hazard"] is None
+    net, version = t._get_network()
+    exposure = t._hazard_exposure(net, version, "flood")
+    assert exposure.max() > 0
+    np.testing.assert_allclose(weights[2.5], weights[0.0] * (1.0 + 2.5 * exposure))
+    assert metas[2.5]["hazard"]["mean_exposure"] == pytest.approx(round(float(exposure.mean()), 4))
@@ -0,0 +1,49 @@
+import networkx as nx
+import numpy as np
+from shapely.geometry import Point
+
+from app.features import transport_agent_api as t
+from app.src.road_network import NodeIndex
+
+
+def _grid(n=6, step=10.0):
+    G = nx.grid_2d_graph(n, n)
+    for (i, j), d in G.nodes(data=True):
+        d["x"], d["y"] = i * step, j * step
+    return G
+
+
+def test_batch_matches_one_by_one_nearest():
+    rng = np.random.default_rng(27)
+    xy = rng.uniform(0, 1000, (300, 2))
+    index = NodeIndex([f"n{k}" for k in range(len(xy))], xy)
+    queries = rng.uniform(-50, 1050, (200, 2))
+    expected = [f"n{np.argmin(((xy - q) ** 2).sum(axis=1))}" for q in queries]
+    assert index.snap_points(queries) == expected
+    assert index.snap_points([Point(q) for q in queries]) == expected
+
+
+def test_empty_and_missing_points_snap_to_none():
+    index = NodeIndex(["a", "b"], [(0, 0), (10, 0)])
+    assert index.snap_points([Point(9, 1), None, Point(), Point(1, 1)]) == ["b", None, None, "a"]
+    assert index.snap_points([]) == []
+    assert NodeIndex([], np.empty((0, 2))).snap_points([Point(0, 0)]) == [None]
+
+
+def test_router_snaps_origins_and_destinations_together():
+    G = _grid()
+    pts = [Point(1, 2), Point(49, 51), Point(31, 8)]
+    assert t.snap_points(G, pts) == [(0, 0), (5, 5), (3, 1)]
+    assert t._nearest_graph_node(G, Point(22, 38)) == (2, 4)
+
+
+def test_index_is_reused_until_the_graph_changes():
+    G = _grid(3)
+    t.snap_points(G, [Point(0, 0)])
+    index = G.graph["node_index"]
+    t.snap_points(G, [Point(5, 5)])
+    assert G.graph["node_index"] is index
+
+    G.add_node("far", x=500.0, y=500.0)
+    assert t.snap_points(G, [Point(480, 490)]) == ["far"]
+    assert G.graph["node_index"] is not index
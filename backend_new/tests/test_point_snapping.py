@@ -0,0 +1,66 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Point
+
+from app.src import simulate_agent as sa
+
+CRS = 3857
+
+
+@pytest.fixture(scope="module")
+def network():
+    """An L of two 1 km roads; nodes 0 = (0, 0), 1 = (1000, 1000), 2 = the corner (1000, 0)"""
+    roads = gpd.GeoDataFrame({"User": [1, 1]}, crs=CRS, geometry=[
+        LineString([(0, 0), (1000, 0)]), LineString([(1000, 0), (1000, 1000)]),
+    ])
+    nodes = gpd.GeoDataFrame({"User": [1, 1]}, crs=CRS, geometry=[Point(0, 0), Point(1000, 1000)])
+    return sa.SimNetwork(*sa.build_graph(roads, nodes, None, None))
+
+
+def _snap(network, *pts):
+    G = network.G.copy()
+    ids = sa.snap_points_to_graph(list(pts), G, network.nodes_allowed, network.edges_allowed,
+                                  rad_nodes=30.0, rad_edge=120.0)
+    return G, ids
+
+
+def test_nodes_first_then_edges_then_nothing(network):
+    G, ids = _snap(network, Point(10, 5), Point(990, 20), Point(400, 50), Point(400, 500))
+    assert ids[:2].tolist() == [0, 2]
+    assert ids[2] > max(network.G.nodes)
+    assert ids[3] == -1
+    assert G.nodes[ids[2]]["geom"].equals(Point(400, 0))
+
+
+def test_split_pieces_keep_eid_shares_and_geometry(network):
+    G, ids = _snap(network, Point(700, -40), Point(250, 60))
+    a, b = int(ids[1]), int(ids[0])  # 250 m and 700 m along edge 0
+    chain = [0, a, b, 2]
+    for (u, v), share in zip(zip(chain, chain[1:]), [0.25, 0.45, 0.3]):
+        d = G.edges[u, v]
+        assert d["eid"] == 0
+        assert d["share"] == pytest.approx(share)
+        assert d["geometry"].length == pytest.approx(1000 * share)
+    assert network.G.number_of_nodes() == 3  # the shared graph is never touched
+
+
+def test_points_at_the_same_spot_share_one_virtual_node(network):
+    G, ids = _snap(network, Point(1050, 500), Point(950, 500), Point(1000, 700))
+    assert ids[0] == ids[1] != ids[2]
+    assert G.number_of_nodes() == network.G.number_of_nodes() + 2
+
+
+def test_projection_onto_an_edge_end_uses_the_end_node(network):
+    _, ids = _snap(network, Point(-60, 0), Point(1000, 1100))
+    assert ids.tolist() == [0, 1]
+
+
+def test_routes_start_and_end_at_mid_edge_points(network):
+    origins = gpd.GeoDataFrame({"Id": [1, 2]}, crs=CRS, geometry=[Point(300, 20), Point(5000, 5000)])
+    dests = gpd.GeoDataFrame({"Id": [1, 2]}, crs=CRS, geometry=[Point(1010, 600), Point(0, 0)])
+    routes = sa.compute_routes(network, origins, dests, backend="csr", verbose=False)
+    assert routes["Id"].tolist() == [1]  # Id 2's origin is out of reach
+    (line,) = routes.geometry
+    assert np.allclose(line.coords[0], (300, 20)) and np.allclose(line.coords[-1], (1010, 600))
+    assert line.length == pytest.approx(20 + 700 + 600 + 10)
@@ -0,0 +1,78 @@
+import json
+from collections import OrderedDict
+
+import pytest
+
+from app.features import transport_agent_api as t
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(t, "_ROUTE_CACHE", OrderedDict())
+    monkeypatch.setattr(t, "_ROUTE_STAMP", None)
+    monkeypatch.setattr(t, "_ROUTE_STATS", {"hits": 0, "misses": 0, "disk_hits": 0, "invalidations": 0})
+    monkeypatch.setattr(t, "NETWORK_BUNDLE", "")
+    monkeypatch.setattr(t, "ROUTE_CACHE_DIR", "")
+
+
+def _compute(**kw):
+    r = t._compute_weighted_internal("heat", max_pairs=3, **kw)
+    assert r.status_code == 200
+    return json.loads(r.body)
+
+
+def test_key_depends_on_engine_not_on_temperature():
+    args = ("stamp", "heat", 0.05, 0.02, 1.0)
+    nx_key = t._route_cache_key(*args, t._routing_engine("networkx", 0), 4)
+    assert nx_key == t._route_cache_key(*args, t._routing_engine("networkx", 1), 4)
+    assert nx_key != t._route_cache_key(*args, t._routing_engine("csr", 0), 4)
+    assert t._routing_engine("csr", 2) == t._routing_engine("networkx", 3) == "parallel"
+    assert nx_key != t._route_cache_key(*args, "networkx", 5)
+
+
+def test_second_request_is_a_hit_per_backend():
+    first = _compute(backend="networkx")
+    assert first["meta"]["cache"] == "miss"
+    again = _compute(backend="networkx")
+    assert again["meta"]["cache"] == "hit"
+    assert again["routes_final"] == first["routes_final"]
+
+    other = _compute(backend="csr")
+    assert other["meta"]["cache"] == "miss" and other["meta"]["backend"] == "csr"
+    assert t.route_cache_stats()["entries"] == 2
+
+
+def test_weather_change_invalidates(monkeypatch):
+    _compute()
+    monkeypatch.setattr(t, "_weather_version", lambda: "another-snapshot")
+    assert _compute()["meta"]["cache"] == "miss"
+    stats = t.route_cache_stats()
+    assert stats["invalidations"] == 1 and stats["entries"] == 1
+
+
+def test_result_of_a_superseded_stamp_is_not_stored():
+    assert t._route_cache_get("old", "k") is None
+    t._route_cache_get("new", "other")  # data changed while "old" was computing
+    t._route_cache_put("old", "k", {"routes_final": {}, "meta": {}})
+    assert "k" not in t._ROUTE_CACHE
+
+
+def test_disk_layer_survives_a_cleared_memory_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(t, "ROUTE_CACHE_DIR", str(tmp_path))
+    entry = {"routes_final": {"type": "FeatureCollection", "features": []}, "meta": {"ok": 0}}
+    t._route_cache_get("s" * 40, "k")
+    t._route_cache_put("s" * 40, "k", entry)
+    t._ROUTE_CACHE.clear()
+    assert t._route_cache_get("s" * 40, "k") == entry
+    assert t._ROUTE_STATS["disk_hits"] == 1
+
+    t._route_cache_get("x" * 40, "k")  # new stamp sweeps files of the old one
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_memory_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(t, "ROUTE_CACHE_SIZE", 3)
+    t._route_cache_get("s", "probe")
+    for k in range(5):
+        t._route_cache_put("s", f"k{k}", {"routes_final": {}, "meta": {}})
+    assert list(t._ROUTE_CACHE) == ["k2", "k3", "k4"]
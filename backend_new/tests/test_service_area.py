@@ -0,0 +1,106 @@
+import os
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from shapely.geometry import LineString
+
+from app.features import transport_agent_api as t
+from app.src.road_network import compile_graph
+
+EPS = 1e-9
+
+
+def _path_graph(weights):
+    """Nodes 0..n on the x axis; edge i joins i and i + 1"""
+    G = nx.Graph()
+    for i in range(len(weights)):
+        G.add_edge(i, i + 1, geometry=LineString([(i, 0), (i + 1, 0)]))
+    cg, _ = compile_graph(G, lambda n, d: (float(n), 0.0))
+    eid = {tuple(sorted((int(cg.node_ids[u]), int(cg.node_ids[v])))): k
+           for k, (u, v) in enumerate(zip(cg.edge_u, cg.edge_v))}
+    w = np.empty(len(weights))
+    for i, wi in enumerate(weights):
+        w[eid[(i, i + 1)]] = wi
+    pos = cg.node_pos()
+    return cg, w, pos, eid
+
+
+def _pieces(area, e):
+    sel = area["edge"] == e
+    return [dict(zip(("reverse", "lo", "hi", "start", "end", "band", "full"), vals)) for vals in zip(
+        area["reverse"][sel], area["lo"][sel], area["hi"][sel], area["start"][sel], area["end"][sel],
+        area["band"][sel], area["full"][sel],
+    )]
+
+
+@pytest.mark.parametrize("limit, covered, full", [
+    (4.0, 0.6, False),  # 3 from each side of the 10-long middle edge: a gap of 4
+    (6.0, 1.0, True),   # both sides meet exactly at cost 6
+    (9.0, 1.0, True),   # budget left over: still meet in the middle
+])
+def test_middle_edge_reached_from_both_ends(limit, covered, full):
+    cg, w, pos, eid = _path_graph([1.0, 10.0, 1.0])
+    area = cg.service_area([pos[0], pos[3]], w, limit)
+    middle = _pieces(area, eid[(1, 2)])
+    assert len(middle) == 2 and {p["reverse"] for p in middle} == {False, True}
+    assert sum(p["hi"] - p["lo"] for p in middle) == pytest.approx(covered)
+    assert all(p["full"] == full for p in middle)
+    assert all(p["end"] <= min(limit, 6.0) + EPS for p in middle)
+
+
+def test_unreached_edges_are_left_out():
+    cg, w, pos, eid = _path_graph([2.0, 2.0, 2.0])
+    area = cg.service_area([pos[0]], w, 3.0)
+    assert set(area["edge"].tolist()) == {eid[(0, 1)], eid[(1, 2)]}
+    (piece,) = _pieces(area, eid[(1, 2)])
+    assert (piece["start"], piece["end"], piece["hi"]) == pytest.approx((2.0, 3.0, 0.5))
+    assert not piece["full"]
+
+
+@pytest.mark.parametrize("breaks", [[0.5, 3.0, 6.0], [2.5], [1.0, 2.0, 3.0, 4.0]])
+def test_pieces_are_cut_at_band_thresholds(breaks):
+    cg, w, pos, eid = _path_graph([1.0, 10.0, 1.0])
+    limit = 9.0
+    area = cg.service_area([pos[0]], w, limit, breaks=breaks)
+    edges = np.r_[0.0, breaks, limit]
+    for start, end, band in zip(area["start"], area["end"], area["band"]):
+        assert edges[band] - EPS <= start < end <= edges[band + 1] + EPS
+    # cut pieces still tile the reached stretch of every edge
+    for e in np.unique(area["edge"]):
+        ps = sorted(_pieces(area, e), key=lambda p: p["lo"])
+        assert ps[0]["lo"] == pytest.approx(0.0)
+        assert all(a["hi"] == pytest.approx(b["lo"]) for a, b in zip(ps, ps[1:]))
+    middle = _pieces(area, eid[(1, 2)])
+    assert max(p["hi"] for p in middle) == pytest.approx(0.8)
+
+
+def test_costs_are_linear_along_random_pieces():
+    rng = np.random.default_rng(11)
+    G = nx.random_geometric_graph(80, 0.2, seed=5)
+    cg, _ = compile_graph(G, lambda n, d: tuple(d["pos"]))
+    w = rng.uniform(0.05, 0.3, cg.n_edges)
+    limit = 0.6
+    area = cg.service_area([0, 40], w, limit, breaks=[0.2, 0.4])
+    entry = np.where(area["reverse"], cg.edge_v[area["edge"]], cg.edge_u[area["edge"]])
+    length = w[area["edge"]]
+    np.testing.assert_allclose(area["start"], area["node_cost"][entry] + area["lo"] * length, atol=1e-9)
+    np.testing.assert_allclose(area["end"], area["node_cost"][entry] + area["hi"] * length, atol=1e-9)
+    assert (area["end"] <= limit + EPS).all()
+
+
+def test_isochrone_bands_match_piece_costs(monkeypatch):
+    monkeypatch.setattr(t, "NETWORK_BUNDLE", "")
+    app = FastAPI()
+    app.include_router(t.router)
+    seed = gpd.read_file(os.path.join(t.DATA_DIR, "origins.geojson")).to_crs(4326).geometry.iloc[0]
+    r = TestClient(app).get("/transport/isochrone", params={"lon": seed.x, "lat": seed.y, "cutoff": 300, "bands": 4})
+    assert r.status_code == 200
+    feats = r.json()["edges"]["features"]
+    assert {f["properties"]["band"] for f in feats} == {1, 2, 3, 4}
+    for f in feats:
+        p = f["properties"]
+        assert (p["band"] - 1) * 75 - 1e-3 <= p["cost_start"] <= p["cost_end"] <= p["band"] * 75 + 1e-3
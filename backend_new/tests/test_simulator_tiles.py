@@ -0,0 +1,89 @@
+import json
+import threading
+
+import mapbox_vector_tile
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pyproj import Transformer
+
+import app.routers.simulator as sim
+
+
+def _square(lon, lat, d=0.0005):
+    return {"type": "Polygon", "coordinates": [[[lon, lat], [lon + d, lat], [lon + d, lat + d], [lon, lat + d], [lon, lat]]]}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    data = tmp_path / "buildings.geojson"
+    data.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": _square(47.074 + i * 0.001, 34.318), "properties": {"Landuse": lu}}
+        for i, lu in enumerate([1, 5, 2, 7])
+    ]}))
+    monkeypatch.setattr(sim, "DATA", data)
+    monkeypatch.setattr(sim, "OUT_HTML", tmp_path / "simulation_map.html")
+    monkeypatch.setattr(sim, "OUT_LOG", tmp_path / "simulation_log.csv")
+    monkeypatch.setattr(sim, "_JOBS", type(sim._JOBS)())
+    sim._buildings_mercator.cache_clear()
+    sim._render_tile.cache_clear()
+    app = FastAPI()
+    app.include_router(sim.router, prefix="/simulator")
+    yield TestClient(app)
+    sim._buildings_mercator.cache_clear()
+    sim._render_tile.cache_clear()
+
+
+def _tile_of(lon, lat, z=16):
+    x, y = Transformer.from_crs(4326, 3857, always_xy=True).transform(lon, lat)
+    size = 2 * sim.WEB_MERCATOR_HALF / (1 << z)
+    return z, int((x + sim.WEB_MERCATOR_HALF) // size), int((sim.WEB_MERCATOR_HALF - y) // size)
+
+
+def test_tiles_carry_each_steps_landuse(client):
+    body = client.post("/simulator/run", json={"steps": 3, "seed": 1}).json()
+    z, x, y = _tile_of(47.0742, 34.3182)
+    for step in range(3):
+        r = client.get(f"/simulator/tiles/{body['job_id']}/{step}/{z}/{x}/{y}.pbf")
+        assert r.status_code == 200
+        feats = mapbox_vector_tile.decode(r.content)[sim.TILE_LAYER]["features"]
+        frames = sim._job_frames(body["job_id"])
+        assert {f["properties"]["fid"]: f["properties"]["landuse"] for f in feats} == {
+            f["properties"]["fid"]: int(frames[step][f["properties"]["fid"]]) for f in feats
+        }
+    assert client.get(f"/simulator/tiles/{body['job_id']}/3/{z}/{x}/{y}.pbf").status_code == 404
+    assert client.get(f"/simulator/tiles/unknown/0/{z}/{x}/{y}.pbf").status_code == 404
+
+
+def test_steps_are_bounded(client):
+    assert client.post("/simulator/run", json={"steps": 0}).status_code == 422
+    assert client.post("/simulator/run", json={"steps": sim.MAX_STEPS + 1}).status_code == 422
+
+
+def test_map_html_is_rendered_by_default_and_never_stale(client):
+    body = client.post("/simulator/run", json={"steps": 2}).json()
+    assert body["html_url"] == "/simulator/map"
+    assert client.get("/simulator/map").status_code == 200
+
+    body = client.post("/simulator/run", json={"steps": 2, "render_html": False}).json()
+    assert "html_url" not in body
+    assert client.get("/simulator/map").status_code == 404
+
+
+def test_evicted_jobs_answer_404_under_concurrency(client, monkeypatch):
+    monkeypatch.setattr(sim, "MAX_JOBS", 2)
+    jobs = [client.post("/simulator/run", json={"steps": 1, "render_html": False}).json()["job_id"]]
+    z, x, y = _tile_of(47.0742, 34.3182)
+    codes = []
+
+    def fetch():
+        for _ in range(20):
+            codes.append(client.get(f"/simulator/tiles/{jobs[0]}/0/{z}/{x}/{y}.pbf").status_code)
+
+    reader = threading.Thread(target=fetch)
+    reader.start()
+    for _ in range(4):
+        client.post("/simulator/run", json={"steps": 1, "render_html": False})
+    reader.join()
+    assert set(codes) <= {200, 404}
+    assert len(sim._JOBS) == 2
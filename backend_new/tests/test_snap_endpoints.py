@@ -0,0 +1,75 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Point
+
+from app.src import simulate_agent as sa
+from app.src.road_network import cluster_within
+
+CRS = 3857
+
+
+def _roads(*lines):
+    return gpd.GeoDataFrame({"User": [1] * len(lines)}, geometry=list(lines), crs=CRS)
+
+
+def _nodes(*points):
+    index = range(1, len(points) + 1)
+    return gpd.GeoDataFrame({"User": [1] * len(points)}, geometry=gpd.GeoSeries(list(points), index=index),
+                            index=index, crs=CRS)
+
+
+def _graph(roads, nodes, snap=sa.SNAP_RAD_NODE):
+    G, nodes_allowed, edges, _, _ = sa.build_graph(roads, nodes, None, None, snap_rad_node=snap)
+    return G, nodes_allowed, edges
+
+
+def test_short_segments_in_a_row_stay_separate_edges():
+    G, _, _ = _graph(_roads(LineString([(0, 0), (10, 0)]), LineString([(10, 0), (20, 0)]),
+                                LineString([(20, 0), (30, 0)])), _nodes())
+    assert G.number_of_edges() == 3
+    assert G.number_of_nodes() == 4
+    assert sorted(d for _, d in G.degree()) == [1, 1, 2, 2]
+
+
+def test_edge_geometry_ends_stay_within_snap_radius_of_their_nodes():
+    rng = np.random.default_rng(3)
+    lines = []
+    for _ in range(60):
+        a = rng.uniform(0, 200, 2)
+        lines.append(LineString([a, a + rng.uniform(-12, 12, 2)]))
+    G, nodes_allowed, _ = _graph(_roads(*lines), _nodes(Point(100, 100)))
+    pos = nodes_allowed.geometry
+    for u, v, d in G.edges(data=True):
+        ends = shapely.get_coordinates(d["geometry"])[[0, -1]]
+        gap = min(
+            Point(ends[0]).distance(pos[u]) + Point(ends[1]).distance(pos[v]),
+            Point(ends[0]).distance(pos[v]) + Point(ends[1]).distance(pos[u]),
+        )
+        assert gap <= 2 * sa.SNAP_RAD_NODE
+
+
+def test_nearby_loose_ends_join_and_existing_nodes_win():
+    G, nodes_allowed, _ = _graph(
+        _roads(LineString([(0, 0), (50, 0)]), LineString([(53, 0), (100, 0)]), LineString([(104, 2), (150, 0)])),
+        _nodes(Point(101, 0)),
+    )
+    assert G.number_of_edges() == 3
+    assert G.degree(1) == 2  # both ends near (101, 0) use the existing node
+    assert len(nodes_allowed) == 4
+
+
+def test_cluster_within_does_not_chain():
+    xy = np.column_stack([np.arange(0, 60, 10.0), np.zeros(6)])
+    label = cluster_within(xy, 15.0)
+    for k in np.unique(label):
+        members = xy[label == k]
+        assert np.ptp(members[:, 0]) <= 15.0
+    assert len(np.unique(label)) == 3
+
+
+def test_cluster_within_keeps_groups_apart():
+    xy = np.array([[0.0, 0.0], [1.0, 0.0], [2.0, 0.0]])
+    assert len(np.unique(cluster_within(xy, 5.0))) == 1
+    label = cluster_within(xy, 5.0, groups=np.array([0, 0, 1]))
+    assert label[0] != label[1]
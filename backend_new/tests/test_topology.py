@@ -0,0 +1,69 @@
+import pytest
+import shapely
+from shapely.geometry import LineString, MultiLineString
+
+from app.src.road_network import build_topology
+
+
+def _edges(topo):
+    return sorted(tuple(sorted(map(tuple, topo.xy[[u, v]].round(6).tolist())))
+                  for u, v in zip(topo.edge_u, topo.edge_v))
+
+
+def test_topology_splits_crossings():
+    topo = build_topology([LineString([(0, 0), (10, 0)]), LineString([(5, -5), (5, 5)])])
+    assert len(topo.xy) == 5 and len(topo.edge_u) == 4
+    assert ((5.0, 0.0) in map(tuple, topo.xy.tolist()))
+
+
+def test_topology_keeps_crossings_without_noding():
+    topo = build_topology([LineString([(0, 0), (10, 0)]), LineString([(5, -5), (5, 5)])],
+                          node_crossings=False)
+    assert len(topo.xy) == 4 and len(topo.edge_u) == 2
+
+
+def test_topology_crossing_on_other_level_is_not_a_junction():
+    lines = [LineString([(0, 0), (10, 0)]), LineString([(5, -5), (5, 5)]), LineString([(10, 0), (20, 0)])]
+    topo = build_topology(lines, levels=[0, 1, 0])
+    assert len(topo.edge_u) == 3
+    assert (5.0, 0.0) not in map(tuple, topo.xy.tolist())
+
+
+def test_topology_merges_endpoints_within_tolerance():
+    lines = [LineString([(0, 0), (10, 0)]), LineString([(10.3, 0), (20, 0)]), LineString([(20.4, 0.2), (30, 0)])]
+    topo = build_topology(lines, snap_tol=0.5, node_crossings=False)
+    assert len(topo.xy) == 4 and len(topo.edge_u) == 3
+    assert topo.edge_v[0] == topo.edge_u[1] and topo.edge_v[1] == topo.edge_u[2]
+
+    apart = build_topology(lines, snap_tol=0.1, node_crossings=False)
+    assert len(apart.xy) == 6
+
+
+def test_topology_keeps_shortest_parallel_edge():
+    short = LineString([(0, 0), (10, 0)])
+    long = LineString([(0, 0), (5, 5), (10, 0)])
+    topo = build_topology([long, short, LineString([(10, 0), (0, 0)])], node_crossings=False)
+    assert len(topo.edge_u) == 1
+    assert shapely.length(topo.edge_geoms[0]) == pytest.approx(10.0)
+
+
+def test_topology_drops_self_loops_and_degenerate_lines():
+    lines = [
+        LineString([(0, 0), (5, 5), (5, 0), (0, 0)]),  # closed ring
+        LineString([(20, 0), (20.2, 0)]),  # collapses within tolerance
+        LineString([(30, 0), (30, 0)]),  # zero length
+        LineString([(0, 10), (10, 10)]),
+    ]
+    topo = build_topology(lines, snap_tol=0.5, node_crossings=False)
+    assert _edges(topo) == [((0.0, 10.0), (10.0, 10.0))]
+
+
+def test_topology_explodes_multilinestrings():
+    multi = MultiLineString([[(0, 0), (10, 0)], [(10, 0), (10, 10)]])
+    topo = build_topology([multi, None])
+    assert len(topo.edge_u) == 2 and len(topo.xy) == 3
+
+
+def test_topology_empty_input():
+    topo = build_topology([])
+    assert len(topo.xy) == 0 and len(topo.edge_u) == 0